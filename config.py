@@ -1,5 +1,6 @@
 import datetime as dt
 import os
+import threading
 from typing import Union, Optional
 
 from pytz import timezone
@@ -16,7 +17,35 @@ class Config:
     PROJECT_ROOT = os.getcwd()
     APP_ROOT = os.path.join(PROJECT_ROOT, "fs_flask")
     DOWNLOAD_PATH = os.path.join(os.path.abspath(os.sep), "tmp")
+    CACHE_PATH = os.path.join(DOWNLOAD_PATH, "files")
+    CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES") or 256 * 1024 * 1024)
+    CACHE_VALIDATE_AFTER = 60  # seconds a cached cloud storage file is served without checking its generation
+    BACKUP_PATH = os.path.join(PROJECT_ROOT, "backup")
+    JOB_PATH = os.path.join(PROJECT_ROOT, "jobs")
+    BACKUP_OVERLAP = 300  # seconds re-exported before the checkpoint to cover clock skew between writers
+    REPLICA_ENABLED = os.environ.get("REPLICA_ENABLED") == "true"
+    REPLICA_PATH = os.environ.get("REPLICA_PATH") or os.path.join(DOWNLOAD_PATH, "replica.sqlite3")
+    REPLICA_MAX_AGE = 3600  # 1 hour = 3600 seconds
+    SHEET_LEDGER_PATH = os.environ.get("SHEET_LEDGER_PATH") or os.path.join(DOWNLOAD_PATH, "sheets.sqlite3")
+    SHEET_SWEEP_INTERVAL = 30  # seconds between deletions of the released sheets
+    SHEET_MAX_AGE = 3600  # seconds after which a temporary sheet which was never released is deleted
+    SHEET_ORPHAN_INTERVAL = 6 * 3600  # seconds between the scans of Drive for orphan sheets
+    SHEET_ORPHAN_AGE = 24 * 3600  # seconds after which a temporary sheet on Drive is an orphan. Above SHEET_MAX_AGE.
+    TEMPLATE_POOL_SIZE = int(os.environ.get("TEMPLATE_POOL_SIZE") or 3)  # ready copies of the template per worker
+    TEMPLATE_POOL_MAX_AGE = 1800  # seconds a ready copy is used. Must be less than SHEET_MAX_AGE.
+    TEMPLATE_POOL_WINDOW = 900  # seconds of recent demand which decide the number of ready copies
+    TEMPLATE_POOL_INTERVAL = 60  # seconds between the checks of the template version
     TOKEN_EXPIRY = 3600  # 1 hour = 3600 seconds
+    GOOGLE_POOL_SIZE = int(os.environ.get("GOOGLE_POOL_SIZE") or 10)  # keep-alive connections per host per worker
+    GOOGLE_TIMEOUT = 120  # seconds
+    GOOGLE_BACKEND = os.environ.get("GOOGLE_BACKEND") or "google"  # "local" for stand-ins of Sheets, Drive, Storage
+    LOCAL_GOOGLE_PATH = os.environ.get("LOCAL_GOOGLE_PATH") or os.path.join(DOWNLOAD_PATH, "local-google")
+    LOCAL_GOOGLE_LATENCY = float(os.environ.get("LOCAL_GOOGLE_LATENCY") or 0.05)  # seconds per stand-in call
+    FIRESTORE_BACKEND = os.environ.get("FIRESTORE_BACKEND") or "google"  # "memory" for a Firestore in the process
+    FIRESTORE_MEMORY_LATENCY = float(os.environ.get("FIRESTORE_MEMORY_LATENCY") or 0)  # seconds per memory call
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED") != "false"
+    QUERY_AUDIT = os.environ.get("QUERY_AUDIT") == "true"  # diagnostic mode to detect queries made in loops
+    QUERY_AUDIT_THRESHOLD = 3  # same shape queries with different values reported as a query in a loop
     # noinspection SpellCheckingInspection
     MIME_TYPES = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
     # noinspection SpellCheckingInspection
@@ -64,15 +93,20 @@ class BaseMap:
 
 
 class Date:
-    TODAY = None
     INDIA_TIME_ZONE = timezone("Asia/Kolkata")
+    _LOCAL = threading.local()  # today is pinned per thread so that a pinned date never leaks into other requests
 
     def __init__(self, date: Union[dt.date, str] = None):
         self._date = date if date is not None else self.today()
 
     @classmethod
     def today(cls) -> dt.date:
-        return cls.TODAY or dt.datetime.now(tz=cls.INDIA_TIME_ZONE).date()
+        return getattr(cls._LOCAL, "today", None) or dt.datetime.now(tz=cls.INDIA_TIME_ZONE).date()
+
+    @classmethod
+    def set_today(cls, date: Optional[dt.date]) -> None:
+        # Pins today in the current thread for scripts and tests. None restores the clock.
+        cls._LOCAL.today = date
 
     @classmethod
     def yesterday(cls) -> dt.date:
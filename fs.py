@@ -1,15 +1,20 @@
 import csv
 import datetime as dt
+import gzip
+import json
+import os
 import time
-from concurrent.futures import as_completed, ThreadPoolExecutor
-# noinspection PyPackageRequirements
-from copy import deepcopy
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Dict, Set, Tuple, NamedTuple, Optional
 
-from googleapiclient.discovery import build
+from firestore_ci import FirestoreQuery
 
 from config import Config, Date
+from fs_flask.change_feed import Change, read_changes, DELETE
+from fs_flask.db_methods import stream, batch_create, batch_save, batch_update, utc_now
+from fs_flask.google_clients import sheets_service
 from fs_flask.hotel import Hotel
+from fs_flask.replica import replica
 from fs_flask.usage import Usage
 from fs_flask.user import User
 
@@ -38,7 +43,7 @@ def create_user(email: str, name: str, role: str, hotel_name_input: str = str(),
 
 
 def mumbai_hotels():
-    sheet = build("sheets", "v4").spreadsheets().values()
+    sheet = sheets_service().spreadsheets().values()
     hotel_table = sheet.get(spreadsheetId=Config.SHEET_ID, range="Hotels!A1:Z39").execute().get("values", list())
     hotel_dict = {str(index): {"name": hotel, "rooms": list(), "competitions": list()}
                   for index, hotel in enumerate(hotel_table[0])}
@@ -66,7 +71,7 @@ def mumbai_hotels():
 
 
 def mumbai_usage():
-    sheet = build("sheets", "v4").spreadsheets().values()
+    sheet = sheets_service().spreadsheets().values()
     hotel_table = sheet.get(spreadsheetId=Config.SHEET_ID, range="Usage!A1:H5100").execute().get("values", list())
     hotels = Hotel.objects.filter_by(city="Mumbai").get()
     hotel_names = [hotel.name for hotel in hotels]
@@ -120,159 +125,379 @@ def mumbai_usage():
     # Usage.create_from_list_of_dict(usages)
     end = time.perf_counter() - start
     print(f"{len(usages)} occupancy records created in {end:0.2f} seconds")
-    Hotel.save_all(hotels)
+    batch_save(hotels)
     print(f"{len(hotels)} hotel occupancy updated")
 
 
-def mumbai_no_event():
-    start_date = "2020-01-01"
-    end_date = "2020-03-31"
-    city = "Mumbai"
-    query = Usage.objects.filter_by(city=city).filter("date", ">=", start_date)
-    usage_data = query.filter("date", "<=", end_date).get()
-    usage_data.sort(key=lambda usage: (usage.hotel, usage.date))
-    hotels = Hotel.objects.get()
+def fill_no_events(city: str, start_date: Union[str, dt.date], end_date: Union[str, dt.date],
+                   hotel_names: List[str] = None, dry_run: bool = True):
+    if city not in Config.CITIES:
+        print("Invalid city")
+        return
+    start, end = Date(start_date).date, Date(end_date).date
+    if not start or not end or start > end:
+        print("Invalid date range")
+        return
+    hotels: List[Hotel] = Hotel.objects.filter_by(city=city).get()
+    if hotel_names:
+        hotels = [hotel for hotel in hotels if hotel.name in hotel_names]
+        missing_hotels = set(hotel_names) - {hotel.name for hotel in hotels}
+        if missing_hotels:
+            print(f"Hotels not found in {city}: {', '.join(sorted(missing_hotels))}")
+    query = Usage.objects.filter_by(city=city)
+    query = query.filter("date", ">=", Date(start).db_date).filter("date", "<=", Date(end).db_date)
+    occupied = {(usage.hotel, usage.date, usage.timing)
+                for usage in stream(query, fields=["hotel", "date", "timing"])}
     no_events = list()
-    start_date = Date(start_date).date
-    days = (Date(end_date).date - start_date).days + 1
-    periods = [(day, timing) for day in range(days) for timing in Config.TIMINGS]
-    for day, timing in periods:
-        date = start_date + dt.timedelta(days=day)
-        date = Date(date).db_date
-        date_usages = [usage for usage in usage_data if usage.date == date and usage.timing == timing]
-        for hotel in hotels:
-            if any(usage.hotel == hotel.name for usage in date_usages):
-                continue
-            usage = Usage()
-            usage.hotel = hotel.name
-            usage.city = city
-            usage.set_date(Date(date).date)
-            usage.timing = timing
-            usage.no_event = True
-            no_events.append(usage.doc_to_dict())
-    for usage in no_events:
-        print(usage)
-    # Usage.create_from_list_of_dict(no_events)
+    for hotel in hotels:
+        contract_start, contract_end = hotel.contract
+        last_date = Date(hotel.last_date).date
+        if not contract_start or not contract_end or not last_date:
+            print(f"{hotel} skipped as it does not have a valid contract or data entry")
+            continue
+        # Gaps are only filled till the last data entry period of the hotel
+        date = max(start, contract_start)
+        fill_till = min(end, contract_end, last_date)
+        hotel_no_events = 0
+        while date <= fill_till:
+            db_date = Date(date).db_date
+            for timing in Config.TIMINGS:
+                if date == last_date and timing == Config.EVENING and hotel.last_timing != Config.EVENING:
+                    continue
+                if (hotel.name, db_date, timing) in occupied:
+                    continue
+                usage = Usage()
+                usage.hotel = hotel.name
+                usage.city = city
+                usage.set_date(date)
+                usage.timing = timing
+                usage.no_event = True
+                no_events.append(usage.doc_to_dict())
+                hotel_no_events += 1
+            date += dt.timedelta(days=1)
+        if hotel_no_events:
+            print(f"{hotel.name} has {hotel_no_events} periods without events")
+    if dry_run:
+        print(f"{len(no_events)} no events to be created (dry run)")
+        return
+    batch_create(Usage, no_events)
     print(f"{len(no_events)} no events created")
 
 
-def check_room(hotel: Hotel, ballroom: str):
-    query = Usage.objects.filter_by(city=hotel.city, hotel=hotel.name)
-    usage = query.filter('ballrooms', Usage.objects.ARRAY_CONTAINS, ballroom).first()
-    used = True if usage else False
-    changed = hotel.set_ballroom_used([ballroom], used)
-    return hotel, ballroom, changed
+def used_ballrooms(city: str) -> Tuple[List[Hotel], Dict[str, Set[str]]]:
+    hotels: List[Hotel] = Hotel.objects.filter_by(city=city).get()
+    used: Dict[str, Set[str]] = {hotel.name: set() for hotel in hotels}
+    query = Usage.objects.filter_by(city=city, no_event=False)
+    for usage in stream(query, fields=["hotel", "ballrooms"]):
+        used.setdefault(usage.hotel, set()).update(usage.ballrooms)
+    return hotels, used
 
 
-def update_ballroom_maps(workers: int = 200):
-    hotels = Hotel.objects.get()
+def update_ballroom_maps(cities: List[str] = None, dry_run: bool = False):
+    cities = cities or list(Config.CITIES)
     start = time.perf_counter()
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        threads = [executor.submit(check_room, hotel, room)
-                   for hotel in hotels for room in hotel.ballrooms]
-        rooms = [future.result() for future in as_completed(threads)]
+    with ThreadPoolExecutor(max_workers=len(cities)) as executor:
+        city_ballrooms = list(executor.map(used_ballrooms, cities))
     end = time.perf_counter() - start
-    print(f"{len(rooms)} checked in {end:0.2f} seconds")
-    updated_hotels = {room[0].name for room in rooms if room[2]}
-    hotels = [hotel for hotel in hotels if hotel.name in updated_hotels]
-    if hotels:
-        Hotel.save_all(hotels)
-    print(f"{len(hotels)} updated")
-
-
-def hotel_backup():
-    for city in list(Config.CITIES):
-        hotels = Hotel.objects.filter_by(city=city).get()
-        file_name = f"Hotels-{city}.csv"
-        with open(file_name, "w", newline="", encoding="utf-8") as csv_file:
-            field_names = list(Hotel().doc_to_dict())
-            writer = csv.DictWriter(csv_file, fieldnames=field_names)
-            writer.writeheader()
-            for hotel in hotels:
-                writer.writerow(hotel.doc_to_dict())
-        print(f"{file_name} created with {len(hotels)} rows")
+    updated_hotels = list()
+    for hotels, used in city_ballrooms:
+        for hotel in hotels:
+            rooms_used = used[hotel.name]
+            changed = hotel.set_ballroom_used([room for room in hotel.ballrooms if room in rooms_used])
+            changed = hotel.set_ballroom_used([room for room in hotel.ballrooms if room not in rooms_used], False) \
+                or changed
+            if changed:
+                print(f"{hotel.city} {hotel.name} ballrooms used {sorted(rooms_used)}")
+                updated_hotels.append(hotel)
+    checked = sum(len(hotels) for hotels, _ in city_ballrooms)
+    print(f"{checked} hotels of {len(cities)} cities checked in {end:0.2f} seconds")
+    if dry_run:
+        print(f"{len(updated_hotels)} to be updated (dry run)")
+        return
+    batch_save(updated_hotels)
+    print(f"{len(updated_hotels)} updated")
+
+
+def read_backup_checkpoint() -> Dict[str, str]:
+    file_path = os.path.join(Config.BACKUP_PATH, "checkpoint.json")
+    if not os.path.exists(file_path):
+        return dict()
+    with open(file_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def write_backup_checkpoint(name: str, started_at: dt.datetime) -> None:
+    checkpoint = read_backup_checkpoint()
+    checkpoint[name] = started_at.isoformat()
+    with open(os.path.join(Config.BACKUP_PATH, "checkpoint.json"), "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=2)
+
+
+def backup_since(name: str) -> Optional[dt.datetime]:
+    checkpoint = read_backup_checkpoint().get(name)
+    if not checkpoint:
+        return None
+    return dt.datetime.fromisoformat(checkpoint) - dt.timedelta(seconds=Config.BACKUP_OVERLAP)
+
+
+def write_backup(file_name: str, query: FirestoreQuery, field_names: List[str]) -> Tuple[str, int]:
+    # Documents are streamed straight into gzip CSV and JSONL files without being held in memory
+    csv_path = os.path.join(Config.BACKUP_PATH, f"{file_name}.csv.gz")
+    jsonl_path = os.path.join(Config.BACKUP_PATH, f"{file_name}.jsonl.gz")
+    rows = 0
+    with gzip.open(csv_path, "wt", newline="", encoding="utf-8") as csv_file, \
+            gzip.open(jsonl_path, "wt", encoding="utf-8") as jsonl_file:
+        writer = csv.DictWriter(csv_file, fieldnames=["id"] + field_names)
+        writer.writeheader()
+        for document in stream(query):
+            doc_dict = document.doc_to_dict()
+            doc_dict["id"] = document.id
+            writer.writerow(doc_dict)
+            jsonl_file.write(json.dumps(doc_dict, default=str) + "\n")
+            rows += 1
+    if not rows:
+        os.remove(csv_path)
+        os.remove(jsonl_path)
+    return file_name, rows
+
+
+def run_backup(shards: List[Tuple[str, FirestoreQuery]], field_names: List[str], workers: int) -> int:
+    os.makedirs(Config.BACKUP_PATH, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        threads = [executor.submit(write_backup, file_name, query, field_names) for file_name, query in shards]
+        results = [thread.result() for thread in threads]
+    for file_name, rows in results:
+        if rows:
+            print(f"{file_name} created with {rows} rows")
+    return sum(rows for _, rows in results)
+
+
+def write_tombstones(file_name: str, collection: str, since: dt.datetime, until: dt.datetime) -> int:
+    # The exports only contain documents which still exist, so the ids deleted between the two checkpoints are read
+    # from the change feed into a file of their own
+    path = os.path.join(Config.BACKUP_PATH, f"{file_name}.csv.gz")
+    rows = 0
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["id", "city", "hotel", "date", "deleted_at"])
+        changes: List[Change] = read_changes(since)
+        while changes:
+            for change in changes:
+                if change.collection == collection and change.operation == DELETE:
+                    writer.writerow([change.doc_id, change.city, change.hotel, change.date,
+                                     change.committed_at.isoformat()])
+                    rows += 1
+            if changes[-1].committed_at >= until:
+                break
+            changes = read_changes(changes[-1].committed_at)
+    if not rows:
+        os.remove(path)
+        return rows
+    print(f"{file_name} created with {rows} rows")
+    return rows
+
+
+def hotel_backup(full: bool = False, workers: int = 4):
+    # Hotels without updated_at i.e. written before it was added are only exported by a full backup, so a full backup
+    # is required once. Later runs export the hotels changed since the last run and a file of the deleted hotels.
+    started_at = utc_now()
+    since = None if full else backup_since("hotels")
+    shards = list()
+    for city in Config.CITIES:
+        if since:
+            query = Hotel.objects.filter_by(city=city).filter("updated_at", ">", since)
+            shards.append((f"Hotels-{city}-{started_at:%Y%m%d%H%M%S}", query))
+        else:
+            shards.append((f"Hotels-{city}", Hotel.objects.filter_by(city=city)))
+    rows = run_backup(shards, list(Hotel().doc_to_dict()), workers)
+    if since:
+        write_tombstones(f"Hotels-deleted-{started_at:%Y%m%d%H%M%S}", Hotel.COLLECTION, since, started_at)
+    write_backup_checkpoint("hotels", started_at)
+    print(f"{rows} hotels backed up {f'since {since:%d-%b-%Y %H:%M}' if since else 'in full'}")
     return
 
 
-def event_backup(month: str):
-    events = Usage.objects.filter_by(month=month).get()
-    if not events:
-        print("No events found")
+def month_range(start_month: str, end_month: str) -> List[str]:
+    months = list()
+    month = dt.datetime.strptime(start_month, "%Y-%m").date()
+    last_month = dt.datetime.strptime(end_month, "%Y-%m").date()
+    while month <= last_month:
+        months.append(month.strftime("%Y-%m"))
+        month = (month + dt.timedelta(days=32)).replace(day=1)
+    return months
+
+
+def month_shards(start_month: str, end_month: str) -> List[Tuple[str, FirestoreQuery]]:
+    months = month_range(start_month, end_month)
+    return [(f"Events-{city}-{month}", Usage.objects.filter_by(city=city, month=month))
+            for city in Config.CITIES for month in months]
+
+
+def event_backup(month: str, end_month: str = str(), workers: int = 8):
+    # Exports the events of the month (or of the months up to the end month). The checkpoint is not changed.
+    try:
+        shards = month_shards(month, end_month or month)
+    except ValueError:
+        print("Invalid month. Month should be in YYYY-MM format")
         return
-    events.sort(key=lambda item: (item.city, item.hotel, item.date))
-    file_name = f"Events-{month}.csv"
-    with open(file_name, "w", newline="", encoding="utf-8") as csv_file:
-        field_names = list(Usage().doc_to_dict())
-        writer = csv.DictWriter(csv_file, fieldnames=field_names)
-        writer.writeheader()
-        for event in events:
-            writer.writerow(event.doc_to_dict())
-    print(f"{file_name} created with {len(events)} rows")
+    rows = run_backup(shards, list(Usage().doc_to_dict()), workers)
+    print(f"{rows} events backed up" if rows else "No events found")
     return
 
 
-def update_data_entry_dates():
-    hotels = Hotel.objects.get()
-    updated_hotels = list()
-    for hotel in hotels:
-        query = Usage.objects.filter_by(city=hotel.city, hotel=hotel.name, timing=Config.MORNING)
-        morning_usage: Usage = query.order_by("date", Usage.objects.ORDER_DESCENDING).first()
-        if not morning_usage:
-            print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                  f"does not have an morning event")
+def incremental_event_backup(start_month: str = str(), workers: int = 8):
+    # Without a start month only the events changed since the last incremental backup are exported.
+    # With a start month all the events from that month to the current month are exported.
+    # Both record the checkpoint for the next incremental backup and write a file of the events deleted since the last
+    # one. Events without updated_at i.e. written before it was added are only exported with a start month, so a run
+    # with the first month of the events is required once.
+    started_at = utc_now()
+    deleted_since = backup_since("events")
+    if start_month:
+        try:
+            shards = month_shards(start_month, Date.today().strftime("%Y-%m"))
+        except ValueError:
+            print("Invalid month. Month should be in YYYY-MM format")
             return
-        query = Usage.objects.filter_by(city=hotel.city, hotel=hotel.name)
-        evening_usage: Usage = query.filter_by(date=morning_usage.date, timing=Config.EVENING).first()
-        hotel_copy = deepcopy(hotel)
-        hotel_copy.last_date = evening_usage.date if evening_usage else morning_usage.date
-        hotel_copy.last_timing = Config.EVENING if evening_usage else Config.MORNING
-        if hotel.last_timing == Config.MORNING:
-            if morning_usage.date != hotel.last_date:
-                print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                      f"date is {hotel.last_date} but last event date is {morning_usage.date}")
-                updated_hotels.append(hotel_copy)
-            elif evening_usage:
-                print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                      f"has an evening event")
-                updated_hotels.append(hotel_copy)
-        elif hotel.last_timing == Config.EVENING:
-            if morning_usage.date != hotel.last_date:
-                print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                      f"last event date is {morning_usage.date} {Config.EVENING if evening_usage else Config.MORNING}")
-                updated_hotels.append(hotel_copy)
-            elif not evening_usage:
-                print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                      f"does not have an evening event")
-                updated_hotels.append(hotel_copy)
-            elif evening_usage.date != hotel.last_date:
-                print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                      f"last event date is {evening_usage.date} - Evening")
-                updated_hotels.append(hotel_copy)
-        else:
-            print(f"{hotel.city} {hotel.name} {hotel.last_date} {hotel.last_timing} "
-                  f"has an invalid last timing")
-            updated_hotels.append(hotel_copy)
-    Hotel.save_all(updated_hotels)
-    print(f"{len(updated_hotels)} of {len(hotels)} updated")
+        since = None
+    else:
+        since = deleted_since
+        if not since:
+            print("No checkpoint found. Run an incremental backup with a start month first")
+            return
+        shards = [(f"Events-{city}-{started_at:%Y%m%d%H%M%S}",
+                   Usage.objects.filter_by(city=city).filter("updated_at", ">", since)) for city in Config.CITIES]
+    rows = run_backup(shards, list(Usage().doc_to_dict()), workers)
+    if not rows:
+        print("No events found")
+    if deleted_since:
+        write_tombstones(f"Events-deleted-{started_at:%Y%m%d%H%M%S}", Usage.COLLECTION, deleted_since, started_at)
+    write_backup_checkpoint("events", started_at)
+    print(f"{rows} events backed up {f'since {since:%d-%b-%Y %H:%M}' if since else 'in full'}")
     return
 
 
-def rename_hotel(old_name: str, new_name: str, city: str):
+class LastEntryDiff(NamedTuple):
+    city: str
+    hotel: str
+    last_date: str
+    last_timing: str
+    new_date: str
+    new_timing: str
+
+
+def last_event_dates(city: str) -> Tuple[List[Hotel], Dict[str, Dict[str, str]]]:
+    hotels: List[Hotel] = Hotel.objects.filter_by(city=city).get()
+    last_dates: Dict[str, Dict[str, str]] = {hotel.name: dict() for hotel in hotels}
+    for usage in stream(Usage.objects.filter_by(city=city), fields=["hotel", "date", "timing"]):
+        timing_dates = last_dates.setdefault(usage.hotel, dict())
+        if usage.date > timing_dates.get(usage.timing, str()):
+            timing_dates[usage.timing] = usage.date
+    return hotels, last_dates
+
+
+def update_data_entry_dates(cities: List[str] = None, dry_run: bool = False) -> Tuple[List[LastEntryDiff], List[str]]:
+    cities = cities or list(Config.CITIES)
+    with ThreadPoolExecutor(max_workers=len(cities)) as executor:
+        city_dates = list(executor.map(last_event_dates, cities))
+    diffs: List[LastEntryDiff] = list()
+    problems: List[str] = list()
+    updated_hotels: List[Hotel] = list()
+    for hotels, last_dates in city_dates:
+        for hotel in hotels:
+            morning_date = last_dates[hotel.name].get(Config.MORNING)
+            evening_date = last_dates[hotel.name].get(Config.EVENING)
+            if not morning_date:
+                problems.append(f"{hotel.city} {hotel.name} does not have an morning event")
+                continue
+            if evening_date and evening_date > morning_date:
+                problems.append(f"{hotel.city} {hotel.name} has an evening event on {evening_date} "
+                                f"without a morning event")
+                continue
+            last_timing = Config.EVENING if evening_date == morning_date else Config.MORNING
+            if (hotel.last_date, hotel.last_timing) == (morning_date, last_timing):
+                continue
+            diffs.append(LastEntryDiff(hotel.city, hotel.name, hotel.last_date, hotel.last_timing, morning_date,
+                                       last_timing))
+            hotel.last_date, hotel.last_timing = morning_date, last_timing
+            updated_hotels.append(hotel)
+    for diff in diffs:
+        print(f"{diff.city} {diff.hotel} {diff.last_date} {diff.last_timing} -> {diff.new_date} {diff.new_timing}")
+    for problem in problems:
+        print(f"Skipped: {problem}")
+    checked = sum(len(hotels) for hotels, _ in city_dates)
+    if dry_run:
+        print(f"{len(diffs)} of {checked} to be updated (dry run). {len(problems)} skipped.")
+        return diffs, problems
+    batch_save(updated_hotels)
+    print(f"{len(diffs)} of {checked} updated. {len(problems)} skipped.")
+    return diffs, problems
+
+
+def rename_hotel(old_name: str, new_name: str, city: str, chunk_size: int = 500):
+    # The hotel is renamed in chunks and the hotel document is renamed last.
+    # An interrupted rename is resumed by running it again with the same names.
+    os.makedirs(Config.JOB_PATH, exist_ok=True)
+    progress_path = os.path.join(Config.JOB_PATH, f"rename-{city}-{old_name}.json")
+    progress = {"new_name": new_name, "events": 0, "users": 0, "hotels": 0}
+    if os.path.exists(progress_path):
+        with open(progress_path) as progress_file:
+            progress = json.load(progress_file)
+        if progress["new_name"] != new_name:
+            print(f"Rename of {old_name} to {progress['new_name']} is in progress. Complete it first.")
+            return
+        print(f"Resuming rename of {old_name} to {new_name}. {progress['events']} events already updated.")
+
+    def save_progress():
+        with open(progress_path, "w") as output_file:
+            json.dump(progress, output_file, indent=2)
+
     hotel: Hotel = Hotel.objects.filter_by(name=old_name, city=city).first()
     if not hotel:
+        # The hotel document is renamed last, so a resumed rename whose hotel has the new name had only the progress
+        # file left to remove
+        if os.path.exists(progress_path) and Hotel.objects.filter_by(name=new_name, city=city).first():
+            os.remove(progress_path)
+            print(f"Hotel renamed to {new_name}. {progress['events']} events, {progress['users']} users and "
+                  f"{progress['hotels']} comp sets updated.")
+            return
         print(f"Hotel {old_name} not found.")
         return
     if Hotel.objects.filter_by(name=new_name, city=city).first():
         print(f"Hotel with the name {new_name} already exists.")
         return
+    save_progress()
+    query = Usage.objects.filter_by(hotel=old_name, city=city).limit(chunk_size)
+    while True:
+        events: List[Usage] = list(stream(query, fields=["hotel", "city", "date"]))
+        if not events:
+            break
+        progress["events"] += batch_update(events, {"hotel": new_name})
+        save_progress()
+        print(f"{progress['events']} events updated")
+    users: List[User] = User.objects.filter_by(hotel=old_name, city=city).get()
+    progress["users"] += batch_update(users, {"hotel": new_name})
+    save_progress()
+    query = Hotel.objects.filter_by(city=city)
+    comp_set_hotels = {comp_set_hotel.id: comp_set_hotel
+                       for comp_set in ("primary_hotels", "secondary_hotels")
+                       for comp_set_hotel in query.filter(comp_set, query.ARRAY_CONTAINS, old_name).get()}
+    for comp_set_hotel in comp_set_hotels.values():
+        comp_set_hotel.primary_hotels = [new_name if name == old_name else name
+                                         for name in comp_set_hotel.primary_hotels]
+        comp_set_hotel.secondary_hotels = [new_name if name == old_name else name
+                                           for name in comp_set_hotel.secondary_hotels]
+    progress["hotels"] += batch_save(list(comp_set_hotels.values()))
+    save_progress()
     hotel.name = new_name
-    events: List[Usage] = Usage.objects.filter_by(hotel=old_name, city=city).get()
-    for event in events:
-        event.hotel = new_name
     hotel.save()
-    Usage.save_all(events)
-    users: List[User] = User.objects.filter_by(hotel=old_name, city=city).get()
-    for user in users:
-        user.hotel = new_name
-    User.save_all(users)
-    print(f"Hotel renamed to {new_name}. {len(events)} events and {len(users)} users updated.")
+    os.remove(progress_path)
+    print(f"Hotel renamed to {new_name}. {progress['events']} events, {progress['users']} users and "
+          f"{progress['hotels']} comp sets updated.")
+
+
+def sync_replica(full: bool = False):
+    start = time.perf_counter()
+    usages, hotels = replica.sync(full)
+    end = time.perf_counter() - start
+    print(f"Replica {replica.path} synced with {usages} events and {hotels} hotels in {end:0.2f} seconds")
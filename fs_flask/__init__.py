@@ -3,15 +3,31 @@ from flask_login import LoginManager
 from flask_wtf import FlaskForm
 
 from config import Config
+from fs_flask.memory_firestore import MEMORY, install_memory_firestore
+
+if Config.FIRESTORE_BACKEND == MEMORY:
+    # firestore_ci is imported by the modules below and must find the memory client
+    install_memory_firestore()
+
+from fs_flask.metrics import install, timed, FORM
+from fs_flask.query_audit import query_audit
 
 fs_app: Flask = Flask(__name__)
 fs_app.config.from_object(Config)
+if Config.METRICS_ENABLED:
+    install(fs_app)
+if Config.QUERY_AUDIT:
+    query_audit.install(fs_app)
 login = LoginManager(fs_app)
 login.login_view = "login"
 login.session_protection = "strong" if Config.CI_SECURITY else "basic"
 
 
 class FSForm(FlaskForm):
+    def validate(self) -> bool:
+        with timed(FORM):
+            return super().validate()
+
     def flash_form_errors(self) -> None:
         for _, errors in self.errors.items():
             for error in errors:
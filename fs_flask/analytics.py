@@ -0,0 +1,94 @@
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+from config import Config
+from fs_flask.date_methods import Days
+from fs_flask.report_helpers import ReportAttribute
+from fs_flask.usage import Usage
+
+# Event filters of the report in the order of the rows of the kernel arrays
+EVENTS = (ReportAttribute.FULL_DAY, ReportAttribute.MORNING, ReportAttribute.EVENING, ReportAttribute.CORPORATE,
+          ReportAttribute.SOCIAL, ReportAttribute.WEEKDAY, ReportAttribute.WEEKEND)
+
+
+def get_event_masks(usages: List[Usage], events: Tuple[str, ...]) -> np.ndarray:
+    # Returns a boolean array of shape (events, usages)
+    timings = np.array([u.timing for u in usages], dtype=object)
+    event_types = np.array([u.event_type for u in usages], dtype=object)
+    weekdays = np.array([bool(u.weekday) for u in usages], dtype=bool)
+    masks = dict(zip(EVENTS, (np.ones(len(usages), dtype=bool), timings == Config.MORNING, timings == Config.EVENING,
+                              event_types == Config.MICE, event_types == Config.SOCIAL, weekdays, ~weekdays)))
+    return np.vstack([masks[event] for event in events])
+
+
+def get_timing_counts(day_counts: Days, events: Tuple[str, ...]) -> np.ndarray:
+    # Number of timings available per ballroom in the period for each event filter
+    timing_counts = dict(zip(EVENTS, (day_counts.total_days * 2, day_counts.total_days, day_counts.total_days,
+                                      day_counts.total_days * 2, day_counts.total_days * 2, day_counts.week_days * 2,
+                                      day_counts.weekend_days * 2)))
+    return np.array([timing_counts[event] for event in events], dtype=float)
+
+
+def rank(values: np.ndarray) -> np.ndarray:
+    # Competition ranking of each row in descending order i.e. equal values share a rank and the next rank is skipped.
+    # Hotels of a row without any events are not ranked and have rank 0 as in the reports before.
+    ranks = (values[:, np.newaxis, :] > values[:, :, np.newaxis]).sum(axis=2) + 1
+    return np.where((values == 0).all(axis=1, keepdims=True), 0, ranks)
+
+
+class KPIs:
+    # Event counts, occupancy ratios, ranks, comp set averages and MPI of every event filter for all hotels.
+    # The first hotel is my property and the remaining hotels are the comp set.
+
+    def __init__(self, hotels: List[str], event_filters: Tuple[str, ...], events: np.ndarray, occupancy: np.ndarray):
+        self.hotels: List[str] = hotels
+        self.event_filters: Tuple[str, ...] = event_filters
+        self.events: np.ndarray = events
+        self.occupancy: np.ndarray = occupancy
+        self.event_ranks: np.ndarray = rank(events)
+        self.occupancy_ranks: np.ndarray = rank(occupancy)
+        comp_set_count = len(hotels) - 1
+        self.event_averages: np.ndarray = events[:, 1:].sum(axis=1) / comp_set_count if comp_set_count \
+            else np.zeros(len(event_filters))
+        self.occupancy_averages: np.ndarray = occupancy[:, 1:].sum(axis=1) / comp_set_count if comp_set_count \
+            else np.zeros(len(event_filters))
+        aggregate = occupancy.mean(axis=1)
+        self.mpi: np.ndarray = np.divide(occupancy[:, 0], aggregate, out=np.zeros(len(event_filters)),
+                                         where=aggregate > 0)
+
+    def get_values(self, event: str, occupancy: bool) -> List[list]:
+        # Returns [[hotel, value]] of the event filter. Values are converted to python types for the Sheets API.
+        row = (self.occupancy if occupancy else self.events)[self.event_filters.index(event)].tolist()
+        return [[hotel, value] for hotel, value in zip(self.hotels, row)]
+
+    def get_data_point_values(self, event: str, occupancy: bool, period: str) -> List[list]:
+        # Returns [[period, my value, comp set average, my rank]] with the MPI index appended for occupancy
+        index = self.event_filters.index(event)
+        if not occupancy:
+            return [[period, self.events[index, 0].item(), self.event_averages[index].item(),
+                     self.event_ranks[index, 0].item()]]
+        return [[period, self.occupancy[index, 0].item(), self.occupancy_averages[index].item(),
+                 self.occupancy_ranks[index, 0].item(), self.mpi[index].item()]]
+
+
+def compute_kpis(usages: List[Usage], hotels: List[str], ballroom_counts: Dict[str, int], day_counts: Days,
+                 events: Tuple[str, ...] = EVENTS) -> KPIs:
+    # Events and ballroom slots are counted for every (event filter, hotel) in a single pass over the usages
+    hotel_index = {hotel: index for index, hotel in enumerate(hotels)}
+    usages = [u for u in usages if u.hotel in hotel_index]
+    shape = (len(events), len(hotels))
+    if usages:
+        masks = get_event_masks(usages, events)
+        positions = np.array([hotel_index[u.hotel] for u in usages])
+        slots = np.array([len(u.ballrooms) for u in usages], dtype=float)
+        event_rows, usage_columns = np.nonzero(masks)
+        bins = event_rows * len(hotels) + positions[usage_columns]
+        counts = np.bincount(bins, minlength=shape[0] * shape[1]).reshape(shape)
+        occupied = np.bincount(bins, weights=slots[usage_columns], minlength=shape[0] * shape[1]).reshape(shape)
+    else:
+        counts, occupied = np.zeros(shape, dtype=int), np.zeros(shape)
+    capacity = np.array([ballroom_counts.get(hotel, 0) for hotel in hotels], dtype=float)
+    total = get_timing_counts(day_counts, events)[:, np.newaxis] * capacity[np.newaxis, :]
+    occupancy = np.divide(occupied, total, out=np.zeros(shape), where=total > 0)
+    return KPIs(hotels, events, counts, occupancy)
@@ -0,0 +1,128 @@
+import datetime as dt
+from typing import List, Optional, NamedTuple
+
+import pytz
+from firestore_ci import FirestoreDocument
+# noinspection PyProtectedMember
+from firestore_ci.firestore_ci import _DB
+from google.cloud.firestore import DocumentReference, WriteBatch, SERVER_TIMESTAMP
+
+CREATE, UPDATE, DELETE = "create", "update", "delete"
+SET_DOCUMENT, UPDATE_FIELDS, DELETE_DOCUMENT = "set", "update", "delete"
+# Position of a consumer which has not read any change
+FEED_START = dt.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+class Change(FirestoreDocument):
+    # Compact record of a create, update or delete of a tracked document. The changes of a commit share its commit time.
+
+    def __init__(self):
+        super().__init__()
+        self.collection: str = str()
+        self.doc_id: str = str()
+        self.hotel: str = str()
+        self.city: str = str()
+        self.date: str = str()
+        self.operation: str = str()
+        self.committed_at: Optional[dt.datetime] = None
+
+    def __repr__(self):
+        return f"{self.committed_at}:{self.operation}:{self.collection}:{self.doc_id}:{self.city}:{self.hotel}:" \
+               f"{self.date}"
+
+    @classmethod
+    def of(cls, collection: str, doc_id: str, operation: str, hotel: str, city: str, date: str = str()) -> "Change":
+        change = cls()
+        change.collection = collection
+        change.doc_id = doc_id
+        change.operation = operation
+        change.hotel = hotel
+        change.city = city
+        change.date = date
+        return change
+
+
+Change.init()
+
+
+class ChangeCursor(FirestoreDocument):
+    # Position of a consumer in the change feed
+
+    def __init__(self):
+        super().__init__()
+        self.consumer: str = str()
+        self.position: dt.datetime = FEED_START
+
+    @classmethod
+    def for_consumer(cls, consumer: str) -> "ChangeCursor":
+        cursor: ChangeCursor = cls.get_by_id(consumer)
+        if not cursor:
+            cursor = cls()
+            cursor.consumer = consumer
+            cursor.set_id(consumer)
+        return cursor
+
+    def read(self, limit: int = 500) -> List[Change]:
+        return read_changes(self.position, limit)
+
+    def commit(self, changes: List[Change]) -> bool:
+        if not changes:
+            return False
+        self.position = max(self.position, max(change.committed_at for change in changes))
+        return self.save()
+
+
+ChangeCursor.init("change_cursors")
+
+
+class Write(NamedTuple):
+    reference: DocumentReference
+    method: str
+    data: Optional[dict] = None
+    change: Optional[Change] = None
+
+
+def _apply(batch: WriteBatch, write: Write) -> None:
+    if write.method == SET_DOCUMENT:
+        batch.set(write.reference, write.data)
+    elif write.method == UPDATE_FIELDS:
+        batch.update(write.reference, write.data)
+    else:
+        batch.delete(write.reference)
+
+
+def commit(writes: List[Write]) -> None:
+    # Change records are written in the same batch as their writes, so a change exists if and only if its write was
+    # committed. The feed is ordered by the commit time set by the server instead of a sequence counter, which would
+    # be a single document updated by every tracked write.
+    if not writes:
+        return
+    batch = _DB.batch()
+    for write in writes:
+        _apply(batch, write)
+        if not write.change:
+            continue
+        change_reference = _DB.collection(Change.COLLECTION).document()
+        write.change.set_id(change_reference.id)
+        change_dict = write.change.doc_to_dict()
+        change_dict["committed_at"] = SERVER_TIMESTAMP
+        batch.set(change_reference, change_dict)
+    batch.commit()
+
+
+def last_position() -> dt.datetime:
+    change: Optional[Change] = Change.objects.order_by("committed_at", Change.objects.ORDER_DESCENDING).first()
+    return change.committed_at if change else FEED_START
+
+
+def read_changes(after: dt.datetime, limit: int = 500) -> List[Change]:
+    # Changes committed after the position in commit order. Reads are strongly consistent, so a change committed
+    # before the last change read is never seen later. The changes of a commit are not split between two reads and the
+    # commit time of the last change read is the position of the next read.
+    query = Change.objects.filter("committed_at", ">", after).order_by("committed_at").limit(limit)
+    changes: List[Change] = query.get()
+    if len(changes) < limit:
+        return changes
+    last_committed_at = changes[-1].committed_at
+    complete = [change for change in changes if change.committed_at != last_committed_at]
+    return complete if complete else Change.objects.filter_by(committed_at=last_committed_at).get()
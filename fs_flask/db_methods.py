@@ -0,0 +1,159 @@
+import datetime as dt
+from typing import List, Iterator, Optional, Type, TypeVar
+
+import pytz
+from firestore_ci import FirestoreDocument, FirestoreQuery
+# noinspection PyProtectedMember
+from firestore_ci.firestore_ci import _DB
+from google.cloud.firestore import Query, DocumentReference
+
+from fs_flask.change_feed import Change, Write, commit, CREATE, UPDATE, DELETE, SET_DOCUMENT, UPDATE_FIELDS, \
+    DELETE_DOCUMENT
+from fs_flask.metrics import timed_call, timed_iter, FIRESTORE
+from fs_flask.query_audit import query_audit
+
+BATCH_SIZE = 500  # Maximum number of writes allowed in a single Firestore batch
+TRACKED_BATCH_SIZE = 166  # Each tracked write also writes a change record whose server timestamp is another write
+
+_Document = TypeVar("_Document", bound=FirestoreDocument)
+
+
+def utc_now() -> dt.datetime:
+    return dt.datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+
+class TrackedDocument(FirestoreDocument):
+    # Documents which record the time of their last write so that exports can pick up only the changes.
+    # Every create, update and delete is also appended to the change feed in the same batch.
+    HOTEL_FIELD = "hotel"
+
+    def __init__(self):
+        super().__init__()
+        self.updated_at: Optional[dt.datetime] = None
+
+    @property
+    def reference(self) -> DocumentReference:
+        return _DB.collection(self.COLLECTION).document(self.id)
+
+    def touch(self) -> None:
+        self.updated_at = utc_now()
+
+    def change(self, operation: str) -> Change:
+        return Change.of(self.COLLECTION, self.id, operation, getattr(self, self.HOTEL_FIELD), self.city,
+                         getattr(self, "date", str()))
+
+    def create(self) -> str:
+        self.touch()
+        self.set_id(_DB.collection(self.COLLECTION).document().id)
+        commit([Write(self.reference, SET_DOCUMENT, self.doc_to_dict(), self.change(CREATE))])
+        return self.id
+
+    def save(self, cascade: bool = False) -> bool:
+        if not self.id:
+            return False
+        self.touch()
+        commit([Write(self.reference, SET_DOCUMENT, self.doc_to_dict(), self.change(UPDATE))])
+        return True
+
+    def delete(self, cascade: bool = False) -> str:
+        if not self.id:
+            return str()
+        commit([Write(self.reference, DELETE_DOCUMENT, change=self.change(DELETE))])
+        doc_id = self.id
+        self.set_id(None)
+        return doc_id
+
+
+def chunks(items: list, size: int = BATCH_SIZE) -> Iterator[list]:
+    for index in range(0, len(items), size):
+        yield items[index: index + size]
+
+
+def _query_ref(query: FirestoreQuery) -> Query:
+    # noinspection PyProtectedMember
+    return query._doc_ref if query._query_ref is None else query._query_ref
+
+
+def stream(query: FirestoreQuery, fields: Optional[List[str]] = None) -> Iterator[_Document]:
+    # Documents are yielded as they arrive instead of being collected in a list like FirestoreQuery.get
+    query_ref = _query_ref(query)
+    if fields:
+        query_ref = query_ref.select(fields)
+    # noinspection PyProtectedMember
+    document_class = query._doc_class
+    query_audit.record_query(query_ref)
+    for doc in timed_iter(FIRESTORE, query_ref.stream()):
+        yield document_class.dict_to_doc(doc.to_dict(), doc.id)
+
+
+@timed_call(FIRESTORE)
+def get_all(document_class: Type[_Document], doc_ids: List[str]) -> List[_Document]:
+    # Documents are read in a single round trip. Documents which do not exist are skipped.
+    query_audit.record_reads(document_class.COLLECTION, doc_ids)
+    collection = _DB.collection(document_class.COLLECTION)
+    snapshots = _DB.get_all([collection.document(doc_id) for doc_id in doc_ids])
+    return [document_class.dict_to_doc(snapshot.to_dict(), snapshot.id) for snapshot in snapshots if snapshot.exists]
+
+
+def _batch_size(document_class: Type[_Document]) -> int:
+    return TRACKED_BATCH_SIZE if issubclass(document_class, TrackedDocument) else BATCH_SIZE
+
+
+def batch_create(document_class: Type[_Document], doc_dicts: List[dict]) -> List[str]:
+    collection = _DB.collection(document_class.COLLECTION)
+    doc_ids: List[str] = list()
+    for chunk in chunks(doc_dicts, _batch_size(document_class)):
+        writes = list()
+        for doc_dict in chunk:
+            document = document_class.dict_to_doc(doc_dict, collection.document().id)
+            change = None
+            if isinstance(document, TrackedDocument):
+                document.touch()
+                change = document.change(CREATE)
+            writes.append(Write(collection.document(document.id), SET_DOCUMENT, document.doc_to_dict(), change))
+            doc_ids.append(document.id)
+        commit(writes)
+    return doc_ids
+
+
+def batch_save(documents: List[_Document]) -> int:
+    documents = [document for document in documents if document.id]
+    if not documents:
+        return 0
+    saved = 0
+    for chunk in chunks(documents, _batch_size(type(documents[0]))):
+        writes = list()
+        for document in chunk:
+            change = None
+            if isinstance(document, TrackedDocument):
+                document.touch()
+                change = document.change(UPDATE)
+            reference = _DB.collection(document.COLLECTION).document(document.id)
+            writes.append(Write(reference, SET_DOCUMENT, document.doc_to_dict(), change))
+        commit(writes)
+        saved += len(chunk)
+    return saved
+
+
+def batch_update(documents: List[_Document], changes: dict) -> int:
+    # Only the changed fields are written. The documents are updated in place with the changes.
+    documents = [document for document in documents if document.id]
+    if not documents:
+        return 0
+    updated = 0
+    for chunk in chunks(documents, _batch_size(type(documents[0]))):
+        writes = list()
+        for document in chunk:
+            fields = dict(changes)
+            change = None
+            if isinstance(document, TrackedDocument):
+                fields["updated_at"] = utc_now()
+            for field, value in fields.items():
+                setattr(document, field, value)
+            if isinstance(document, TrackedDocument):
+                change = document.change(UPDATE)
+            reference = _DB.collection(document.COLLECTION).document(document.id)
+            writes.append(Write(reference, UPDATE_FIELDS, fields, change))
+        commit(writes)
+        updated += len(chunk)
+    return updated
@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import re
+from typing import Iterable, Iterator, List, Callable, NamedTuple, Dict
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from flask import Response
+
+from fs_flask.usage import Usage
+
+HEADER = ("Hotel Name", "Date", "Timing", "Client", "Meal", "Event Type", "Ballroom", "BTR")
+KEYS = ("hotel", "date", "timing", "client", "meal", "event_type", "ballroom", "btr")
+ROWS_PER_CHUNK = 500
+# Characters which are not allowed in XML 1.0
+INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def get_row(usage: Usage) -> List[str]:
+    # Same columns as the Data sheet of the main report
+    return [usage.hotel, usage.formatted_date, usage.timing, usage.client, usage.formatted_meal, usage.event_type,
+            usage.formatted_ballroom, usage.event_description]
+
+
+def iter_csv(usages: Iterable[Usage]) -> Iterator[bytes]:
+    # The byte order mark lets Excel detect the encoding
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    yield buffer.getvalue().encode("utf-8-sig")
+    buffer.seek(0)
+    buffer.truncate()
+    for index, usage in enumerate(usages, start=1):
+        writer.writerow(get_row(usage))
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def iter_jsonl(usages: Iterable[Usage]) -> Iterator[bytes]:
+    lines: List[str] = list()
+    for usage in usages:
+        lines.append(json.dumps(dict(zip(KEYS, get_row(usage))), ensure_ascii=False))
+        if len(lines) == ROWS_PER_CHUNK:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = list()
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+class _Pipe:
+    # Write only stream for ZipFile whose contents are drained by the generator after every write.
+    # Without tell and seek, ZipFile writes the sizes after the data of each member so nothing is rewritten.
+
+    def __init__(self):
+        self.chunks: List[bytes] = list()
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = list()
+        return data
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    "_rels/.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    "xl/workbook.xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    "xl/_rels/workbook.xml.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+SHEET_START = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>' \
+              '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+SHEET_END = "</sheetData></worksheet>"
+
+
+def get_xml_row(row: Iterable[str]) -> str:
+    cells = "".join(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(INVALID_XML.sub(str(), str(value)))}'
+                    f'</t></is></c>' for value in row)
+    return f"<row>{cells}</row>"
+
+
+def iter_xlsx(usages: Iterable[Usage]) -> Iterator[bytes]:
+    # Workbook with a single Data sheet of inline strings and no charts, zipped as it is generated
+    pipe = _Pipe()
+    with ZipFile(pipe, "w", ZIP_DEFLATED) as zip_file:
+        for name, content in XLSX_PARTS.items():
+            zip_file.writestr(name, content)
+        with zip_file.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write((SHEET_START + get_xml_row(HEADER)).encode())
+            rows: List[str] = list()
+            for usage in usages:
+                rows.append(get_xml_row(get_row(usage)))
+                if len(rows) == ROWS_PER_CHUNK:
+                    sheet.write("".join(rows).encode())
+                    rows = list()
+                    yield pipe.drain()
+            sheet.write(("".join(rows) + SHEET_END).encode())
+    yield pipe.drain()
+
+
+class ExportFormat(NamedTuple):
+    generator: Callable[[Iterable[Usage]], Iterator[bytes]]
+    mimetype: str
+    extension: str
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "csv": ExportFormat(iter_csv, "text/csv", "csv"),
+    "jsonl": ExportFormat(iter_jsonl, "application/x-ndjson", "jsonl"),
+    "xlsx": ExportFormat(iter_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+
+def stream_export(usages: Iterable[Usage], export_format: str, filename: str) -> Response:
+    # The rows are generated locally and sent as they are produced without Sheets or Drive
+    export = EXPORT_FORMATS[export_format]
+    response = Response(export.generator(usages), mimetype=export.mimetype)
+    response.headers.set("Content-Disposition", "attachment", filename=f"{filename}.{export.extension}")
+    response.cache_control.no_store = True
+    return response
@@ -1,15 +1,19 @@
 import datetime as dt
 import itertools
 from operator import itemgetter
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Iterator
 
+from firestore_ci import FirestoreQuery
 from flask_login import current_user
 from wtforms import SelectMultipleField, DateField, SubmitField, ValidationError, RadioField, HiddenField
 
 from config import Config, Date
 from fs_flask import FSForm
+from fs_flask.db_methods import stream
+from fs_flask.export import EXPORT_FORMATS
 from fs_flask.file import File, GridRange, GridCoordinate
 from fs_flask.hotel import Hotel
+from fs_flask.replica import replica
 from fs_flask.usage import Usage
 
 
@@ -19,7 +23,7 @@ class QueryForm(FSForm):
     MAX_WEEKDAYS = int(MAX_ALL_DAYS * 7 / 5)
     MAX_WEEKENDS = int(MAX_ALL_DAYS * 7 / 2)
     MAX_SPECIFIC_DAYS = int(MAX_ALL_DAYS * 7 / 1)
-    DEFAULT_DATE = Date.previous_lock_in()
+    MAX_REPLICA_DAYS = 366 * 2  # Limit of any day filter for closed periods which are served from the replica
     PRIMARY_HOTEL = "Primary Comp Set"
     SECONDARY_HOTEL = "Secondary Comp Set"
     CUSTOM_HOTEL = "Custom Comp Set"
@@ -36,6 +40,9 @@ class QueryForm(FSForm):
     DAY_CHOICES = (ALL_DAY, WEEKDAY, WEEKEND)
     ALL_EVENT = "All Events"
     EVENT_CHOICES = tuple([ALL_EVENT] + list(Config.EVENTS))
+    CHART_EXPORT = "sheet"
+    EXPORT_CHOICES = ((CHART_EXPORT, "Excel with charts"), ("xlsx", "Excel (data only)"), ("csv", "CSV"),
+                      ("jsonl", "JSON Lines"))
     # Form type
     DOWNLOAD = "download"
     HOTEL_QUERY = "hotel_query"
@@ -44,8 +51,8 @@ class QueryForm(FSForm):
     hotel_select = RadioField("Comp Set Type", choices=[(choice, choice) for choice in HOTEL_CHOICES],
                               default=PRIMARY_HOTEL)
     custom_hotels = SelectMultipleField("Select hotels", choices=list())
-    start_date = DateField("From Date", default=DEFAULT_DATE, format="%d/%m/%Y")
-    end_date = DateField("To Date", default=DEFAULT_DATE, format="%d/%m/%Y")
+    start_date = DateField("From Date", default=Date.previous_lock_in, format="%d/%m/%Y")
+    end_date = DateField("To Date", default=Date.previous_lock_in, format="%d/%m/%Y")
     timing = RadioField("Select timing", choices=[(timing, timing) for timing in TIMING_CHOICES], default=ALL_TIMING)
     all_meal = RadioField("Select meals", choices=[(meal, meal) for meal in ALL_MEAL_CHOICES], default=ALL_MEAL)
     morning_meal = RadioField("Select morning meals", choices=[(meal, meal) for meal in MORNING_MEAL_CHOICES],
@@ -54,6 +61,7 @@ class QueryForm(FSForm):
                               default=ALL_MEAL)
     day = RadioField("Select the day(s) of the week", choices=[(day, day) for day in DAY_CHOICES], default=ALL_DAY)
     event = RadioField("Select event type", choices=[(event, event) for event in EVENT_CHOICES], default=ALL_EVENT)
+    export_format = RadioField("Select format", choices=list(EXPORT_CHOICES), default=CHART_EXPORT)
     form_type = HiddenField()
     submit = SubmitField("Query")
 
@@ -82,9 +90,11 @@ class QueryForm(FSForm):
         self.hotel_counts: List[Tuple[Hotel, int]] = list()
         self.hotel_trends: List[Tuple[str, int, float]] = list()
         self.file_path: str = str()
+        self.export_usages: Optional[Iterator[Usage]] = None
+        self.from_replica: Optional[bool] = None  # Decided once when the dates are validated or the data is read
 
     def raise_date_error(self, message):
-        self.start_date.data = self.end_date.data = self.DEFAULT_DATE
+        self.start_date.data = self.end_date.data = Date.previous_lock_in()
         raise ValidationError(message)
 
     def validate_end_date(self, end_date: DateField):
@@ -96,6 +106,12 @@ class QueryForm(FSForm):
         if self.start_date.data > end_date.data:
             self.raise_date_error("From Date cannot be greater than To Date")
         days = (end_date.data - self.start_date.data).days + 1
+        if replica.covers(end_date.data):
+            if days > self.MAX_REPLICA_DAYS:
+                self.raise_date_error(f"For closed periods, the date range cannot be greater than "
+                                      f"{self.MAX_REPLICA_DAYS} days")
+            self.from_replica = True
+            return
         if self.day.data == self.ALL_DAY and days > self.MAX_ALL_DAYS:
             self.raise_date_error(f"For All Days query, the date range cannot be greater than {self.MAX_ALL_DAYS} days")
         if self.day.data == self.WEEKDAY and days > self.MAX_WEEKDAYS:
@@ -105,6 +121,7 @@ class QueryForm(FSForm):
         if self.day.data not in (self.ALL_DAY, self.WEEKDAY, self.WEEKEND) and days > self.MAX_SPECIFIC_DAYS:
             self.raise_date_error(f"For specific day query, the date range cannot be greater than "
                                   f"{self.MAX_SPECIFIC_DAYS} days")
+        self.from_replica = False
 
     def get_filter_meals(self) -> List[str]:
         if self.timing.data == self.ALL_TIMING:
@@ -118,13 +135,13 @@ class QueryForm(FSForm):
         return [self.evening_meal.data] if self.evening_meal.data != self.ALL_MEAL else list()
 
     def update_data(self):
-        query = Usage.objects.filter_by(city=current_user.city, no_event=False)
+        filters = {"no_event": False}
         if self.day.data != self.ALL_DAY:
-            query = query.filter_by(weekday=self.day.data == self.WEEKDAY)
+            filters["weekday"] = self.day.data == self.WEEKDAY
         if self.timing.data != self.ALL_TIMING:
-            query = query.filter_by(timing=self.timing.data)
+            filters["timing"] = self.timing.data
         if self.event.data != self.ALL_EVENT:
-            query = query.filter_by(event_type=self.event.data)
+            filters["event_type"] = self.event.data
         if self.hotel_select.data == self.PRIMARY_HOTEL:
             hotels = self.primaries[:]
         elif self.hotel_select.data == self.SECONDARY_HOTEL:
@@ -132,55 +149,88 @@ class QueryForm(FSForm):
         else:
             hotels = self.custom_hotels.data[:] if self.custom_hotels.data else list()
         hotels.append(current_user.hotel)
-        query = query.filter("hotel", query.IN, hotels)
-        query = query.filter("date", ">=", Date(self.start_date.data).db_date)
-        query = query.filter("date", "<=", Date(self.end_date.data).db_date)
-        self.usage_data = query.get()
+        start_date, end_date = Date(self.start_date.data).db_date, Date(self.end_date.data).db_date
+        if self.from_replica is None:
+            # The dates were not validated and are the default dates or the dates reset by a validation error
+            self.from_replica = replica.covers(self.end_date.data)
+        if self.local_export:
+            # The export is streamed by the route with constant memory. The first usage is read to know if there is any.
+            usages = self.iter_usages(hotels, start_date, end_date, filters)
+            first_usage = next(usages, None)
+            self.export_usages = itertools.chain([first_usage], usages) if first_usage else None
+            return
+        if self.from_replica:
+            self.usage_data = replica.get_usages(current_user.city, hotels, start_date, end_date, **filters)
+        else:
+            self.usage_data = self.get_query(hotels, start_date, end_date, filters).get()
         filter_meals = self.get_filter_meals()
-        if filter_meals:
-            self.usage_data = [usage for usage in self.usage_data if any(meal in usage.meals for meal in filter_meals)]
+        self.usage_data = [usage for usage in self.usage_data if self.has_meals(usage, filter_meals)]
         self.usage_data.sort(key=lambda usage: usage.timing, reverse=True)
         self.usage_data.sort(key=lambda usage: usage.date)
         self.determine_hotel_counts()
         self.determine_hotel_trends()
-        if self.form_type.data == self.DOWNLOAD and len(self.usage_data) > 0:
+        if self.form_type.data == self.DOWNLOAD and self.export_format.data == self.CHART_EXPORT and self.usage_data:
             self.download()
 
+    @staticmethod
+    def get_query(hotels: List[str], start_date: str, end_date: str, filters: dict) -> FirestoreQuery:
+        query = Usage.objects.filter_by(city=current_user.city, **filters)
+        query = query.filter("hotel", query.IN, hotels)
+        query = query.filter("date", ">=", start_date)
+        return query.filter("date", "<=", end_date)
+
+    @staticmethod
+    def has_meals(usage: Usage, filter_meals: List[str]) -> bool:
+        return not filter_meals or any(meal in usage.meals for meal in filter_meals)
+
+    def iter_usages(self, hotels: List[str], start_date: str, end_date: str, filters: dict) -> Iterator[Usage]:
+        # Usages are streamed in the order of the report. Firestore returns them by date and only the usages of a day
+        # are sorted by timing. The meals are filtered one usage at a time.
+        if self.from_replica:
+            usages = replica.iter_usages(current_user.city, hotels, start_date, end_date, **filters)
+        else:
+            query = self.get_query(hotels, start_date, end_date, filters).order_by("date")
+            usages = (usage for _, day_usages in itertools.groupby(stream(query), key=lambda usage: usage.date)
+                      for usage in sorted(day_usages, key=lambda usage: usage.timing, reverse=True))
+        filter_meals = self.get_filter_meals()
+        return (usage for usage in usages if self.has_meals(usage, filter_meals))
+
     def download(self):
+        # The sheet is written in two calls after it is created i.e. one for the sheets and charts and one for values
         sheet = File.create_sheet()
         data_rows = len(self.usage_data) + 4
-        sheet.prepare(data_rows=data_rows)
-        header = ["Hotel Name", "Date", "Timing", "Client", "Meal", "Event Type", "Ballroom", "BTR"]
-        data = [[u.hotel, u.formatted_date, u.timing, u.client, u.formatted_meal, u.event_type, u.formatted_ballroom,
-                 u.event_description] for u in self.usage_data]
-        data.insert(0, header)
-        range_name = f"Data!A1:H{data_rows}"
-        sheet.update_range(range_name, data)
-        row1 = self.selected_hotels
-        row1.extend([str()] * (9 - len(row1)))
-        row1.insert(0, self.hotel_select.data)
-        row2 = ["From Date", "To Date", "Days", "Timing", "Meal", "Event"] + [str()] * 4
-        row3 = [Date(self.start_date.data).format_date, Date(self.end_date.data).format_date, self.day.data,
-                self.timing.data, " and ".join(self.meals), self.event.data] + [str()] * 4
-        sheet.update_range(f"Report!A1:J3", [row1, row2, row3])
-        hotel_counts: List[list] = [list(hotel_count) for hotel_count in self.hotel_counts]
-        hotel_counts.insert(0, ["Hotel", f"Total Count={len(self.usage_data)}"])
-        row_end = len(self.hotel_counts) + 5
-        sheet.update_range(f"Report!H5:I{row_end}", hotel_counts)
-        headers = [GridRange.from_range(f"Report!H6:H{row_end}").to_dict()]
-        values = [GridRange.from_range(f"Report!I6:I{row_end}").to_dict()]
-        anchor = GridCoordinate.from_cell(f"Report!A5").to_dict()
-        pie = sheet.pie_spec(headers, values, anchor)
-        hotel_trends: List[list] = [list(hotel_trend) for hotel_trend in self.hotel_trends]
-        hotel_trends.insert(0, ["Date", "My Prop", "Comp Set Avg"])
-        row_end = len(self.hotel_trends) + 25
-        sheet.update_range(f"Report!H25:J{row_end}", hotel_trends)
-        headers = [GridRange.from_range(f"Report!H25:H{row_end}").to_dict()]
-        values = [GridRange.from_range(f"Report!I25:I{row_end}").to_dict(),
-                  GridRange.from_range(f"Report!J25:J{row_end}").to_dict()]
-        anchor = GridCoordinate.from_cell(f"Report!A25").to_dict()
-        trend = sheet.trend_spec(headers, values, anchor)
-        sheet.update_chart(pie, trend)
+        with sheet.writer() as writer:
+            writer.prepare(data_rows=data_rows)
+            header = ["Hotel Name", "Date", "Timing", "Client", "Meal", "Event Type", "Ballroom", "BTR"]
+            data = [[u.hotel, u.formatted_date, u.timing, u.client, u.formatted_meal, u.event_type,
+                     u.formatted_ballroom, u.event_description] for u in self.usage_data]
+            data.insert(0, header)
+            range_name = f"Data!A1:H{data_rows}"
+            writer.update_range(range_name, data)
+            row1 = self.selected_hotels
+            row1.extend([str()] * (9 - len(row1)))
+            row1.insert(0, self.hotel_select.data)
+            row2 = ["From Date", "To Date", "Days", "Timing", "Meal", "Event"] + [str()] * 4
+            row3 = [Date(self.start_date.data).format_date, Date(self.end_date.data).format_date, self.day.data,
+                    self.timing.data, " and ".join(self.meals), self.event.data] + [str()] * 4
+            writer.update_range(f"Report!A1:J3", [row1, row2, row3])
+            hotel_counts: List[list] = [list(hotel_count) for hotel_count in self.hotel_counts]
+            hotel_counts.insert(0, ["Hotel", f"Total Count={len(self.usage_data)}"])
+            row_end = len(self.hotel_counts) + 5
+            writer.update_range(f"Report!H5:I{row_end}", hotel_counts)
+            headers = [GridRange.from_range(f"Report!H6:H{row_end}").to_dict()]
+            values = [GridRange.from_range(f"Report!I6:I{row_end}").to_dict()]
+            anchor = GridCoordinate.from_cell(f"Report!A5").to_dict()
+            writer.add_chart(sheet.pie_spec(headers, values, anchor))
+            hotel_trends: List[list] = [list(hotel_trend) for hotel_trend in self.hotel_trends]
+            hotel_trends.insert(0, ["Date", "My Prop", "Comp Set Avg"])
+            row_end = len(self.hotel_trends) + 25
+            writer.update_range(f"Report!H25:J{row_end}", hotel_trends)
+            headers = [GridRange.from_range(f"Report!H25:H{row_end}").to_dict()]
+            values = [GridRange.from_range(f"Report!I25:I{row_end}").to_dict(),
+                      GridRange.from_range(f"Report!J25:J{row_end}").to_dict()]
+            anchor = GridCoordinate.from_cell(f"Report!A25").to_dict()
+            writer.add_chart(sheet.trend_spec(headers, values, anchor))
         self.file_path = sheet.download_from_drive()
         sheet.delete_sheet()
 
@@ -225,6 +275,11 @@ class QueryForm(FSForm):
             hotels = self.custom_hotels.data
         return hotels if hotels else ["No Hotel"]
 
+    @property
+    def local_export(self) -> bool:
+        # Data only formats are generated locally and streamed by the route instead of going through Sheets
+        return self.form_type.data == self.DOWNLOAD and self.export_format.data in EXPORT_FORMATS
+
     @property
     def meals(self) -> List[str]:
         filter_meals = self.get_filter_meals()
@@ -1,16 +1,16 @@
 import io
-import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed, Future
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, IO
 
-from google.cloud.storage import Client, Blob
-# noinspection PyPackageRequirements
-from googleapiclient.discovery import build
+from google.cloud.storage import Blob
+from google.resumable_media import DataCorruption
 # noinspection PyPackageRequirements
 from googleapiclient.http import MediaIoBaseDownload
 
 from config import Config, BaseMap
+from fs_flask.file_cache import file_cache
+from fs_flask.google_clients import ThreadLocalClient, sheets_service, drive_service, storage_bucket
+from fs_flask.sheet_sweeper import sheet_sweeper, SPREADSHEET, TEMPORARY_PROPERTIES
 
 
 class RangeValues(BaseMap):
@@ -20,21 +20,23 @@ class RangeValues(BaseMap):
 
 
 class File:
-    SHEETS = build("sheets", "v4")
-    DRIVE = build("drive", "v3")
+    SHEETS = ThreadLocalClient(sheets_service)
+    DRIVE = ThreadLocalClient(drive_service)
     SHEET_ID = {'Report': 0, 'Data': 1}
-    BUCKET = Client().bucket("focus-solutions-files")
+    BUCKET = ThreadLocalClient(storage_bucket)
+    UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # Must be a multiple of 256 KB
 
     def __init__(self, sheet_id: str, extension: str):
         self.name: str = sheet_id
         self.extension: str = extension
-        self.future: Optional[Future] = None
 
     @classmethod
     def create_sheet(cls) -> "File":
-        body = {"properties": {"title": "Reports"}}
-        spreadsheet = cls.SHEETS.spreadsheets().create(body=body, fields="spreadsheetId").execute()
-        sheet_id = spreadsheet.get("spreadsheetId")
+        # Created through Drive so that the sheet is tagged as temporary for the orphan sweep
+        body = {"name": "Reports", "mimeType": SPREADSHEET, "appProperties": TEMPORARY_PROPERTIES}
+        spreadsheet = cls.DRIVE.files().create(body=body, fields="id").execute()
+        sheet_id = spreadsheet.get("id")
+        sheet_sweeper.register(sheet_id)
         print(f"Sheet with ID {sheet_id} created")
         return cls(sheet_id, "xlsx")
 
@@ -44,17 +46,10 @@ class File:
         sheet.grant_permission()
         return sheet
 
-    def async_copy(self):
-        with ThreadPoolExecutor() as executor:
-            self.future = executor.submit(self.copy_sheet)
-
-    def await_copy(self) -> "File":
-        results = [future.result() for future in as_completed([self.future])]
-        return results[0]
-
     def copy_sheet(self) -> "File":
-        file = self.DRIVE.files().copy(fileId=self.name).execute()
+        file = self.DRIVE.files().copy(fileId=self.name, body={"appProperties": TEMPORARY_PROPERTIES}).execute()
         file_id = file["id"]
+        sheet_sweeper.register(file_id)
         print(f"A new copy of sheet {self.name} created. The id of new sheet is {file_id}")
         return File(file_id, "xlsx")
 
@@ -79,22 +74,30 @@ class File:
 
     @property
     def local_path(self):
-        return os.path.join(Config.DOWNLOAD_PATH, self.filename)
+        return file_cache.local_path(self.filename)
 
     @property
     def filename(self) -> str:
         return f"{self.name}.{self.extension}"
 
-    def prepare(self, data_rows: int = 1000):
-        body = {"requests": [
+    def writer(self) -> "SheetWriter":
+        return SheetWriter(self)
+
+    @classmethod
+    def prepare_requests(cls, data_rows: int = 1000) -> List[dict]:
+        return [
             {"updateSheetProperties": {
-                "properties": {"sheetId": 0, "title": "Report"},
+                "properties": {"sheetId": cls.SHEET_ID["Report"], "title": "Report"},
                 "fields": "title"
             }},
             {"addSheet": {
-                "properties": {"title": "Data", "gridProperties": {"rowCount": data_rows, "columnCount": 26}}
+                "properties": {"sheetId": cls.SHEET_ID["Data"], "title": "Data",
+                               "gridProperties": {"rowCount": data_rows, "columnCount": 26}}
             }}
-        ]}
+        ]
+
+    def prepare(self, data_rows: int = 1000):
+        body = {"requests": self.prepare_requests(data_rows)}
         self.SHEETS.spreadsheets().batchUpdate(spreadsheetId=self.name, body=body).execute()
 
     def update_range(self, range_name: str, values: List[List[str]]):
@@ -105,11 +108,33 @@ class File:
         body: dict = {"valueInputOption": "USER_ENTERED", "data": data}
         self.SHEETS.spreadsheets().values().batchUpdate(spreadsheetId=self.name, body=body).execute()
 
+    def duplicate_sheets(self, prefixes: List[str]):
+        # Every sheet of the workbook is repeated for each prefix in a single batch update. The existing sheets are
+        # renamed with the first prefix and the copies (along with their charts) are named with the remaining prefixes.
+        spreadsheet = self.SHEETS.spreadsheets().get(spreadsheetId=self.name, fields="sheets.properties").execute()
+        sheets: List[dict] = [sheet["properties"] for sheet in spreadsheet["sheets"]]
+        requests: List[dict] = list()
+        for index, prefix in enumerate(prefixes[1:], start=1):
+            for position, sheet in enumerate(sheets):
+                requests.append({"duplicateSheet": {
+                    "sourceSheetId": sheet["sheetId"],
+                    "insertSheetIndex": index * len(sheets) + position,
+                    "newSheetName": f"{prefix} {sheet['title']}"
+                }})
+        for sheet in sheets:
+            requests.append({"updateSheetProperties": {
+                "properties": {"sheetId": sheet["sheetId"], "title": f"{prefixes[0]} {sheet['title']}"},
+                "fields": "title"
+            }})
+        self.SHEETS.spreadsheets().batchUpdate(spreadsheetId=self.name, body={"requests": requests}).execute()
+
     def delete_sheet(self):
+        # The sheet is deleted later by the sweeper in a batch request
         if not self.name:
             print("Nothing to delete")
-        self.DRIVE.files().delete(fileId=self.name).execute()
-        print(f"Sheet with ID {self.name} deleted")
+            return
+        sheet_sweeper.release(self.name)
+        print(f"Sheet with ID {self.name} released for deletion")
 
     def download_from_drive(self) -> str:
         if not self.name:
@@ -125,43 +150,33 @@ class File:
         done = False
         while done is False:
             _, done = downloader.next_chunk()
+        file_handle.close()
+        file_cache.put(self.filename)
         print(f"File {file_path} downloaded")
         return file_path
 
-    def download_from_cloud(self) -> str:
-        if not self.name or not self.extension:
-            print("Nothing to download")
-            return str()
-        file_path = self.local_path
-        if os.path.exists(file_path):
-            return file_path
-        blob: Blob = self.BUCKET.blob(self.filename)
-        if not blob.exists():
-            print(f"File {self.filename} not found on cloud storage")
-            return str()
-        blob.download_to_filename(file_path)
-        return file_path
-
-    def upload_to_cloud(self) -> str:
+    def upload_from_stream(self, stream: IO[bytes], content_type: Optional[str] = None) -> str:
+        # The stream is sent in chunks of a resumable upload without another local copy of the file.
+        # Werkzeug still spools uploads larger than 500 KB to a temporary file while parsing the request.
+        # The checksum is verified on completion and a corrupted object is deleted by the client library.
         if not self.name or not self.extension:
             print("Nothing to upload")
             return str()
-        file_path = self.local_path
-        if not os.path.exists(file_path):
+        blob: Blob = self.BUCKET.blob(self.filename, chunk_size=self.UPLOAD_CHUNK_SIZE)
+        try:
+            blob.upload_from_file(stream, content_type=content_type, checksum="crc32c")
+        except DataCorruption:
+            print(f"File {self.filename} failed checksum verification")
             return str()
-        blob: Blob = self.BUCKET.blob(self.filename)
-        if blob.exists():
-            print(f"File {self.filename} present on cloud storage and was overwritten")
-        blob.upload_from_filename(file_path)
-        return file_path
+        file_cache.evict(self.filename)
+        return self.filename
 
     def delete_from_cloud(self) -> str:
         if not self.name or not self.extension:
             print("Nothing to delete")
             return str()
         file_path = self.local_path
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        file_cache.evict(self.filename)
         blob: Blob = self.BUCKET.blob(self.filename)
         if blob.exists():
             blob.delete()
@@ -205,6 +220,54 @@ class File:
         print("Chart updated")
 
 
+class SheetWriter:
+    # Collects the changes to a sheet and writes them in at most two calls on commit.
+    # Sheet properties and charts go in one batchUpdate which is sent first so that the added sheets exist before
+    # the values are written. All the value ranges then go in one values batchUpdate.
+    # Used as a context manager, the changes are committed on exit unless an exception is raised.
+
+    def __init__(self, sheet: File):
+        self.sheet: File = sheet
+        self.requests: List[dict] = list()
+        self.data: List[dict] = list()
+
+    def __enter__(self) -> "SheetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+
+    def prepare(self, data_rows: int = 1000) -> "SheetWriter":
+        self.requests.extend(File.prepare_requests(data_rows))
+        return self
+
+    def update_range(self, range_name: str, values: List[List[str]]) -> "SheetWriter":
+        self.data.append(RangeValues(range_name, values).to_dict())
+        return self
+
+    def update_bulk_range(self, data: List[dict]) -> "SheetWriter":
+        self.data.extend(data)
+        return self
+
+    def add_chart(self, chart: dict) -> "SheetWriter":
+        self.requests.append({"addChart": {"chart": chart}})
+        return self
+
+    def commit(self) -> int:
+        # Returns the number of calls made
+        calls = 0
+        if self.requests:
+            self.sheet.SHEETS.spreadsheets().batchUpdate(spreadsheetId=self.sheet.name,
+                                                         body={"requests": self.requests}).execute()
+            calls += 1
+        if self.data:
+            self.sheet.update_bulk_range(self.data)
+            calls += 1
+        self.requests, self.data = list(), list()
+        return calls
+
+
 class GridRange(BaseMap):
     def __init__(self):
         self.sheetId: int = 0
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, NamedTuple
+
+from config import Config
+
+
+class CacheEntry(NamedTuple):
+    size: int
+    # None for files which do not have a copy on cloud storage e.g. generated reports. Empty if not known.
+    version: Optional[str]
+    validated_at: float
+
+
+class FileCache:
+    # Local copies of cloud storage files and generated reports limited to max_bytes on disk.
+    # The least recently used files are evicted first. A cloud storage file is served from the disk until it is
+    # validate_after seconds old. After that it is streamed from cloud storage instead.
+
+    def __init__(self, path: str, max_bytes: int, validate_after: int):
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.validate_after: int = validate_after
+        self.entries: Dict[str, CacheEntry] = OrderedDict()
+        self.size: int = 0
+        self._lock = threading.Lock()
+        self._loaded: bool = False
+        os.makedirs(self.path, exist_ok=True)
+
+    def load(self) -> None:
+        # Files left by a previous process are counted for eviction. Their version is not known so they are not served.
+        if self._loaded:
+            return
+        files = [entry for entry in os.scandir(self.path) if entry.is_file()]
+        files.sort(key=lambda entry: entry.stat().st_atime)
+        for entry in files:
+            self.entries[entry.name] = CacheEntry(entry.stat().st_size, str(), 0)
+            self.size += entry.stat().st_size
+        self._loaded = True
+
+    def local_path(self, filename: str) -> str:
+        return os.path.join(self.path, filename)
+
+    def get_entry(self, filename: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self.entries.get(filename)
+            if entry:
+                self.entries.move_to_end(filename)
+            return entry
+
+    def put(self, filename: str, version: Optional[str] = None) -> None:
+        # Records a file which has been written to its local path and evicts the least recently used files
+        file_path = self.local_path(filename)
+        if not os.path.exists(file_path):
+            return
+        with self._lock:
+            self.load()
+            previous = self.entries.pop(filename, None)
+            if previous:
+                self.size -= previous.size
+            self.entries[filename] = CacheEntry(os.path.getsize(file_path), version, time.monotonic())
+            self.size += self.entries[filename].size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                evicted, entry = self.entries.popitem(last=False)
+                self.size -= entry.size
+                self._remove(evicted)
+
+    def evict(self, filename: str) -> None:
+        with self._lock:
+            entry = self.entries.pop(filename, None)
+            if entry:
+                self.size -= entry.size
+            self._remove(filename)
+
+    def _remove(self, filename: str) -> None:
+        try:
+            os.remove(self.local_path(filename))
+        except FileNotFoundError:
+            pass
+
+    def peek(self, filename: str) -> str:
+        # Returns the local path of a file which is cached and does not need validation or an empty string
+        entry = self.get_entry(filename)
+        if not entry:
+            return str()
+        if entry.version is not None and time.monotonic() - entry.validated_at >= self.validate_after:
+            return str()
+        return self.local_path(filename)
+
+
+file_cache = FileCache(Config.CACHE_PATH, Config.CACHE_MAX_BYTES, Config.CACHE_VALIDATE_AFTER)
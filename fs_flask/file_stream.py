@@ -0,0 +1,66 @@
+import datetime as dt
+import mimetypes
+from typing import Iterator, Optional
+
+import pytz
+from flask import request, Response
+from google.cloud.storage import Bucket, Blob
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB per ranged read from cloud storage
+
+
+def read_chunks(blob: Blob, start: int, stop: int) -> Iterator[bytes]:
+    # Every chunk is read from the same generation so that the object cannot change in the middle of a response
+    for offset in range(start, stop, CHUNK_SIZE):
+        yield blob.download_as_bytes(start=offset, end=min(offset + CHUNK_SIZE, stop) - 1)
+
+
+def stream_from_cloud(bucket: Bucket, filename: str, attachment: bool, download_name: str) -> Optional[Response]:
+    # Pipes the blob to the response without writing it to the disk. Conditional and range requests are honoured.
+    # Returns None if the blob does not exist.
+    blob: Optional[Blob] = bucket.get_blob(filename)
+    if not blob:
+        return None
+    # HTTP dates are compared as naive UTC datetime by werkzeug
+    last_modified = blob.updated.astimezone(pytz.UTC).replace(tzinfo=None, microsecond=0) if blob.updated else None
+    if not is_resource_modified(request.environ, etag=blob.etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(blob.etag)
+        return response
+    size: int = blob.size or 0
+    start, stop, status = 0, size, 200
+    # Multiple ranges are not supported and the complete file is sent instead
+    if request.range and len(request.range.ranges) == 1 and if_range_matches(blob.etag, last_modified):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        start, stop = byte_range
+        status = 206
+    pinned_blob: Blob = bucket.blob(filename, generation=blob.generation)
+    mimetype = blob.content_type or mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    response = Response(read_chunks(pinned_blob, start, stop), status=status, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.content_length = stop - start
+    if status == 206:
+        response.content_range = ContentRange("bytes", start, stop, size)
+    response.accept_ranges = "bytes"
+    response.set_etag(blob.etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.headers.set("Content-Disposition", "attachment" if attachment else "inline", filename=download_name)
+    return response
+
+
+def if_range_matches(etag: str, last_modified: Optional[dt.datetime]) -> bool:
+    # A range is served only if the If-Range validator (if any) still matches the blob
+    if not request.headers.get("If-Range"):
+        return True
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    return bool(if_range.date and last_modified and last_modified <= if_range.date)
@@ -0,0 +1,146 @@
+import os
+import threading
+from typing import Callable, Any, Optional, Tuple, Dict
+
+import google.auth
+import httplib2
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud.storage import Client, Bucket
+# noinspection PyPackageRequirements
+from googleapiclient.discovery import build, Resource
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import Config
+from fs_flask.metrics import timed, GOOGLE
+
+BUCKET_NAME = "focus-solutions-files"
+LOCAL = "local"  # Google backend of stand-ins for development and load tests
+SCOPES = ("https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets",
+          "https://www.googleapis.com/auth/devstorage.full_control")
+
+
+class TransportStats:
+    # Connections opened versus requests sent over the pooled transport. The rest of the requests reused a connection.
+
+    def __init__(self):
+        self.opened: int = 0
+        self.requests: int = 0
+        self._lock = threading.Lock()
+
+    def add(self, opened: int = 0, requests: int = 0) -> None:
+        with self._lock:
+            self.opened += opened
+            self.requests += requests
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.opened, 0)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"opened": self.opened, "reused": self.reused, "requests": self.requests}
+
+
+transport_stats = TransportStats()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        transport_stats.add(opened=1)
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        transport_stats.add(opened=1)
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool,
+                                                   "https": CountingHTTPSConnectionPool}
+
+    def send(self, *args, **kwargs):
+        transport_stats.add(requests=1)
+        with timed(GOOGLE):
+            return super().send(*args, **kwargs)
+
+
+class PooledHttp:
+    # httplib2.Http compatible transport for googleapiclient over the shared requests session
+
+    def __init__(self, session: AuthorizedSession):
+        self.session: AuthorizedSession = session
+
+    def request(self, uri: str, method: str = "GET", body=None, headers: Optional[dict] = None,
+                redirections: int = 5, connection_type=None) -> Tuple[httplib2.Response, bytes]:
+        response = self.session.request(method, uri, data=body, headers=headers, timeout=Config.GOOGLE_TIMEOUT)
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # The content is already decoded by requests. Like httplib2, the length is of the decoded content.
+        if "content-encoding" in info:
+            info["-content-encoding"] = info.pop("content-encoding")
+            info["content-length"] = str(len(response.content))
+        info["status"] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+
+_session: Optional[AuthorizedSession] = None
+_project: Optional[str] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> Tuple[AuthorizedSession, Optional[str]]:
+    # One authorised keep-alive session per worker process shared by Sheets, Drive and Storage.
+    # The connection pool of requests is thread safe.
+    global _session, _project
+    with _session_lock:
+        if _session is None:
+            credentials, _project = google.auth.default(scopes=SCOPES)
+            session = AuthorizedSession(credentials)
+            adapter = PooledAdapter(pool_connections=Config.GOOGLE_POOL_SIZE, pool_maxsize=Config.GOOGLE_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session, _project
+
+
+class ThreadLocalClient:
+    # Class attribute which builds its client on first use in every thread.
+    # The API client objects are not shared between threads. They share the pooled transport.
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory: Callable[[], Any] = factory
+        self.local = threading.local()
+
+    def __get__(self, instance, owner) -> Any:
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.factory()
+        return client
+
+
+def build_service(service_name: str, version: str) -> Resource:
+    # Discovery documents bundled with the client library are used instead of fetching them over the network
+    if Config.GOOGLE_BACKEND == LOCAL:
+        from fs_flask.local_google import LocalSheetsService, LocalDriveService
+        return LocalSheetsService() if service_name == "sheets" else LocalDriveService()
+    session, _ = get_session()
+    return build(service_name, version, http=PooledHttp(session), static_discovery=True, cache_discovery=False)
+
+
+def sheets_service() -> Resource:
+    return build_service("sheets", "v4")
+
+
+def drive_service() -> Resource:
+    return build_service("drive", "v3")
+
+
+def storage_bucket() -> Bucket:
+    if Config.GOOGLE_BACKEND == LOCAL:
+        from fs_flask.local_google import LocalBucket
+        return LocalBucket(BUCKET_NAME, os.path.join(Config.LOCAL_GOOGLE_PATH, BUCKET_NAME))
+    session, project = get_session()
+    return Client(project=project, credentials=session.credentials, _http=session).bucket(BUCKET_NAME)
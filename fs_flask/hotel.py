@@ -2,7 +2,6 @@ import datetime as dt
 from operator import itemgetter
 from typing import List, Optional, Tuple, Union, NamedTuple
 
-from firestore_ci import FirestoreDocument
 from flask import request
 from flask_login import current_user
 from flask_wtf.file import FileAllowed
@@ -15,6 +14,7 @@ from wtforms.validators import Optional as InputOptional
 
 from config import Config, BaseMap, Date
 from fs_flask import FSForm
+from fs_flask.db_methods import TrackedDocument
 from fs_flask.file import File
 
 
@@ -24,8 +24,9 @@ class BallroomMap(BaseMap):
         self.used: bool = False
 
 
-class Hotel(FirestoreDocument):
+class Hotel(TrackedDocument):
     FILE_EXTENSION = "pdf"
+    HOTEL_FIELD = "name"
 
     def __init__(self, name: str = None, ballrooms: List[str] = None, primary_hotels: List[str] = None,
                  secondary_hotels: List[str] = None, city: str = None):
@@ -307,9 +308,7 @@ class HotelForm(FSForm):
         if not secure_filename(file_storage.filename):
             raise ValidationError("No file selected for upload")
         file = File(self.hotel.contract_filename, Hotel.FILE_EXTENSION)
-        file_path = file.local_path
-        file_storage.save(file_path)
-        if not file.upload_to_cloud():
+        if not file.upload_from_stream(file_storage.stream, file_storage.mimetype):
             raise ValidationError("Error in upload")
 
     def update(self):
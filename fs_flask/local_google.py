@@ -0,0 +1,339 @@
+import base64
+import datetime as dt
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, IO, Any
+
+import httplib2
+import pytz
+from google.api_core.exceptions import NotFound
+# noinspection PyPackageRequirements
+from googleapiclient.errors import HttpError
+
+from config import Config
+
+# Local stand-ins for the parts of Sheets, Drive and Cloud Storage used by File. They are selected with
+# GOOGLE_BACKEND=local for development and load tests without credentials. Every call waits for
+# LOCAL_GOOGLE_LATENCY seconds to behave like a network call. Spreadsheets are kept in the memory of the process
+# and blobs are files in LOCAL_GOOGLE_PATH so that they are shared by the workers.
+
+
+def wait() -> None:
+    if Config.LOCAL_GOOGLE_LATENCY:
+        time.sleep(Config.LOCAL_GOOGLE_LATENCY)
+
+
+def not_found(file_id: str) -> HttpError:
+    return HttpError(httplib2.Response({"status": 404}), f"File not found: {file_id}".encode())
+
+
+class LocalRequest:
+    def __init__(self, function: Callable[..., Any], *args, **kwargs):
+        self.function: Callable[..., Any] = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def execute(self, num_retries: int = 0, latency: bool = True) -> Any:
+        if latency:
+            wait()
+        return self.function(*self.args, **self.kwargs)
+
+
+class LocalSpreadsheets:
+    # Spreadsheets of this process by id. Only the sheet properties and the written ranges are kept.
+
+    def __init__(self):
+        self.spreadsheets: Dict[str, dict] = dict()
+        self.versions: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def create(self, title: str = "Untitled", sheets: Optional[List[dict]] = None) -> str:
+        spreadsheet_id = uuid.uuid4().hex
+        with self._lock:
+            self.spreadsheets[spreadsheet_id] = {
+                "title": title,
+                "sheets": sheets or [{"properties": {"sheetId": 0, "title": "Sheet1", "index": 0}}],
+                "values": dict(),
+            }
+            self.versions[spreadsheet_id] = 1
+        return spreadsheet_id
+
+    def get(self, spreadsheet_id: str) -> dict:
+        with self._lock:
+            if spreadsheet_id not in self.spreadsheets:
+                # Sheets which exist on Drive (like the template) are created on first use
+                self.spreadsheets[spreadsheet_id] = {"title": spreadsheet_id, "values": dict(),
+                                                     "sheets": [{"properties": {"sheetId": 0, "title": "Sheet1",
+                                                                                "index": 0}}]}
+                self.versions[spreadsheet_id] = 1
+            return self.spreadsheets[spreadsheet_id]
+
+    def copy(self, spreadsheet_id: str) -> str:
+        source = self.get(spreadsheet_id)
+        sheets = [{"properties": dict(sheet["properties"])} for sheet in source["sheets"]]
+        return self.create(f"Copy of {source['title']}", sheets)
+
+    def delete(self, spreadsheet_id: str) -> bool:
+        with self._lock:
+            self.versions.pop(spreadsheet_id, None)
+            return self.spreadsheets.pop(spreadsheet_id, None) is not None
+
+    def batch_update(self, spreadsheet_id: str, requests: List[dict]) -> dict:
+        spreadsheet = self.get(spreadsheet_id)
+        with self._lock:
+            sheets: List[dict] = spreadsheet["sheets"]
+            for request in requests:
+                if "addSheet" in request:
+                    properties = dict(request["addSheet"].get("properties", dict()))
+                    properties.setdefault("sheetId", max(sheet["properties"]["sheetId"] for sheet in sheets) + 1)
+                    properties.setdefault("index", len(sheets))
+                    sheets.append({"properties": properties})
+                elif "duplicateSheet" in request:
+                    duplicate = request["duplicateSheet"]
+                    sheet_id = max(sheet["properties"]["sheetId"] for sheet in sheets) + 1
+                    sheets.append({"properties": {"sheetId": sheet_id, "title": duplicate["newSheetName"],
+                                                  "index": duplicate.get("insertSheetIndex", len(sheets))}})
+                elif "updateSheetProperties" in request:
+                    properties = request["updateSheetProperties"]["properties"]
+                    sheet = next((sheet for sheet in sheets
+                                  if sheet["properties"]["sheetId"] == properties["sheetId"]), None)
+                    if sheet:
+                        sheet["properties"].update(properties)
+            self.versions[spreadsheet_id] += 1
+        return {"spreadsheetId": spreadsheet_id, "replies": [dict() for _ in requests]}
+
+    def update_values(self, spreadsheet_id: str, data: List[dict]) -> dict:
+        spreadsheet = self.get(spreadsheet_id)
+        with self._lock:
+            for range_values in data:
+                spreadsheet["values"][range_values["range"]] = range_values.get("values", list())
+        return {"spreadsheetId": spreadsheet_id, "totalUpdatedRanges": len(data)}
+
+    def get_values(self, spreadsheet_id: str, range_name: str) -> dict:
+        spreadsheet = self.get(spreadsheet_id)
+        return {"range": range_name, "values": spreadsheet["values"].get(range_name, list())}
+
+
+spreadsheets = LocalSpreadsheets()
+
+
+class LocalValues:
+    def update(self, spreadsheetId: str, range: str, body: dict, **_) -> LocalRequest:
+        return LocalRequest(spreadsheets.update_values, spreadsheetId, [dict(body, range=range)])
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> LocalRequest:
+        return LocalRequest(spreadsheets.update_values, spreadsheetId, body.get("data", list()))
+
+    def get(self, spreadsheetId: str, range: str, **_) -> LocalRequest:
+        return LocalRequest(spreadsheets.get_values, spreadsheetId, range)
+
+
+class LocalSheetsService:
+    def spreadsheets(self) -> "LocalSheetsService":
+        return self
+
+    def values(self) -> LocalValues:
+        return LocalValues()
+
+    def create(self, body: dict, fields: str = str()) -> LocalRequest:
+        def create() -> dict:
+            title = body.get("properties", dict()).get("title", "Untitled")
+            return {"spreadsheetId": spreadsheets.create(title, body.get("sheets"))}
+
+        return LocalRequest(create)
+
+    def get(self, spreadsheetId: str, fields: str = str()) -> LocalRequest:
+        return LocalRequest(lambda: {"spreadsheetId": spreadsheetId,
+                                     "sheets": spreadsheets.get(spreadsheetId)["sheets"]})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> LocalRequest:
+        return LocalRequest(spreadsheets.batch_update, spreadsheetId, body.get("requests", list()))
+
+
+class LocalMediaHttp:
+    # Answers the GET of MediaIoBaseDownload with the exported workbook
+    def __init__(self, content: bytes):
+        self.content: bytes = content
+
+    def request(self, uri: str, method: str = "GET", **_):
+        wait()
+        return httplib2.Response({"status": "200", "content-length": str(len(self.content))}), self.content
+
+
+class LocalMediaRequest:
+    def __init__(self, spreadsheet_id: str):
+        if spreadsheet_id not in spreadsheets.spreadsheets:
+            raise not_found(spreadsheet_id)
+        # The values are not rendered. The export is a valid workbook with an empty Data sheet.
+        from fs_flask.export import iter_xlsx
+        self.uri: str = f"local://drive/{spreadsheet_id}/export"
+        self.headers: Dict[str, str] = dict()
+        self.http = LocalMediaHttp(b"".join(iter_xlsx(list())))
+
+
+class LocalBatch:
+    # All the calls of a batch wait for a single round trip
+    def __init__(self, callback: Optional[Callable] = None):
+        self.callback: Optional[Callable] = callback
+        self.requests: List[tuple] = list()
+
+    def add(self, request: LocalRequest, callback: Optional[Callable] = None, request_id: Optional[str] = None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests) + 1)))
+
+    def execute(self) -> None:
+        wait()
+        for request, callback, request_id in self.requests:
+            response, exception = None, None
+            try:
+                response = request.execute(latency=False)
+            except HttpError as error:
+                exception = error
+            if callback:
+                callback(request_id, response, exception)
+
+
+class LocalFiles:
+    def copy(self, fileId: str, **_) -> LocalRequest:
+        return LocalRequest(lambda: {"id": spreadsheets.copy(fileId)})
+
+    def get(self, fileId: str, fields: str = str()) -> LocalRequest:
+        def get_file() -> dict:
+            spreadsheets.get(fileId)
+            return {"id": fileId, "version": str(spreadsheets.versions.get(fileId, 1))}
+
+        return LocalRequest(get_file)
+
+    def delete(self, fileId: str) -> LocalRequest:
+        def delete() -> str:
+            if not spreadsheets.delete(fileId):
+                raise not_found(fileId)
+            return str()
+
+        return LocalRequest(delete)
+
+    def list(self, pageToken: Optional[str] = None, **_) -> LocalRequest:
+        # Temporary sheets of other instances do not exist locally
+        return LocalRequest(lambda: {"files": list()})
+
+    def export_media(self, fileId: str, mimeType: str) -> LocalMediaRequest:
+        return LocalMediaRequest(fileId)
+
+
+class LocalPermissions:
+    def create(self, fileId: str, body: dict, fields: str = str()) -> LocalRequest:
+        return LocalRequest(lambda: {"id": uuid.uuid4().hex})
+
+
+class LocalDriveService:
+    def files(self) -> LocalFiles:
+        return LocalFiles()
+
+    def permissions(self) -> LocalPermissions:
+        return LocalPermissions()
+
+    @staticmethod
+    def new_batch_http_request(callback: Optional[Callable] = None) -> LocalBatch:
+        return LocalBatch(callback)
+
+
+class LocalBlob:
+    # Blob of the local bucket. The metadata is read from the file like the attributes of a fetched blob.
+
+    def __init__(self, bucket: "LocalBucket", name: str, chunk_size: Optional[int] = None,
+                 generation: Optional[int] = None):
+        self.bucket: LocalBucket = bucket
+        self.name: str = name
+        self.chunk_size: Optional[int] = chunk_size
+        self.generation: Optional[int] = generation
+        self.size: Optional[int] = None
+        self.md5_hash: Optional[str] = None
+        self.crc32c: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.updated: Optional[dt.datetime] = None
+        self.content_type: Optional[str] = mimetypes.guess_type(name)[0]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bucket.path, self.name)
+
+    def reload(self) -> None:
+        if not os.path.exists(self.path):
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as file:
+            md5 = hashlib.md5()
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                md5.update(chunk)
+        self.size = stat.st_size
+        self.generation = stat.st_mtime_ns
+        self.md5_hash = base64.b64encode(md5.digest()).decode()
+        self.etag = md5.hexdigest()
+        self.updated = dt.datetime.fromtimestamp(stat.st_mtime, tz=pytz.UTC)
+
+    def exists(self) -> bool:
+        wait()
+        return os.path.exists(self.path)
+
+    def _write(self, write: Callable[[IO[bytes]], None]) -> None:
+        # Written to a temporary file first so that a reader never sees a partial blob
+        temp_path = f"{self.path}.{uuid.uuid4().hex}.part"
+        with open(temp_path, "wb") as file:
+            write(file)
+        os.replace(temp_path, self.path)
+        self.reload()
+
+    def upload_from_filename(self, filename: str, content_type: Optional[str] = None) -> None:
+        wait()
+
+        def write(file: IO[bytes]) -> None:
+            with open(filename, "rb") as source:
+                shutil.copyfileobj(source, file)
+
+        self._write(write)
+
+    def upload_from_file(self, file_obj: IO[bytes], content_type: Optional[str] = None, **_) -> None:
+        wait()
+        self._write(lambda file: shutil.copyfileobj(file_obj, file))
+
+    def download_to_filename(self, filename: str) -> None:
+        wait()
+        self.reload()
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        wait()
+        if not os.path.exists(self.path):
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        with open(self.path, "rb") as file:
+            file.seek(start or 0)
+            return file.read() if end is None else file.read(end - (start or 0) + 1)
+
+    def delete(self) -> None:
+        wait()
+        if not os.path.exists(self.path):
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        os.remove(self.path)
+
+
+class LocalBucket:
+    def __init__(self, name: str, path: str):
+        self.name: str = name
+        self.path: str = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def blob(self, name: str, chunk_size: Optional[int] = None, generation: Optional[int] = None) -> LocalBlob:
+        return LocalBlob(self, name, chunk_size, generation)
+
+    def get_blob(self, name: str) -> Optional[LocalBlob]:
+        wait()
+        blob = self.blob(name)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob
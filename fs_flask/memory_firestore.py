@@ -0,0 +1,625 @@
+import datetime as dt
+import math
+import random
+import string
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pytz
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud import firestore
+# noinspection PyProtectedMember
+from google.cloud.firestore_v1.base_query import _COMPARISON_OPERATORS
+
+from config import Config
+
+MEMORY = "memory"  # Firestore backend held in the memory of the process for development and load tests
+ASCENDING, DESCENDING = "ASCENDING", "DESCENDING"
+EQUAL, IN, ARRAY_CONTAINS, ARRAY_CONTAINS_ANY = "==", "in", "array_contains", "array_contains_any"
+NOT_EQUAL, NOT_IN = "!=", "not-in"
+INEQUALITY_OPERATORS = {"<", "<=", ">", ">=", NOT_EQUAL, NOT_IN}
+INDEXED_OPERATORS = {EQUAL, IN, ARRAY_CONTAINS, ARRAY_CONTAINS_ANY}
+ID_CHARACTERS = string.ascii_letters + string.digits
+# Order of the values of different types in Firestore
+TYPE_ORDER = {"null": 0, "boolean": 1, "number": 2, "timestamp": 3, "string": 4, "bytes": 5, "array": 6, "map": 7}
+
+
+def wait() -> None:
+    # Simulated round trip of a Firestore call. Never called while holding the store lock.
+    if Config.FIRESTORE_MEMORY_LATENCY:
+        time.sleep(Config.FIRESTORE_MEMORY_LATENCY)
+
+
+def auto_id() -> str:
+    return "".join(random.choice(ID_CHARACTERS) for _ in range(20))
+
+
+def utc_now() -> dt.datetime:
+    return dt.datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+
+def encode(value: Any) -> Any:
+    # Values are stored the way Firestore returns them. Naive datetimes are UTC and are returned timezone aware.
+    if isinstance(value, dt.datetime):
+        return value.replace(tzinfo=pytz.UTC) if value.tzinfo is None else value.astimezone(pytz.UTC)
+    if isinstance(value, (dt.date, set)):
+        raise TypeError(f"Cannot convert to a Firestore Value {value!r}")
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    return value
+
+
+def type_of(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, dt.datetime):
+        return "timestamp"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, bytes):
+        return "bytes"
+    if isinstance(value, list):
+        return "array"
+    return "map"
+
+
+def sort_key(value: Any) -> tuple:
+    value_type = type_of(value)
+    if value_type == "array":
+        return TYPE_ORDER[value_type], tuple(sort_key(item) for item in value)
+    if value_type == "map":
+        return TYPE_ORDER[value_type], tuple((key, sort_key(item)) for key, item in sorted(value.items()))
+    if value_type == "number" and math.isnan(value):
+        return TYPE_ORDER[value_type], -math.inf
+    return TYPE_ORDER[value_type], value if value is not None else 0
+
+
+def same(value: Any, other: Any) -> bool:
+    return type_of(value) == type_of(other) and value == other
+
+
+def index_key(value: Any) -> Optional[tuple]:
+    # Equal values of different types (like True and 1) are different keys
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return type_of(value), value
+
+
+MISSING = object()
+
+
+def copy_value(value: Any) -> Any:
+    # Stored values are only dicts, lists and immutable scalars which is faster to copy than deepcopy
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def get_field(doc_dict: dict, field_path: str) -> Any:
+    value = doc_dict
+    for field in field_path.split("."):
+        if not isinstance(value, dict) or field not in value:
+            return MISSING
+        value = value[field]
+    return value
+
+
+def set_field(doc_dict: dict, field_path: str, value: Any) -> None:
+    fields = field_path.split(".")
+    for field in fields[:-1]:
+        if not isinstance(doc_dict.get(field), dict):
+            doc_dict[field] = dict()
+        doc_dict = doc_dict[field]
+    doc_dict[fields[-1]] = value
+
+
+def resolve_timestamps(value: Any, commit_time: dt.datetime) -> Any:
+    # Server timestamps are the commit time of the write
+    if value is firestore.SERVER_TIMESTAMP:
+        return commit_time
+    if isinstance(value, dict):
+        return {key: resolve_timestamps(item, commit_time) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_timestamps(item, commit_time) for item in value]
+    return value
+
+
+def merge_into(doc_dict: dict, changes: dict) -> None:
+    # Nested maps are merged like a Firestore set with merge. Other values, including arrays, are replaced.
+    for field, value in changes.items():
+        if isinstance(value, dict) and isinstance(doc_dict.get(field), dict):
+            merge_into(doc_dict[field], value)
+        else:
+            doc_dict[field] = value
+
+
+def matches(value: Any, operator: str, filter_value: Any) -> bool:
+    if value is MISSING:
+        return False
+    if operator == EQUAL:
+        return same(value, filter_value)
+    if operator == IN:
+        return any(same(value, item) for item in filter_value)
+    if operator == ARRAY_CONTAINS:
+        return isinstance(value, list) and any(same(item, filter_value) for item in value)
+    if operator == ARRAY_CONTAINS_ANY:
+        return isinstance(value, list) and any(same(item, other) for item in value for other in filter_value)
+    if operator in (NOT_EQUAL, NOT_IN):
+        values = [filter_value] if operator == NOT_EQUAL else filter_value
+        return value is not None and not any(same(value, item) for item in values)
+    if type_of(value) != type_of(filter_value):
+        return False
+    value_key, filter_key = sort_key(value), sort_key(filter_value)
+    return {"<": value_key < filter_key, "<=": value_key <= filter_key, ">": value_key > filter_key,
+            ">=": value_key >= filter_key}[operator]
+
+
+class FieldIndex:
+    # Document ids by the value of a field. Array values are indexed by each item for array_contains queries.
+
+    def __init__(self):
+        self.values: Dict[tuple, Set[str]] = dict()
+        self.items: Dict[tuple, Set[str]] = dict()
+
+    @staticmethod
+    def _keys(value: Any) -> Tuple[Optional[tuple], List[tuple]]:
+        if value is MISSING:
+            return None, list()
+        items = [index_key(item) for item in value] if isinstance(value, list) else list()
+        return index_key(value), [key for key in items if key is not None]
+
+    def add(self, doc_id: str, value: Any) -> None:
+        value_key, item_keys = self._keys(value)
+        if value_key is not None:
+            self.values.setdefault(value_key, set()).add(doc_id)
+        for key in item_keys:
+            self.items.setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_id: str, value: Any) -> None:
+        value_key, item_keys = self._keys(value)
+        for keys, index in (([value_key] if value_key is not None else list(), self.values), (item_keys, self.items)):
+            for key in keys:
+                doc_ids = index.get(key)
+                if doc_ids is not None:
+                    doc_ids.discard(doc_id)
+                    if not doc_ids:
+                        del index[key]
+
+    def lookup(self, operator: str, filter_value: Any) -> Optional[Set[str]]:
+        # Candidate ids of a filter or None when the value cannot be looked up
+        values = filter_value if operator in (IN, ARRAY_CONTAINS_ANY) else [filter_value]
+        keys = [index_key(value) for value in values]
+        if any(key is None for key in keys):
+            return None
+        index = self.values if operator in (EQUAL, IN) else self.items
+        return set().union(*(index.get(key, set()) for key in keys))
+
+
+class MemoryCollectionData:
+    def __init__(self):
+        self.documents: Dict[str, dict] = dict()
+        self.indexes: Dict[str, FieldIndex] = dict()
+
+    def index(self, field_path: str) -> FieldIndex:
+        # Indexes are built on the first equality query of a field and then kept up to date by the writes
+        index = self.indexes.get(field_path)
+        if index is None:
+            index = FieldIndex()
+            for doc_id, doc_dict in self.documents.items():
+                index.add(doc_id, get_field(doc_dict, field_path))
+            self.indexes[field_path] = index
+        return index
+
+    def put(self, doc_id: str, doc_dict: Optional[dict]) -> None:
+        old_dict = self.documents.get(doc_id)
+        for field_path, index in self.indexes.items():
+            if old_dict is not None:
+                index.remove(doc_id, get_field(old_dict, field_path))
+            if doc_dict is not None:
+                index.add(doc_id, get_field(doc_dict, field_path))
+        if doc_dict is None:
+            self.documents.pop(doc_id, None)
+        else:
+            self.documents[doc_id] = doc_dict
+
+
+class MemoryStore:
+    # Documents of all the collections by collection path. The lock makes batches and transactions atomic.
+
+    def __init__(self):
+        self.collections: Dict[str, MemoryCollectionData] = dict()
+        self.lock = threading.RLock()
+        self.committed_at: dt.datetime = utc_now()
+
+    def commit_time(self) -> dt.datetime:
+        # Commit times are unique and increasing like the commit timestamps of Firestore. Called with the lock held.
+        self.committed_at = max(utc_now(), self.committed_at + dt.timedelta(microseconds=1))
+        return self.committed_at
+
+    def collection(self, path: str) -> MemoryCollectionData:
+        return self.collections.setdefault(path, MemoryCollectionData())
+
+    def clear(self) -> None:
+        with self.lock:
+            self.collections = dict()
+
+
+store = MemoryStore()
+
+
+class MemorySnapshot:
+    def __init__(self, reference: "MemoryDocumentReference", data: Optional[dict],
+                 field_paths: Optional[List[str]] = None):
+        self.reference: MemoryDocumentReference = reference
+        self._data: Optional[dict] = data
+        self._field_paths: Optional[List[str]] = field_paths
+        self.read_time: dt.datetime = utc_now()
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        if self._data is None:
+            return None
+        if self._field_paths is None:
+            return copy_value(self._data)
+        doc_dict = dict()
+        for field_path in self._field_paths:
+            value = get_field(self._data, field_path)
+            if value is not MISSING:
+                set_field(doc_dict, field_path, copy_value(value))
+        return doc_dict
+
+    def get(self, field_path: str) -> Any:
+        value = get_field(self._data or dict(), field_path)
+        if value is MISSING:
+            raise KeyError(f"{field_path!r} is not contained in the data")
+        return copy_value(value)
+
+
+class MemoryDocumentReference:
+    def __init__(self, client: "MemoryClient", collection_path: str, doc_id: str):
+        self._client: MemoryClient = client
+        self._collection_path: str = collection_path
+        self.id: str = doc_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MemoryDocumentReference) and self.path == other.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def __repr__(self) -> str:
+        return f"MemoryDocumentReference({self.path!r})"
+
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self) -> "MemoryCollection":
+        return self._client.collection(self._collection_path)
+
+    def collection(self, collection_id: str) -> "MemoryCollection":
+        return self._client.collection(self.path, collection_id)
+
+    def _snapshot(self, field_paths: Optional[List[str]] = None) -> MemorySnapshot:
+        with store.lock:
+            data = store.collection(self._collection_path).documents.get(self.id)
+        return MemorySnapshot(self, data, field_paths)
+
+    def get(self, field_paths: Optional[Iterable[str]] = None, transaction: Optional["MemoryTransaction"] = None,
+            **_) -> MemorySnapshot:
+        # Reads in a transaction are made while the transaction holds the lock and are not delayed
+        if transaction is None:
+            wait()
+        return self._snapshot(list(field_paths) if field_paths is not None else None)
+
+    def _write(self, method: Callable[["MemoryWriteBatch"], None]) -> None:
+        batch = self._client.batch()
+        method(batch)
+        batch.commit()
+
+    def create(self, document_data: dict) -> None:
+        self._write(lambda batch: batch.create(self, document_data))
+
+    def set(self, document_data: dict, merge: bool = False) -> None:
+        self._write(lambda batch: batch.set(self, document_data, merge=merge))
+
+    def update(self, field_updates: dict) -> None:
+        self._write(lambda batch: batch.update(self, field_updates))
+
+    def delete(self) -> None:
+        self._write(lambda batch: batch.delete(self))
+
+
+class MemoryQuery:
+    ASCENDING, DESCENDING = ASCENDING, DESCENDING
+
+    def __init__(self, parent: "MemoryCollection", filters: Tuple[Tuple[str, str, Any], ...] = tuple(),
+                 orders: Tuple[Tuple[str, str], ...] = tuple(), limit: Optional[int] = None,
+                 projection: Optional[List[str]] = None):
+        self._parent: MemoryCollection = parent
+        self._filters: Tuple[Tuple[str, str, Any], ...] = filters
+        self._orders: Tuple[Tuple[str, str], ...] = orders
+        self._limit: Optional[int] = limit
+        self._projection: Optional[List[str]] = projection
+
+    def _copy(self, **changes) -> "MemoryQuery":
+        attributes = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                          projection=self._projection)
+        attributes.update(changes)
+        return MemoryQuery(self._parent, **attributes)
+
+    def where(self, field_path: str, op_string: str, value: Any) -> "MemoryQuery":
+        if op_string not in _COMPARISON_OPERATORS:
+            raise ValueError(f"Operator string {op_string!r} is invalid.")
+        if value is None and op_string != EQUAL:
+            raise ValueError('Only an equality filter ("==") can be used with None or NaN values')
+        return self._copy(filters=self._filters + ((field_path, op_string, encode(value)),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "MemoryQuery":
+        if direction not in (ASCENDING, DESCENDING):
+            raise ValueError(f"Invalid direction {direction!r}.")
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "MemoryQuery":
+        return self._copy(limit=count)
+
+    def select(self, field_paths: Iterable[str]) -> "MemoryQuery":
+        return self._copy(projection=list(field_paths))
+
+    def _candidates(self, data: MemoryCollectionData) -> Iterable[str]:
+        candidates: Optional[Set[str]] = None
+        for field_path, operator, value in self._filters:
+            if operator not in INDEXED_OPERATORS:
+                continue
+            doc_ids = data.index(field_path).lookup(operator, value)
+            if doc_ids is None:
+                continue
+            candidates = doc_ids if candidates is None else candidates & doc_ids
+        return candidates if candidates is not None else list(data.documents)
+
+    def _sort(self, results: List[Tuple[str, dict]]) -> List[Tuple[str, dict]]:
+        # Without an order an inequality field is the order like in Firestore. Ties are in the order of the ids.
+        orders = list(self._orders)
+        if not orders:
+            orders = [(field_path, ASCENDING) for field_path, operator, _ in self._filters
+                      if operator in INEQUALITY_OPERATORS][:1]
+        results = [result for result in results
+                   if all(get_field(result[1], field_path) is not MISSING for field_path, _ in orders)]
+        results.sort(key=lambda result: result[0])
+        for field_path, direction in reversed(orders):
+            results.sort(key=lambda result: sort_key(get_field(result[1], field_path)),
+                         reverse=direction == DESCENDING)
+        return results
+
+    def _run(self) -> List[MemorySnapshot]:
+        collection_path = self._parent.path
+        with store.lock:
+            data = store.collection(collection_path)
+            results = [(doc_id, data.documents[doc_id]) for doc_id in self._candidates(data)
+                       if doc_id in data.documents]
+        results = [(doc_id, doc_dict) for doc_id, doc_dict in results
+                   if all(matches(get_field(doc_dict, field_path), operator, value)
+                          for field_path, operator, value in self._filters)]
+        results = self._sort(results)
+        if self._limit is not None:
+            results = results[:self._limit]
+        client = self._parent.client
+        return [MemorySnapshot(MemoryDocumentReference(client, collection_path, doc_id), doc_dict, self._projection)
+                for doc_id, doc_dict in results]
+
+    def stream(self, transaction: Optional["MemoryTransaction"] = None, **_) -> Iterator[MemorySnapshot]:
+        # Stored documents are replaced and never changed in place by the writes, so the results are a snapshot
+        if transaction is None:
+            wait()
+        yield from self._run()
+
+    def get(self, transaction: Optional["MemoryTransaction"] = None, **_) -> List[MemorySnapshot]:
+        return list(self.stream(transaction=transaction))
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, client: "MemoryClient", path: str):
+        super().__init__(self)
+        self.client: MemoryClient = client
+        self.path: str = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self.client, self.path, document_id or auto_id())
+
+    def add(self, document_data: dict,
+            document_id: Optional[str] = None) -> Tuple[dt.datetime, MemoryDocumentReference]:
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return utc_now(), reference
+
+    def list_documents(self, **_) -> List[MemoryDocumentReference]:
+        with store.lock:
+            doc_ids = list(store.collection(self.path).documents)
+        return [self.document(doc_id) for doc_id in doc_ids]
+
+
+Staged = Dict[Tuple[str, str], Optional[dict]]
+
+
+class MemoryWriteBatch:
+    # Writes are staged and checked together when committed, so that a failed write leaves every document unchanged
+
+    def __init__(self, client: "MemoryClient"):
+        self._client: MemoryClient = client
+        self._writes: List[Callable[[Staged], None]] = list()
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    @staticmethod
+    def _current(staged: Staged, reference: MemoryDocumentReference) -> Optional[dict]:
+        key = (reference._collection_path, reference.id)
+        if key in staged:
+            return staged[key]
+        return store.collection(reference._collection_path).documents.get(reference.id)
+
+    def create(self, reference: MemoryDocumentReference, document_data: dict) -> None:
+        doc_dict = encode(document_data)
+
+        def create(staged: Staged) -> None:
+            if self._current(staged, reference) is not None:
+                raise AlreadyExists(f"Document already exists: {reference.path}")
+            staged[reference._collection_path, reference.id] = doc_dict
+
+        self._writes.append(create)
+
+    def set(self, reference: MemoryDocumentReference, document_data: dict, merge: bool = False) -> None:
+        doc_dict = encode(document_data)
+
+        def set_document(staged: Staged) -> None:
+            new_dict = copy_value(self._current(staged, reference) or dict()) if merge else dict()
+            merge_into(new_dict, copy_value(doc_dict))
+            staged[reference._collection_path, reference.id] = new_dict
+
+        self._writes.append(set_document)
+
+    def update(self, reference: MemoryDocumentReference, field_updates: dict) -> None:
+        fields = encode(field_updates)
+
+        def update(staged: Staged) -> None:
+            doc_dict = self._current(staged, reference)
+            if doc_dict is None:
+                raise NotFound(f"No document to update: {reference.path}")
+            new_dict = copy_value(doc_dict)
+            for field_path, value in fields.items():
+                set_field(new_dict, field_path, value)
+            staged[reference._collection_path, reference.id] = new_dict
+
+        self._writes.append(update)
+
+    def delete(self, reference: MemoryDocumentReference, **_) -> None:
+        def delete(staged: Staged) -> None:
+            staged[reference._collection_path, reference.id] = None
+
+        self._writes.append(delete)
+
+    def _apply(self) -> None:
+        staged: Staged = dict()
+        with store.lock:
+            try:
+                for write in self._writes:
+                    write(staged)
+            finally:
+                self._writes = list()
+            commit_time = store.commit_time()
+            for (collection_path, doc_id), doc_dict in staged.items():
+                store.collection(collection_path).put(doc_id, resolve_timestamps(doc_dict, commit_time))
+
+    def commit(self) -> list:
+        wait()
+        self._apply()
+        return list()
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    # Serializable transaction which holds the store lock from the begin to the commit or the rollback.
+    # Implements the methods called by the transactional decorator of google.cloud.firestore.
+
+    def __init__(self, client: "MemoryClient", max_attempts: int = 1, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts: int = max_attempts
+        self._read_only: bool = read_only
+        self._id: Optional[bytes] = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def _clean_up(self) -> None:
+        self._writes = list()
+        self._id = None
+
+    def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        wait()
+        store.lock.acquire()
+        self._id = auto_id().encode()
+
+    def _rollback(self) -> None:
+        if not self.in_progress:
+            return
+        self._clean_up()
+        store.lock.release()
+
+    def _commit(self) -> list:
+        try:
+            self._apply()
+        finally:
+            self._clean_up()
+            store.lock.release()
+        return list()
+
+    def get(self, ref_or_query, **_) -> Iterator[MemorySnapshot]:
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+
+class MemoryClient:
+    # Stand-in for google.cloud.firestore.Client. All the clients of a process share the same store.
+
+    def __init__(self, *_, **__):
+        self.project: str = MEMORY
+
+    def collection(self, *collection_path: str) -> MemoryCollection:
+        return MemoryCollection(self, "/".join(collection_path))
+
+    def document(self, *document_path: str) -> MemoryDocumentReference:
+        path = "/".join(document_path)
+        collection_path, doc_id = path.rsplit("/", 1)
+        return MemoryDocumentReference(self, collection_path, doc_id)
+
+    def collections(self) -> List[MemoryCollection]:
+        with store.lock:
+            paths = [path for path in store.collections if "/" not in path]
+        return [self.collection(path) for path in paths]
+
+    def get_all(self, references: Iterable[MemoryDocumentReference], field_paths: Optional[Iterable[str]] = None,
+                transaction: Optional[MemoryTransaction] = None, **_) -> Iterator[MemorySnapshot]:
+        references = list(references)
+        if transaction is None:
+            wait()
+        field_paths = list(field_paths) if field_paths is not None else None
+        for reference in references:
+            yield reference._snapshot(field_paths)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 1, read_only: bool = False) -> MemoryTransaction:
+        return MemoryTransaction(self, max_attempts, read_only)
+
+
+def install_memory_firestore() -> None:
+    # firestore_ci creates its client when it is imported, so the client class is replaced before that import
+    if "firestore_ci" in sys.modules:
+        raise RuntimeError("The memory Firestore backend must be installed before firestore_ci is imported")
+    firestore.Client = MemoryClient
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional, Tuple, Callable, Iterable, Iterator, TypeVar
+
+from firestore_ci import FirestoreDocument, FirestoreQuery
+from flask import Flask, Response, request, before_render_template, template_rendered
+
+FIRESTORE, GOOGLE, FORM, RENDER, TOTAL = "firestore", "google", "form", "render", "total"
+CATEGORIES = (FIRESTORE, GOOGLE, FORM, RENDER)
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # upper bounds in milliseconds
+
+_T = TypeVar("_T")
+
+
+class Histogram:
+    # Fixed bucket latency histogram in milliseconds. The last bucket counts everything above the largest bound.
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def observe(self, duration: float) -> None:
+        self.buckets[bisect_left(BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, fraction: float) -> float:
+        # Upper bound of the bucket which holds the rank (limited to the maximum seen)
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(float(BUCKETS[index]), self.max) if index < len(BUCKETS) else self.max
+        return 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": round(self.mean, 1), "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95), "p99": self.percentile(0.99), "max": round(self.max, 1)}
+
+
+class RequestTimings:
+    # Calls and milliseconds spent in each category by the current request.
+    # Categories can overlap e.g. the Firestore queries made during form validation are counted in both.
+
+    def __init__(self):
+        self.started_at: float = time.perf_counter()
+        self.calls: Dict[str, int] = {category: 0 for category in CATEGORIES}
+        self.durations: Dict[str, float] = {category: 0.0 for category in CATEGORIES}
+        self.render_started: List[float] = list()
+
+    def add(self, category: str, duration: float, calls: int = 1) -> None:
+        self.calls[category] += calls
+        self.durations[category] += duration
+
+    @property
+    def elapsed(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def server_timing(self) -> str:
+        metrics = [f'{category};dur={self.durations[category]:.1f};desc="{self.calls[category]} calls"'
+                   for category in CATEGORIES if self.calls[category]]
+        metrics.append(f"{TOTAL};dur={self.elapsed:.1f}")
+        return ", ".join(metrics)
+
+
+class Metrics:
+    # Latency histograms per route and category aggregated across the requests of this worker process
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = dict()
+        self.started_at: float = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Optional[RequestTimings]:
+        return getattr(self._local, "timings", None)
+
+    def begin(self) -> RequestTimings:
+        self._local.timings = RequestTimings()
+        return self._local.timings
+
+    def end(self) -> Optional[RequestTimings]:
+        timings = self.current
+        self._local.timings = None
+        return timings
+
+    def observe(self, route: str, timings: RequestTimings) -> None:
+        observations = [(category, timings.durations[category]) for category in CATEGORIES if timings.calls[category]]
+        observations.append((TOTAL, timings.elapsed))
+        with self._lock:
+            for category, duration in observations:
+                self.histograms.setdefault((route, category), Histogram()).observe(duration)
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            rows = [dict(route=route, category=category, **histogram.to_dict())
+                    for (route, category), histogram in self.histograms.items()]
+        rows.sort(key=lambda row: (row["route"], row["category"] != TOTAL, row["category"]))
+        return rows
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def timed(category: str, calls: int = 1) -> Iterator[None]:
+    # Adds the time of the block to the current request. Outside a request it does nothing.
+    timings = metrics.current
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(category, (time.perf_counter() - start) * 1000, calls)
+
+
+def timed_call(category: str) -> Callable[[Callable[..., _T]], Callable[..., _T]]:
+    def decorator(function: Callable[..., _T]) -> Callable[..., _T]:
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> _T:
+            with timed(category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_iter(category: str, iterable: Iterable[_T]) -> Iterator[_T]:
+    # Times the fetching of every item of a lazy iterator (like a Firestore stream) as a single call
+    iterator = iter(iterable)
+    calls = 1
+    while True:
+        with timed(category, calls):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        calls = 0
+        yield item
+
+
+def instrument_firestore() -> None:
+    # The queries and reads of firestore_ci are timed for every model
+    FirestoreQuery.get = timed_call(FIRESTORE)(FirestoreQuery.get)
+    FirestoreQuery.first = timed_call(FIRESTORE)(FirestoreQuery.first)
+    FirestoreQuery.delete = timed_call(FIRESTORE)(FirestoreQuery.delete)
+    FirestoreDocument.get_by_id = classmethod(timed_call(FIRESTORE)(FirestoreDocument.get_by_id.__func__))
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _before_request() -> None:
+    if request.endpoint != "static":
+        metrics.begin()
+
+
+def _after_request(response: Response) -> Response:
+    # For streamed responses, the total is the time taken to start the response
+    timings = metrics.end()
+    if timings is None:
+        return response
+    response.headers["Server-Timing"] = timings.server_timing()
+    metrics.observe(_route(), timings)
+    log = {"route": _route(), "method": request.method, "status": response.status_code,
+           "total_ms": round(timings.elapsed, 1)}
+    log.update({category: {"calls": timings.calls[category], "ms": round(timings.durations[category], 1)}
+                for category in CATEGORIES if timings.calls[category]})
+    print(json.dumps(log))
+    return response
+
+
+def _teardown_request(_) -> None:
+    # Timings of a request which failed before after_request must not leak into the next request of the thread
+    metrics.end()
+
+
+def _before_render(_, **__) -> None:
+    timings = metrics.current
+    if timings is not None:
+        timings.render_started.append(time.perf_counter())
+
+
+def _rendered(_, **__) -> None:
+    timings = metrics.current
+    if timings is not None and timings.render_started:
+        timings.add(RENDER, (time.perf_counter() - timings.render_started.pop()) * 1000)
+
+
+def install(app: Flask) -> None:
+    instrument_firestore()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import List, Optional, Tuple, Iterator, Union, NamedTuple, Iterable
+
+from firestore_ci import FirestoreDocument, FirestoreQuery
+from flask import Flask, Response, request
+from google.cloud.firestore import CollectionReference, Query
+# noinspection PyProtectedMember
+from google.cloud.firestore_v1._helpers import decode_value
+# noinspection PyProtectedMember
+from google.cloud.firestore_v1.base_query import _COMPARISON_OPERATORS
+
+from config import Config
+from fs_flask.memory_firestore import MemoryQuery, MemoryCollection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames of these modules are skipped in the stacks since they only forward the query
+SKIPPED_MODULES = tuple(os.path.join(ROOT, "fs_flask", name) for name in ("query_audit.py", "metrics.py",
+                                                                           "db_methods.py"))
+STACK_DEPTH = 6
+REPEATED, SAME_SHAPE = "repeated", "same_shape"
+
+
+class QueryRecord(NamedTuple):
+    shape: str  # Query with the values replaced by ?
+    statement: str  # Query with the values
+    stack: Tuple[str, ...]
+
+
+def describe(query_ref: Union[Query, CollectionReference, MemoryQuery], action: str = "query") -> Tuple[str, str]:
+    # Returns the shape and the statement of a Firestore query e.g. "usages where hotel in ? and date >= ?"
+    if isinstance(query_ref, (CollectionReference, MemoryCollection)):
+        return f"{action} {query_ref.id}", f"{action} {query_ref.id}"
+    collection, query_filters, orders, limit = _memory_parts(query_ref) if isinstance(query_ref, MemoryQuery) \
+        else _parts(query_ref)
+    shape_parts: List[str] = list()
+    statement_parts: List[str] = list()
+    for field, operator, value in query_filters:
+        if value is not None:
+            shape_parts.append(f"{field} {operator} ?")
+            statement_parts.append(f"{field} {operator} {value}")
+        else:
+            shape_parts.append(f"{field} {operator}")
+            statement_parts.append(f"{field} {operator}")
+    prefix = f"{action} {collection}"
+    suffix = "".join(f" order by {field} {direction}" for field, direction in orders)
+    if limit is not None:
+        suffix += f" limit {limit}"
+    where = " where " if query_filters else str()
+    return f"{prefix}{where}{' and '.join(shape_parts)}{suffix}", \
+           f"{prefix}{where}{' and '.join(statement_parts)}{suffix}"
+
+
+_QueryParts = Tuple[str, List[Tuple[str, str, Optional[str]]], List[Tuple[str, str]], Optional[int]]
+
+
+def _parts(query_ref: Query) -> _QueryParts:
+    # Collection, filters with the formatted values, orders and limit of a google.cloud.firestore query
+    query_filters = list()
+    # noinspection PyProtectedMember
+    for query_filter in query_ref._field_filters:
+        value = getattr(query_filter, "value", None)  # Unary filters like IS_NULL do not have a value
+        query_filters.append((query_filter.field.field_path, query_filter.op.name,
+                              _format_value(value) if value is not None else None))
+    # noinspection PyProtectedMember
+    orders = [(order.field.field_path, order.direction.name) for order in query_ref._orders]
+    # noinspection PyProtectedMember
+    return query_ref._parent.id, query_filters, orders, query_ref._limit
+
+
+def _format_value(value) -> str:
+    try:
+        return repr(decode_value(value, None))
+    except (AttributeError, TypeError, ValueError):
+        # Values like document references need a client to be decoded and the protocol buffer is printed instead
+        return " ".join(str(value).split())
+
+
+def _memory_parts(query_ref: MemoryQuery) -> _QueryParts:
+    # Operators are named like the operators of google.cloud.firestore queries so that the findings are the same
+    query_filters = list()
+    # noinspection PyProtectedMember
+    for field, operator, value in query_ref._filters:
+        if value is None:
+            query_filters.append((field, "IS_NULL", None))
+        else:
+            query_filters.append((field, _COMPARISON_OPERATORS[operator].name, repr(value)))
+    # noinspection PyProtectedMember
+    return query_ref._parent.id, query_filters, list(query_ref._orders), query_ref._limit
+
+
+def get_stack() -> Tuple[str, ...]:
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(ROOT) and not frame.filename.startswith(SKIPPED_MODULES)]
+    return tuple(f"{os.path.relpath(frame.filename, ROOT)}:{frame.lineno} in {frame.name}"
+                 for frame in frames[-STACK_DEPTH:])
+
+
+class AuditReport:
+    # Findings of an audit session. An identical query made more than once is repeated. A query shape made at least
+    # threshold times with different values is a query in a loop (N+1) which can usually be made as a single query.
+
+    def __init__(self, label: str, records: List[QueryRecord], threshold: int):
+        self.label: str = label
+        self.records: List[QueryRecord] = records
+        self.findings: List[dict] = list()
+        statements = Counter(record.statement for record in records)
+        shapes = Counter(record.shape for record in records)
+        for statement, count in statements.items():
+            if count > 1:
+                self.findings.append(self.finding(REPEATED, statement, count,
+                                                  [record for record in records if record.statement == statement]))
+        for shape, count in shapes.items():
+            distinct = len({record.statement for record in records if record.shape == shape})
+            if distinct >= threshold:
+                self.findings.append(self.finding(SAME_SHAPE, shape, count,
+                                                  [record for record in records if record.shape == shape]))
+
+    @staticmethod
+    def finding(kind: str, query: str, count: int, records: List[QueryRecord]) -> dict:
+        # Every distinct stack which made the query is reported
+        stacks = list(dict.fromkeys(record.stack for record in records))
+        return {"kind": kind, "query": query, "count": count, "stacks": [list(stack) for stack in stacks]}
+
+    @property
+    def summary(self) -> str:
+        kinds = Counter(finding["kind"] for finding in self.findings)
+        return f"{len(self.records)} queries; {kinds[REPEATED]} {REPEATED}; {kinds[SAME_SHAPE]} {SAME_SHAPE}"
+
+    def to_dict(self) -> dict:
+        return {"label": self.label, "queries": len(self.records), "findings": self.findings}
+
+    def log(self) -> None:
+        if self.findings:
+            print(json.dumps({"query_audit": self.to_dict()}))
+
+
+class QueryAudit:
+    # Diagnostic mode which records the Firestore queries and reads of a request (or of a script) with their stacks.
+    # A script session started with audit() collects the queries of all the threads which are not in a request.
+
+    def __init__(self, threshold: int):
+        self.threshold: int = threshold
+        self.installed: bool = False
+        self._local = threading.local()
+        self._script: Optional[List[QueryRecord]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def records(self) -> Optional[List[QueryRecord]]:
+        records = getattr(self._local, "records", None)
+        return records if records is not None else self._script
+
+    def record(self, shape: str, statement: str) -> None:
+        records = self.records
+        if records is None:
+            return
+        with self._lock:
+            records.append(QueryRecord(shape, statement, get_stack()))
+
+    def record_query(self, query_ref: Union[Query, CollectionReference], action: str = "query") -> None:
+        if self.records is not None:
+            self.record(*describe(query_ref, action))
+
+    def record_reads(self, collection: str, doc_ids: Iterable[str]) -> None:
+        if self.records is not None:
+            doc_ids = list(doc_ids)
+            self.record(f"get {collection} ids ({len(doc_ids)})", f"get {collection} ids {doc_ids}")
+
+    def begin(self) -> None:
+        self._local.records = list()
+
+    def end(self, label: str) -> Optional[AuditReport]:
+        records = getattr(self._local, "records", None)
+        self._local.records = None
+        return AuditReport(label, records, self.threshold) if records is not None else None
+
+    @contextmanager
+    def audit(self, label: str) -> Iterator[List[AuditReport]]:
+        # Usage: with query_audit.audit("update_data_entry_dates") as reports: fs.update_data_entry_dates()
+        # The report is appended to the yielded list at the end of the block and is also logged.
+        self.install_firestore()
+        reports: List[AuditReport] = list()
+        self._script = list()
+        try:
+            yield reports
+        finally:
+            report = AuditReport(label, self._script, self.threshold)
+            self._script = None
+            report.log()
+            reports.append(report)
+
+    def install_firestore(self) -> None:
+        if self.installed:
+            return
+        self.installed = True
+        query_get, query_first, query_delete = FirestoreQuery.get, FirestoreQuery.first, FirestoreQuery.delete
+        get_by_id = FirestoreDocument.get_by_id.__func__
+
+        def query_ref(query: FirestoreQuery):
+            # noinspection PyProtectedMember
+            return query._doc_ref if query._query_ref is None else query._query_ref
+
+        @wraps(query_get)
+        def get(query: FirestoreQuery, *args, **kwargs):
+            self.record_query(query_ref(query))
+            return query_get(query, *args, **kwargs)
+
+        @wraps(query_first)
+        def first(query: FirestoreQuery, *args, **kwargs):
+            self.record_query(query_ref(query).limit(1))
+            return query_first(query, *args, **kwargs)
+
+        @wraps(query_delete)
+        def delete(query: FirestoreQuery, *args, **kwargs):
+            self.record_query(query_ref(query), action="delete")
+            return query_delete(query, *args, **kwargs)
+
+        @wraps(get_by_id)
+        def get_document(cls, doc_id: str, *args, **kwargs):
+            self.record_reads(cls.COLLECTION, [doc_id])
+            return get_by_id(cls, doc_id, *args, **kwargs)
+
+        FirestoreQuery.get, FirestoreQuery.first, FirestoreQuery.delete = get, first, delete
+        FirestoreDocument.get_by_id = classmethod(get_document)
+
+    def install(self, app: Flask) -> None:
+        # Every request is audited. The summary is sent in the Query-Audit header for load tests and benchmarks.
+        self.install_firestore()
+
+        @app.before_request
+        def begin_audit() -> None:
+            if request.endpoint != "static":
+                self.begin()
+
+        @app.after_request
+        def end_audit(response: Response) -> Response:
+            report = self.end(request.url_rule.rule if request.url_rule else "unmatched")
+            if report:
+                report.log()
+                response.headers["Query-Audit"] = report.summary
+            return response
+
+        @app.teardown_request
+        def clear_audit(_) -> None:
+            self._local.records = None
+
+
+query_audit = QueryAudit(Config.QUERY_AUDIT_THRESHOLD)
@@ -0,0 +1,311 @@
+import datetime as dt
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import List, Optional, Tuple, Set, Dict, Iterable, Iterator
+
+from config import Config, Date
+from fs_flask.change_feed import last_position, read_changes, DELETE
+from fs_flask.db_methods import stream, utc_now, get_all
+from fs_flask.hotel import Hotel
+from fs_flask.usage import Usage
+
+USAGE_COLUMNS = ("id", "city", "hotel", "date", "day", "month", "weekday", "timing", "client", "event_type", "meals",
+                 "ballrooms", "event_description", "no_event", "updated_at")
+HOTEL_COLUMNS = ("id", "city", "name", "document", "updated_at")
+KPI_METRICS = ("events", "morning_events", "evening_events", "corporate_events", "social_events", "weekday_events",
+               "weekend_events", "slots", "morning_slots", "evening_slots")
+# Occupancy metric: (slot metric, timings per day)
+OCCUPANCY_METRICS = {"occupancy": ("slots", 2), "morning_occupancy": ("morning_slots", 1),
+                     "evening_occupancy": ("evening_slots", 1)}
+DAY, WEEK, MONTH = "day", "week", "month"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usages (
+    id TEXT PRIMARY KEY, city TEXT, hotel TEXT, date TEXT, day TEXT, month TEXT, weekday INTEGER, timing TEXT,
+    client TEXT, event_type TEXT, meals TEXT, ballrooms TEXT, event_description TEXT, no_event INTEGER,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS usages_slot ON usages (city, hotel, date, timing);
+CREATE INDEX IF NOT EXISTS usages_event_type ON usages (event_type);
+CREATE TABLE IF NOT EXISTS hotels (
+    id TEXT PRIMARY KEY, city TEXT, name TEXT, document TEXT, updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS hotels_name ON hotels (city, name);
+CREATE TABLE IF NOT EXISTS kpis (
+    city TEXT, hotel TEXT, granularity TEXT, period_id TEXT, events INTEGER, morning_events INTEGER,
+    evening_events INTEGER, corporate_events INTEGER, social_events INTEGER, weekday_events INTEGER,
+    weekend_events INTEGER, slots INTEGER, morning_slots INTEGER, evening_slots INTEGER,
+    PRIMARY KEY (city, granularity, period_id, hotel)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _format_timestamp(timestamp: Optional[dt.datetime]) -> str:
+    return timestamp.isoformat() if isinstance(timestamp, dt.datetime) else str()
+
+
+def _parse_timestamp(timestamp: str) -> Optional[dt.datetime]:
+    return dt.datetime.fromisoformat(timestamp) if timestamp else None
+
+
+def usage_to_row(usage: Usage) -> tuple:
+    return (usage.id, usage.city, usage.hotel, usage.date, usage.day, usage.month,
+            None if usage.weekday is None else int(usage.weekday), usage.timing, usage.client, usage.event_type,
+            json.dumps(usage.meals), json.dumps(usage.ballrooms), usage.event_description, int(usage.no_event),
+            _format_timestamp(usage.updated_at))
+
+
+def row_to_usage(row: sqlite3.Row) -> Usage:
+    doc_dict = dict(row)
+    doc_dict["weekday"] = None if row["weekday"] is None else bool(row["weekday"])
+    doc_dict["meals"] = json.loads(row["meals"])
+    doc_dict["ballrooms"] = json.loads(row["ballrooms"])
+    doc_dict["no_event"] = bool(row["no_event"])
+    doc_dict["updated_at"] = _parse_timestamp(row["updated_at"])
+    return Usage.dict_to_doc(doc_dict, doc_dict.pop("id"))
+
+
+def hotel_to_row(hotel: Hotel) -> tuple:
+    return hotel.id, hotel.city, hotel.name, json.dumps(hotel.doc_to_dict(), default=str), \
+           _format_timestamp(hotel.updated_at)
+
+
+def kpi_periods(db_date: str) -> List[Tuple[str, str, dt.date, dt.date]]:
+    # Periods (granularity, period id, start date, end date) which include the date.
+    # Weeks start on Monday and are identified by the date of the Monday.
+    date = Date(db_date).date
+    if not date:
+        return list()
+    monday = date - dt.timedelta(days=date.weekday())
+    first_date = date.replace(day=1)
+    last_date = (first_date + dt.timedelta(days=32)).replace(day=1) - dt.timedelta(days=1)
+    return [(DAY, db_date, date, date), (WEEK, Date(monday).db_date, monday, monday + dt.timedelta(days=6)),
+            (MONTH, date.strftime("%Y-%m"), first_date, last_date)]
+
+
+def period_days(granularity: str, period_id: str) -> int:
+    if granularity == DAY:
+        return 1
+    if granularity == WEEK:
+        return 7
+    _, _, start_date, end_date = kpi_periods(f"{period_id}-01")[2]
+    return (end_date - start_date).days + 1
+
+
+def kpi_row(usages: List[sqlite3.Row]) -> Tuple[int, ...]:
+    counts = dict.fromkeys(KPI_METRICS, 0)
+    for usage in usages:
+        slots = len(json.loads(usage["ballrooms"]))
+        timing = "morning" if usage["timing"] == Config.MORNING else "evening"
+        counts["events"] += 1
+        counts[f"{timing}_events"] += 1
+        counts["slots"] += slots
+        counts[f"{timing}_slots"] += slots
+        counts["weekday_events" if usage["weekday"] else "weekend_events"] += 1
+        if usage["event_type"] == Config.MICE:
+            counts["corporate_events"] += 1
+        elif usage["event_type"] == Config.SOCIAL:
+            counts["social_events"] += 1
+    return tuple(counts[metric] for metric in KPI_METRICS)
+
+
+class Replica:
+    # Local SQLite copy of Usage and Hotel used for historical queries of closed periods.
+    # It is synced incrementally from the change feed.
+    USAGE_FILTERS = ("no_event", "weekday", "timing", "event_type")
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._sync_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def create_tables(self) -> None:
+        with closing(self.connect()) as connection:
+            connection.executescript(SCHEMA)
+
+    def get_meta(self, key: str) -> str:
+        if not os.path.exists(self.path):
+            return str()
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else str()
+
+    @property
+    def synced_at(self) -> Optional[dt.datetime]:
+        return _parse_timestamp(self.get_meta("synced_at"))
+
+    def sync(self, full: bool = False) -> Tuple[int, int]:
+        # The first sync loads the collections. Later syncs replay the change feed from the last synced position.
+        with self._sync_lock:
+            self.create_tables()
+            started_at = utc_now()
+            position = _parse_timestamp(self.get_meta("position"))
+            with closing(self.connect()) as connection:
+                if full or not position:
+                    usages, hotels = self.load(connection)
+                else:
+                    usages, hotels = self.replay(connection, position)
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)",
+                                   (started_at.isoformat(),))
+                connection.commit()
+        return usages, hotels
+
+    @staticmethod
+    def upsert_usage(connection: sqlite3.Connection, usage: Usage, changed: Set[Tuple[str, str, str]]) -> None:
+        # The previous (city, hotel, date) of the event also needs its KPIs to be recomputed
+        previous = connection.execute("SELECT city, hotel, date FROM usages WHERE id = ?", (usage.id,)).fetchone()
+        if previous:
+            changed.add(tuple(previous))
+        changed.add((usage.city, usage.hotel, usage.date))
+        connection.execute(f"INSERT OR REPLACE INTO usages ({', '.join(USAGE_COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(USAGE_COLUMNS))})", usage_to_row(usage))
+
+    @staticmethod
+    def delete_usage(connection: sqlite3.Connection, doc_id: str, changed: Set[Tuple[str, str, str]]) -> None:
+        previous = connection.execute("SELECT city, hotel, date FROM usages WHERE id = ?", (doc_id,)).fetchone()
+        if previous:
+            changed.add(tuple(previous))
+        connection.execute("DELETE FROM usages WHERE id = ?", (doc_id,))
+
+    @staticmethod
+    def upsert_hotels(connection: sqlite3.Connection, hotels: Iterable[Hotel]) -> int:
+        return connection.executemany(f"INSERT OR REPLACE INTO hotels ({', '.join(HOTEL_COLUMNS)}) "
+                                      f"VALUES ({', '.join('?' * len(HOTEL_COLUMNS))})",
+                                      (hotel_to_row(hotel) for hotel in hotels)).rowcount
+
+    def load(self, connection: sqlite3.Connection) -> Tuple[int, int]:
+        # Changes committed while the collections are being loaded are replayed again by the next sync
+        position = last_position()
+        connection.execute("DELETE FROM usages")
+        connection.execute("DELETE FROM hotels")
+        connection.execute("DELETE FROM kpis")
+        changed: Set[Tuple[str, str, str]] = set()
+        usages = 0
+        for usage in stream(Usage.objects):
+            self.upsert_usage(connection, usage, changed)
+            usages += 1
+        hotels = self.upsert_hotels(connection, stream(Hotel.objects))
+        self.update_kpis(connection, changed)
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('position', ?)",
+                           (_format_timestamp(position),))
+        return usages, hotels
+
+    def replay(self, connection: sqlite3.Connection, position: dt.datetime) -> Tuple[int, int]:
+        changed: Set[Tuple[str, str, str]] = set()
+        usages = hotels = 0
+        changes = read_changes(position)
+        while changes:
+            # Only the last operation of a document matters. Documents which no longer exist are deleted.
+            operations = {(change.collection, change.doc_id): change.operation for change in changes}
+            for document_class in (Usage, Hotel):
+                doc_ids = [doc_id for (collection, doc_id), operation in operations.items()
+                           if collection == document_class.COLLECTION and operation != DELETE]
+                documents = get_all(document_class, doc_ids) if doc_ids else list()
+                existing_ids = {document.id for document in documents}
+                deleted_ids = [doc_id for (collection, doc_id) in operations
+                               if collection == document_class.COLLECTION and doc_id not in existing_ids]
+                if document_class is Usage:
+                    for usage in documents:
+                        self.upsert_usage(connection, usage, changed)
+                    for doc_id in deleted_ids:
+                        self.delete_usage(connection, doc_id, changed)
+                    usages += len(documents) + len(deleted_ids)
+                else:
+                    self.upsert_hotels(connection, documents)
+                    connection.executemany("DELETE FROM hotels WHERE id = ?", [(doc_id,) for doc_id in deleted_ids])
+                    hotels += len(documents) + len(deleted_ids)
+            position = changes[-1].committed_at
+            changes = read_changes(position)
+        self.update_kpis(connection, changed)
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('position', ?)",
+                           (_format_timestamp(position),))
+        return usages, hotels
+
+    @staticmethod
+    def update_kpis(connection: sqlite3.Connection, changed: Set[Tuple[str, str, str]]) -> None:
+        periods = {(city, hotel, *period) for city, hotel, date in changed for period in kpi_periods(date)}
+        for city, hotel, granularity, period_id, start_date, end_date in periods:
+            usages = connection.execute("SELECT timing, event_type, weekday, ballrooms FROM usages "
+                                        "WHERE city = ? AND hotel = ? AND date >= ? AND date <= ? AND no_event = 0",
+                                        (city, hotel, Date(start_date).db_date, Date(end_date).db_date)).fetchall()
+            connection.execute(f"INSERT OR REPLACE INTO kpis (city, hotel, granularity, period_id, "
+                               f"{', '.join(KPI_METRICS)}) VALUES ({', '.join('?' * (len(KPI_METRICS) + 4))})",
+                               (city, hotel, granularity, period_id, *kpi_row(usages)))
+
+    def get_kpi_values(self, city: str, hotels: List[str], granularity: str, period_ids: List[str], metric: str,
+                       ballroom_counts: Dict[str, int]) -> List[list]:
+        # Returns [[hotel, value]] in the order of the hotels. Period ids of the same granularity are added up.
+        column, timings = OCCUPANCY_METRICS.get(metric, (metric, 0))
+        if column not in KPI_METRICS:
+            raise ValueError(f"Invalid KPI metric {metric}")
+        with closing(self.connect()) as connection:
+            rows = connection.execute(f"SELECT hotel, SUM({column}) AS value FROM kpis WHERE city = ? "
+                                      f"AND granularity = ? AND period_id IN ({', '.join('?' * len(period_ids))}) "
+                                      f"AND hotel IN ({', '.join('?' * len(hotels))}) GROUP BY hotel",
+                                      (city, granularity, *period_ids, *hotels)).fetchall()
+        values = {row["hotel"]: row["value"] for row in rows}
+        if not timings:
+            return [[hotel, values.get(hotel, 0)] for hotel in hotels]
+        timing_count = timings * sum(period_days(granularity, period_id) for period_id in period_ids)
+        return [[hotel, values.get(hotel, 0) / (timing_count * ballroom_counts[hotel])
+                 if ballroom_counts.get(hotel) else 0] for hotel in hotels]
+
+    def sync_in_background(self) -> None:
+        if self._sync_lock.locked():
+            return
+        threading.Thread(target=self.sync, daemon=True).start()
+
+    def is_fresh(self) -> bool:
+        synced_at = self.synced_at
+        return bool(synced_at) and (utc_now() - synced_at).total_seconds() <= Config.REPLICA_MAX_AGE
+
+    def covers(self, end_date: dt.date) -> bool:
+        # Only closed periods (before the previous lock in) are served from the replica
+        if not Config.REPLICA_ENABLED or not end_date or end_date > Date.previous_lock_in():
+            return False
+        if not self.is_fresh():
+            self.sync_in_background()
+            return False
+        if self._sync_lock.locked():
+            return False
+        # The changes since the last sync are replayed first, so that an edit of a closed period is in the usages and
+        # the KPIs of its periods as soon as it is committed. Without new changes this is a single Firestore query.
+        self.sync()
+        return True
+
+    def _usage_query(self, city: str, hotels: List[str], start_date: str, end_date: str,
+                     filters: dict) -> Tuple[str, list]:
+        sql = f"SELECT * FROM usages WHERE city = ? AND hotel IN ({', '.join('?' * len(hotels))}) " \
+              f"AND date >= ? AND date <= ?"
+        parameters = [city, *hotels, start_date, end_date]
+        for column, value in filters.items():
+            if column not in self.USAGE_FILTERS:
+                raise ValueError(f"Invalid usage filter {column}")
+            sql += f" AND {column} = ?"
+            parameters.append(int(value) if isinstance(value, bool) else value)
+        return sql, parameters
+
+    def get_usages(self, city: str, hotels: List[str], start_date: str, end_date: str, **filters) -> List[Usage]:
+        sql, parameters = self._usage_query(city, hotels, start_date, end_date, filters)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        return [row_to_usage(row) for row in rows]
+
+    def iter_usages(self, city: str, hotels: List[str], start_date: str, end_date: str, **filters) -> Iterator[Usage]:
+        # Usages in the order of the reports (date and then morning before evening) fetched from the cursor as they
+        # are consumed
+        sql, parameters = self._usage_query(city, hotels, start_date, end_date, filters)
+        with closing(self.connect()) as connection:
+            for row in connection.execute(f"{sql} ORDER BY date, timing DESC", parameters):
+                yield row_to_usage(row)
+
+
+replica = Replica(Config.REPLICA_PATH)
@@ -1,6 +1,7 @@
-from typing import Callable, List
+from typing import Callable, List, Tuple, NamedTuple
 
 from config import Config
+from fs_flask.date_methods import Days
 from fs_flask.usage import Usage
 
 
@@ -10,13 +11,31 @@ class QueryAttribute:
     DAYS = "days"
     WEEKLY = "weekly"
     MONTHLY = "monthly"
+    BUNDLE = "bundle"
 
     def __init__(self, name: str, nav_method: Callable = None, comp_set: str = str(),
-                 period: str = str()):
+                 period: str = str(), archive: bool = False):
         self.name: str = name
         self.nav_method: Callable = nav_method
         self.comp_set: str = comp_set
         self.period: str = period
+        self.archive: bool = archive  # Bundle as a zip of workbooks instead of sheets of one workbook
+
+
+class ReportWindow(NamedTuple):
+    # Date range of a single report. Saaya days are a list of dates within the month.
+    period: str
+    period_tag: str
+    short_title: str
+    start_date: str
+    end_date: str
+    day_counts: Days
+    date_list: Tuple[str, ...] = tuple()
+
+    def select(self, usages: List[Usage]) -> List[Usage]:
+        if self.date_list:
+            return [u for u in usages if u.date in self.date_list]
+        return [u for u in usages if self.start_date <= u.date <= self.end_date]
 
 
 class DataAttribute:
@@ -71,157 +90,133 @@ class ReportAttribute:
 
     # Data type
 
-    def __init__(self, name: str, sheet_range: str, sheet: str, event: str, cache_to: str = str(),
-                 cache_from: str = str(), occupancy: bool = False):
+    def __init__(self, name: str, sheet_range: str, sheet: str, event: str, occupancy: bool = False):
         self.name = name
         self.range = sheet_range
         self.sheet = sheet
         self.event = event
-        self.cache_to = cache_to
-        self.cache_from = cache_from
         self.occupancy = occupancy
 
 
-def get_report_attributes() -> List[ReportAttribute]:
-    return [
-        ReportAttribute(name=ReportTag.FULL_DAY_OCCUPANCY_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.FULL_DAY,
-                        cache_to=ReportTag.FULL_DAY_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!F32:G41"
-                        ),
-        ReportAttribute(name=ReportTag.FULL_DAY_OCCUPANCY_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.FULL_DAY,
-                        cache_from=ReportTag.FULL_DAY_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A5:E5"
-                        ),
-        ReportAttribute(name=ReportTag.MORNING_OCCUPANCY_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.MORNING,
-                        cache_to=ReportTag.MORNING_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!J18:K27"
-                        ),
-        ReportAttribute(name=ReportTag.MORNING_OCCUPANCY_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.MORNING,
-                        cache_from=ReportTag.MORNING_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A9:E9"
-                        ),
-        ReportAttribute(name=ReportTag.EVENING_OCCUPANCY_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.EVENING,
-                        cache_to=ReportTag.EVENING_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!M18:N27"
-                        ),
-        ReportAttribute(name=ReportTag.EVENING_OCCUPANCY_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.EVENING,
-                        cache_from=ReportTag.EVENING_OCCUPANCY_DATA_POINT,
-                        occupancy=True,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A13:E13"
-                        ),
-        ReportAttribute(name=ReportTag.FULL_DAY_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.FULL_DAY,
-                        cache_to=ReportTag.FULL_DAY_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!A2:B11"
-                        ),
-        ReportAttribute(name=ReportTag.FULL_DAY_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.FULL_DAY,
-                        cache_from=ReportTag.FULL_DAY_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A17:D17"
-                        ),
-        ReportAttribute(name=ReportTag.MORNING_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.MORNING,
-                        cache_to=ReportTag.MORNING_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!A18:B27"
-                        ),
-        ReportAttribute(name=ReportTag.MORNING_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.MORNING,
-                        cache_from=ReportTag.MORNING_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A21:D21"
-                        ),
-        ReportAttribute(name=ReportTag.EVENING_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.EVENING,
-                        cache_to=ReportTag.EVENING_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!E2:F11"
-                        ),
-        ReportAttribute(name=ReportTag.EVENING_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.EVENING,
-                        cache_from=ReportTag.EVENING_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A25:D25"
-                        ),
-        ReportAttribute(name=ReportTag.CORPORATE_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.CORPORATE,
-                        cache_to=ReportTag.CORPORATE_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!J3:K12"
-                        ),
-        ReportAttribute(name=ReportTag.CORPORATE_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.CORPORATE,
-                        cache_from=ReportTag.CORPORATE_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A29:D29"
-                        ),
-        ReportAttribute(name=ReportTag.SOCIAL_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.SOCIAL,
-                        cache_to=ReportTag.SOCIAL_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!R3:S12"
-                        ),
-        ReportAttribute(name=ReportTag.SOCIAL_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.SOCIAL,
-                        cache_from=ReportTag.SOCIAL_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A33:D33"
-                        ),
-        ReportAttribute(name=ReportTag.WEEKDAY_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.WEEKDAY,
-                        cache_to=ReportTag.WEEKDAY_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!F18:E27"
-                        ),
-        ReportAttribute(name=ReportTag.WEEKDAY_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.WEEKDAY,
-                        cache_from=ReportTag.WEEKDAY_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A37:D37"
-                        ),
-        ReportAttribute(name=ReportTag.WEEKEND_EVENTS_BAR_GRAPH,
-                        sheet=ReportAttribute.BAR_GRAPH,
-                        event=ReportAttribute.WEEKEND,
-                        cache_to=ReportTag.WEEKEND_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!R18:S27"
-                        ),
-        ReportAttribute(name=ReportTag.WEEKEND_EVENTS_DATA_POINT,
-                        sheet=ReportAttribute.DATA_POINT,
-                        event=ReportAttribute.WEEKEND,
-                        cache_from=ReportTag.WEEKEND_EVENTS_DATA_POINT,
-                        occupancy=False,
-                        sheet_range=f"'{ReportAttribute.DATA_POINT}'!A41:D41"
-                        ),
-    ]
+REPORT_ATTRIBUTES: Tuple[ReportAttribute, ...] = (
+    ReportAttribute(name=ReportTag.FULL_DAY_OCCUPANCY_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.FULL_DAY,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!F32:G41"
+                    ),
+    ReportAttribute(name=ReportTag.FULL_DAY_OCCUPANCY_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.FULL_DAY,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A5:E5"
+                    ),
+    ReportAttribute(name=ReportTag.MORNING_OCCUPANCY_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.MORNING,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!J18:K27"
+                    ),
+    ReportAttribute(name=ReportTag.MORNING_OCCUPANCY_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.MORNING,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A9:E9"
+                    ),
+    ReportAttribute(name=ReportTag.EVENING_OCCUPANCY_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.EVENING,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!M18:N27"
+                    ),
+    ReportAttribute(name=ReportTag.EVENING_OCCUPANCY_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.EVENING,
+                    occupancy=True,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A13:E13"
+                    ),
+    ReportAttribute(name=ReportTag.FULL_DAY_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.FULL_DAY,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!A2:B11"
+                    ),
+    ReportAttribute(name=ReportTag.FULL_DAY_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.FULL_DAY,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A17:D17"
+                    ),
+    ReportAttribute(name=ReportTag.MORNING_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.MORNING,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!A18:B27"
+                    ),
+    ReportAttribute(name=ReportTag.MORNING_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.MORNING,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A21:D21"
+                    ),
+    ReportAttribute(name=ReportTag.EVENING_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.EVENING,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!E2:F11"
+                    ),
+    ReportAttribute(name=ReportTag.EVENING_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.EVENING,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A25:D25"
+                    ),
+    ReportAttribute(name=ReportTag.CORPORATE_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.CORPORATE,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!J3:K12"
+                    ),
+    ReportAttribute(name=ReportTag.CORPORATE_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.CORPORATE,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A29:D29"
+                    ),
+    ReportAttribute(name=ReportTag.SOCIAL_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.SOCIAL,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!R3:S12"
+                    ),
+    ReportAttribute(name=ReportTag.SOCIAL_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.SOCIAL,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A33:D33"
+                    ),
+    ReportAttribute(name=ReportTag.WEEKDAY_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.WEEKDAY,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!F18:E27"
+                    ),
+    ReportAttribute(name=ReportTag.WEEKDAY_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.WEEKDAY,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A37:D37"
+                    ),
+    ReportAttribute(name=ReportTag.WEEKEND_EVENTS_BAR_GRAPH,
+                    sheet=ReportAttribute.BAR_GRAPH,
+                    event=ReportAttribute.WEEKEND,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.BAR_GRAPH}'!R18:S27"
+                    ),
+    ReportAttribute(name=ReportTag.WEEKEND_EVENTS_DATA_POINT,
+                    sheet=ReportAttribute.DATA_POINT,
+                    event=ReportAttribute.WEEKEND,
+                    occupancy=False,
+                    sheet_range=f"'{ReportAttribute.DATA_POINT}'!A41:D41"
+                    ),
+)
@@ -1,17 +1,24 @@
+import datetime as dt
 from itertools import groupby
-from operator import itemgetter
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from uuid import uuid4
+from zipfile import ZipFile, ZIP_DEFLATED
 
 from flask_login import current_user
 
-from config import Config
-from fs_flask.date_methods import get_db_date_range_for_week, get_db_date_range_for_month, get_db_date_list_for_days, \
+from config import Config, Date
+from fs_flask.date_methods import get_db_date_range_for_month, get_db_date_list_for_days, get_db_date, \
     get_days_count_from_month, get_days_count_from_days, Days, format_start_end_date_from_month, format_days, \
-    unpack_week_range
+    unpack_week_range, format_weeks_from_month
 from fs_flask.file import File, RangeValues
+from fs_flask.file_cache import file_cache
 from fs_flask.hotel import Hotel
-from fs_flask.report_helpers import QueryAttribute, DataAttribute, ReportAttribute, get_report_attributes
+from fs_flask.replica import replica, DAY, WEEK, MONTH
+from fs_flask.report_helpers import QueryAttribute, DataAttribute, ReportAttribute, ReportWindow
+from fs_flask.report_plan import REPORT_PLAN, PlanNode, BY_HOTEL, OCCUPANCY
+from fs_flask.template_pool import template_pool
 from fs_flask.usage import Usage
+from fs_flask.user import User
 
 
 def execute_report_action(query_tag: str, my_hotel: Hotel, days: List[int]) -> tuple:
@@ -19,109 +26,88 @@ def execute_report_action(query_tag: str, my_hotel: Hotel, days: List[int]) -> t
     # Navigation Methods
     if action.nav_method:
         if action.name == QueryTag.UPDATE_DAYS:
-            action.nav_method(days)
+            action.nav_method(current_user, days)
         else:
-            action.nav_method()
+            action.nav_method(current_user)
         current_user.save()
         return None, None
 
-    # Init copy of template sheet
-    sheet = File(Config.TEMPLATE_SHEET_ID, "xlsx")
-    sheet.async_copy()
+    compset_tag = "Primary" if action.comp_set == QueryAttribute.PRIMARY else "Secondary"
+    comp_set: List[str] = getattr(my_hotel, action.comp_set)
+    windows: List[ReportWindow] = get_bundle_windows() if action.period == QueryAttribute.BUNDLE \
+        else [get_report_window(action.period)]
 
-    # Get period string
-    def get_title(period_tag: str) -> str:
-        return f"{compset_tag} Compset - {current_user.report_month} {period_tag} Performance Data"
+    # Get Usages from db for all the windows in a single query. Closed periods are read from the replica.
+    start_date = min(window.start_date for window in windows)
+    end_date = max(window.end_date for window in windows)
+    from_replica = replica.covers(Date(end_date).date)
+    usages: List[Usage] = get_usages_from_query(comp_set, start_date, end_date, from_replica)
 
-    compset_tag = "Primary" if action.comp_set == QueryAttribute.PRIMARY else "Secondary"
-    if action.period == QueryAttribute.WEEKLY:
-        period = current_user.report_week
-        title = get_title("Month Weekly")
-        week_number, _, _ = unpack_week_range(period)
-        short_title = f"Week {week_number}"
-    elif action.period == QueryAttribute.MONTHLY:
-        period = format_start_end_date_from_month(current_user.report_month, current_user.report_year)
-        title = get_title("Monthly")
-        short_title = "Monthly"
+    # Get ballroom count for each hotel which is used by occupancy report
+    hotels: List[Hotel] = Hotel.objects.filter("name", Hotel.objects.IN, comp_set).get() if comp_set else list()
+    ballroom_info: dict = {my_hotel.name: my_hotel.ballroom_count}
+    for hotel in hotels:
+        ballroom_info[hotel.name] = hotel.ballroom_count
+
+    def get_filename(short_title: str, extension: str) -> str:
+        return f"BQT Analytics - {my_hotel.name} -  {compset_tag} Compset - {current_user.report_month} " \
+               f"{current_user.report_year} - {short_title}.{extension}"
+
+    def get_window_ranges(window: ReportWindow) -> List[dict]:
+        return get_report_ranges(window, my_hotel, comp_set, compset_tag, window.select(usages), ballroom_info,
+                                 from_replica)
+
+    # Separate workbook for every window in a zip
+    if action.archive:
+        zip_filename = f"{uuid4()}.zip"
+        zip_path = file_cache.local_path(zip_filename)
+        with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+            for window in windows:
+                new_sheet: File = template_pool.take()
+                new_sheet.update_bulk_range(get_window_ranges(window))
+                file_path = new_sheet.download_from_drive()
+                new_sheet.delete_sheet()
+                zip_file.write(file_path, get_filename(window.short_title, new_sheet.extension))
+                file_cache.evict(new_sheet.filename)
+        file_cache.put(zip_filename)
+        return zip_path, get_filename("Bundle", "zip")
+
+    # Update Ranges in the new copied sheet and download it. A bundle has a set of sheets for each window.
+    new_sheet: File = template_pool.take()
+    if len(windows) == 1:
+        update_ranges = get_window_ranges(windows[0])
     else:
-        period = format_days(current_user.report_month, current_user.report_year, current_user.report_days)
-        title = get_title("Month Saaya Days")
-        short_title = "Saaya Days"
+        new_sheet.duplicate_sheets([window.short_title for window in windows])
+        update_ranges = [dict(range_values, range=f"'{window.short_title} {range_values['range'][1:]}")
+                         for window in windows for range_values in get_window_ranges(window)]
+    new_sheet.update_bulk_range(update_ranges)
+    file_path = new_sheet.download_from_drive()
+    new_sheet.delete_sheet()
+    short_title = windows[0].short_title if len(windows) == 1 else "Bundle"
+    return file_path, get_filename(short_title, new_sheet.extension)
 
+
+def get_report_ranges(window: ReportWindow, my_hotel: Hotel, comp_set: List[str], compset_tag: str,
+                      usages: List[Usage], ballroom_info: dict, from_replica: bool = False) -> List[dict]:
     # Update title
-    comp_set: List[str] = getattr(my_hotel, action.comp_set)
-    title = f"{title}\n({period})"
+    title = f"{compset_tag} Compset - {current_user.report_month} {window.period_tag} Performance Data"
+    title = f"{title}\n({window.period})"
     subtitle = f"My Property: {my_hotel.name}\nComp Set: {', '.join(comp_set)}"
     update_ranges: List[dict] = list()
     update_ranges.append(RangeValues(f"'{ReportAttribute.DATA_POINT}'!A1:A2", [[title], [subtitle]]).to_dict())
 
-    # Get Usages from db
-    usages: List[Usage] = get_usages_from_query(action, comp_set)
-
     # Start of Event Reports
-    # Get ballroom count for each hotel which is used by occupancy report
-    hotels: List[Hotel] = Hotel.objects.filter("name", Hotel.objects.IN, comp_set).get() if comp_set else list()
-    ballroom_info: dict = {my_hotel.name: my_hotel.ballroom_count}
-    for hotel in hotels:
-        ballroom_info[hotel.name] = hotel.ballroom_count
-    # Get total days for data attributes
-    day_counts: Days = get_days_from_period(action.period)
     # Filter data for data attributes
-    full_day_events = usages
-    morning_events = [u for u in usages if u.timing == Config.MORNING]
-    evening_events = [u for u in usages if u.timing == Config.EVENING]
-    corp_events = [u for u in usages if u.event_type == Config.MICE]
-    social_events = [u for u in usages if u.event_type == Config.SOCIAL]
-    weekday_events = [u for u in usages if u.weekday]
-    weekend_events = [u for u in usages if not u.weekday]
-    # Setup data attributes
     data: Dict[str, DataAttribute] = dict()
-    data[ReportAttribute.FULL_DAY] = DataAttribute(full_day_events, current_user.hotel, comp_set, day_counts.total_days)
-    data[ReportAttribute.MORNING] = DataAttribute(morning_events, current_user.hotel, comp_set,
-                                                  day_counts.total_days / 2)
-    data[ReportAttribute.EVENING] = DataAttribute(evening_events, current_user.hotel, comp_set,
-                                                  day_counts.total_days / 2)
-    data[ReportAttribute.CORPORATE] = DataAttribute(corp_events, current_user.hotel, comp_set, day_counts.total_days)
-    data[ReportAttribute.SOCIAL] = DataAttribute(social_events, current_user.hotel, comp_set, day_counts.total_days)
-    data[ReportAttribute.WEEKDAY] = DataAttribute(weekday_events, current_user.hotel, comp_set, day_counts.week_days)
-    data[ReportAttribute.WEEKEND] = DataAttribute(weekend_events, current_user.hotel, comp_set, day_counts.weekend_days)
-    # Occupancy & Event Report
-    cache: dict = dict()
-    for report_attr in get_report_attributes():
-        my_prop_data: List[Usage] = data[report_attr.event].my_prop
-        comp_set_data: List[Usage] = data[report_attr.event].comp_set
-        if not report_attr.occupancy:
-            if not report_attr.cache_from:
-                values = [[my_hotel.name, len(my_prop_data)]]
-                values.extend([[hotel_name, sum(1 for u in comp_set_data if u.hotel == hotel_name)]
-                               for hotel_name in comp_set])
-                if report_attr.cache_to:
-                    cache[report_attr.cache_to] = values
-            else:  # cache is available
-                values = cache[report_attr.cache_from]
-            if report_attr.sheet == ReportAttribute.DATA_POINT:
-                values = get_data_point_values(values, len(comp_set), period)
-        else:  # Occupancy Reports
-            if not report_attr.cache_from:
-                timing_count = data[report_attr.event].timing_count
-                my_value = get_occupancy_values(my_prop_data, my_hotel.name, timing_count, ballroom_info[my_hotel.name])
-                values = [my_value]
-                values.extend([get_occupancy_values(comp_set_data, hotel_name, timing_count, ballroom_info[hotel_name])
-                               for hotel_name in comp_set])
-                if report_attr.cache_to:
-                    cache[report_attr.cache_to] = values
-            else:  # cache is available
-                values = cache[report_attr.cache_from]
-            if report_attr.sheet == ReportAttribute.DATA_POINT:
-                # noinspection PyTypeChecker
-                aggregate_value: float = sum(value[1] for value in values) / (len(comp_set) + 1)
-                mpi_index: float = values[0][1] / aggregate_value if aggregate_value > 0 else 0
-                values = get_data_point_values(values, len(comp_set), period)
-                values[0].append(mpi_index)
-        if report_attr.sheet == ReportAttribute.BAR_GRAPH:
-            values = [value[:] for value in values]
-            values.extend([[str(), str()]] * (9 - len(comp_set)))
-        update_ranges.append(RangeValues(report_attr.range, values).to_dict())
+    data[ReportAttribute.FULL_DAY] = DataAttribute(usages, my_hotel.name, comp_set, window.day_counts.total_days)
+    data[ReportAttribute.CORPORATE] = DataAttribute([u for u in usages if u.event_type == Config.MICE],
+                                                    my_hotel.name, comp_set, window.day_counts.total_days)
+    # Occupancy & Event Report of every report attribute from the compiled report plan
+    hotels = [my_hotel.name] + comp_set
+    if from_replica and REPORT_PLAN.replica_ready:
+        update_ranges.extend(get_replica_ranges(window, hotels, ballroom_info))
+    else:
+        update_ranges.extend(REPORT_PLAN.execute(usages, hotels, ballroom_info, window.day_counts, window.period))
 
     # Update Reader Board data
     def sort_events(event_data: List[Usage]) -> None:
@@ -173,70 +159,109 @@ def execute_report_action(query_tag: str, my_hotel: Hotel, days: List[int]) -> t
     top5_range = f"'{ReportAttribute.TOP5}'!A1:D{len(top5_report)}"
     update_ranges.append(RangeValues(top5_range, top5_report).to_dict())
 
-    # Update Ranges in the new copied sheet and download it
-    new_sheet: File = sheet.await_copy()
-    new_sheet.update_bulk_range(update_ranges)
-    file_path = new_sheet.download_from_drive()
-    new_sheet.delete_sheet()
-    filename = f"BQT Analytics - {my_hotel.name} -  {compset_tag} Compset - {current_user.report_month} " \
-               f"{current_user.report_year} - {short_title}.{new_sheet.extension}"
-    return file_path, filename
+    return update_ranges
+
+
+def get_replica_ranges(window: ReportWindow, hotels: List[str], ballroom_info: dict) -> List[dict]:
+    # Occupancy & Event Report of a closed period from the materialized KPIs of the replica without the usages
+    granularity, period_ids = get_kpi_periods(window)
+    metric_values: Dict[str, List[list]] = dict()
+    results: Dict[PlanNode, List[list]] = dict()
+    for node in REPORT_PLAN.nodes:
+        if node.replica_metric not in metric_values:
+            metric_values[node.replica_metric] = replica.get_kpi_values(current_user.city, hotels, granularity,
+                                                                        period_ids, node.replica_metric, ballroom_info)
+        values = metric_values[node.replica_metric]
+        results[node] = values if node.grouping == BY_HOTEL \
+            else get_data_point_values(values, len(hotels) - 1, window.period, node.metric == OCCUPANCY)
+    return REPORT_PLAN.get_ranges(results, len(hotels))
+
 
+def get_kpi_periods(window: ReportWindow) -> Tuple[str, List[str]]:
+    # KPI periods which make up the window. A month or a week starting on Monday is read as a single period.
+    if window.date_list:
+        return DAY, list(window.date_list)
+    start_date, end_date = Date(window.start_date).date, Date(window.end_date).date
+    days = (end_date - start_date).days + 1
+    if start_date.day == 1 and (end_date + dt.timedelta(days=1)).day == 1 and start_date.month == end_date.month:
+        return MONTH, [start_date.strftime("%Y-%m")]
+    if start_date.weekday() == 0 and days == 7:
+        return WEEK, [window.start_date]
+    return DAY, [Date(start_date + dt.timedelta(days=day)).db_date for day in range(days)]
 
-def get_usages_from_query(action: QueryAttribute, comp_set: List[str]) -> List[Usage]:
+
+def get_usages_from_query(comp_set: List[str], start_date: str, end_date: str,
+                          from_replica: bool = False) -> List[Usage]:
     hotel_names: List[str] = comp_set[:]
     hotel_names.append(current_user.hotel)
-    if action.period == QueryAttribute.WEEKLY:
-        start_date, end_date = get_db_date_range_for_week(current_user.report_week)
-    else:
-        start_date, end_date = get_db_date_range_for_month(current_user.report_month, current_user.report_year)
+    if from_replica:
+        return replica.get_usages(current_user.city, hotel_names, start_date, end_date, no_event=False)
     query = Usage.objects.filter_by(city=current_user.city, no_event=False)
     query = query.filter("hotel", query.IN, hotel_names)
     query = query.filter("date", query.GREATER_THAN_OR_EQUAL, start_date)
     query = query.filter("date", query.LESS_THAN_OR_EQUAL, end_date)
-    usages: List[Usage] = query.get()
-    if action.period == QueryAttribute.DAYS:
-        date_list = get_db_date_list_for_days(current_user.report_days, current_user.report_month,
-                                              current_user.report_year)
-        usages = [u for u in usages if u.date in date_list]
-    return usages
+    return query.get()
+
+
+def get_weekly_window(week_range: str) -> ReportWindow:
+    week_number, start_date, end_date = unpack_week_range(week_range)
+    return ReportWindow(week_range, "Month Weekly", f"Week {week_number}", get_db_date(start_date),
+                        get_db_date(end_date), Days(total_days=7, weekend_days=2, week_days=5))
+
+
+def get_monthly_window(month: str, year: int) -> ReportWindow:
+    start_date, end_date = get_db_date_range_for_month(month, year)
+    return ReportWindow(format_start_end_date_from_month(month, year), "Monthly", "Monthly", start_date, end_date,
+                        get_days_count_from_month(month, year))
 
 
-def get_occupancy_values(usages: List[Usage], hotel_name: str, timing_count: int, ballroom_count: int) -> list:
-    occupied = sum(len(u.ballrooms) for u in usages if u.hotel == hotel_name)
-    total = timing_count * ballroom_count
-    occupancy: float = occupied / total
-    return [hotel_name, occupancy]
+def get_days_window(days: List[str], month: str, year: int) -> ReportWindow:
+    start_date, end_date = get_db_date_range_for_month(month, year)
+    return ReportWindow(format_days(month, year, days), "Month Saaya Days", "Saaya Days", start_date, end_date,
+                        get_days_count_from_days(days, month, year),
+                        tuple(get_db_date_list_for_days(days, month, year)))
+
+
+def get_report_window(period: str) -> ReportWindow:
+    if period == QueryAttribute.WEEKLY:
+        return get_weekly_window(current_user.report_week)
+    elif period == QueryAttribute.MONTHLY:
+        return get_monthly_window(current_user.report_month, current_user.report_year)
+    return get_days_window(current_user.report_days, current_user.report_month, current_user.report_year)
+
+
+def get_bundle_windows() -> List[ReportWindow]:
+    # Monthly, every week starting in the month and the Saaya days (if any) of the report month
+    month, year = current_user.report_month, current_user.report_year
+    windows: List[ReportWindow] = [get_monthly_window(month, year)]
+    windows.extend(get_weekly_window(week_range) for week_range in format_weeks_from_month(month, year))
+    if current_user.report_days:
+        windows.append(get_days_window(current_user.report_days, month, year))
+    return windows
 
 
 def rank_values(values: List[list]) -> List[list]:
-    sorted_values = sorted(values, key=itemgetter(1), reverse=True)
-    previous_value = previous_rank = 0
-    ranked_values = [value[:] for value in values]
+    # Equal values share a rank and the next rank is skipped. When every value is 0 the hotels are not ranked (rank 0).
+    if all(value[1] == 0 for value in values):
+        return [value + [0] for value in values]
+    sorted_values = sorted((value[1] for value in values), reverse=True)
+    ranks: dict = dict()
     for index, value in enumerate(sorted_values):
-        rank = previous_rank if value[1] == previous_value else index + 1
-        previous_value, previous_rank = value[1], rank
-        hotel_value = next(r for r in ranked_values if r[0] == value[0])
-        hotel_value.append(rank)
-    return ranked_values
+        ranks.setdefault(value, index + 1)
+    return [value + [ranks[value[1]]] for value in values]
 
 
-def get_data_point_values(values: List[list], comp_set_count: int, period: str) -> list:
+def get_data_point_values(values: List[list], comp_set_count: int, period: str, occupancy: bool = False) -> list:
+    # Returns [[period, my value, comp set average, my rank]] with the MPI index appended for occupancy
     my_prop_value: float = values[0][1]
     comp_set_value: float = sum(value[1] for value in values[1:]) / comp_set_count if comp_set_count > 0 else 0
     ranked_values = rank_values(values)
     my_rank = ranked_values[0][2]
-    return [[period, my_prop_value, comp_set_value, my_rank]]
-
-
-def get_days_from_period(period: str) -> Days:
-    if period == QueryAttribute.WEEKLY:
-        return Days(total_days=7, weekend_days=2, week_days=5)
-    elif period == QueryAttribute.MONTHLY:
-        return get_days_count_from_month(current_user.report_month, current_user.report_year)
-    elif period == QueryAttribute.DAYS:
-        return get_days_count_from_days(current_user.report_days, current_user.report_month, current_user.report_year)
-    return Days()
+    if not occupancy:
+        return [[period, my_prop_value, comp_set_value, my_rank]]
+    aggregate_value: float = sum(value[1] for value in values) / len(values)
+    mpi_index: float = my_prop_value / aggregate_value if aggregate_value > 0 else 0
+    return [[period, my_prop_value, comp_set_value, my_rank, mpi_index]]
 
 
 def update_top5_message(top5_values: list, hotel_name: str, message: str) -> None:
@@ -251,6 +276,10 @@ class QueryTag:
     SECONDARY_WEEKLY = "secondary_weekly"
     SECONDARY_MONTHLY = "secondary_monthly"
     SECONDARY_DAYS = "secondary_days"
+    PRIMARY_BUNDLE = "primary_bundle"
+    SECONDARY_BUNDLE = "secondary_bundle"
+    PRIMARY_BUNDLE_ZIP = "primary_bundle_zip"
+    SECONDARY_BUNDLE_ZIP = "secondary_bundle_zip"
     NEXT_WEEK = "next_week"
     PREVIOUS_WEEK = "previous_week"
     NEXT_MONTH = "next_month"
@@ -261,23 +290,30 @@ class QueryTag:
     UPDATE_DAYS = "update_days"
 
 
+QUERY_ATTRIBUTES: Dict[str, QueryAttribute] = {attribute.name: attribute for attribute in (
+    QueryAttribute(QueryTag.PRIMARY_WEEKLY, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.WEEKLY),
+    QueryAttribute(QueryTag.SECONDARY_WEEKLY, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.WEEKLY),
+    QueryAttribute(QueryTag.PRIMARY_MONTHLY, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.MONTHLY),
+    QueryAttribute(QueryTag.SECONDARY_MONTHLY, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.MONTHLY),
+    QueryAttribute(QueryTag.PRIMARY_DAYS, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.DAYS),
+    QueryAttribute(QueryTag.SECONDARY_DAYS, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.DAYS),
+    QueryAttribute(QueryTag.PRIMARY_BUNDLE, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.BUNDLE),
+    QueryAttribute(QueryTag.SECONDARY_BUNDLE, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.BUNDLE),
+    QueryAttribute(QueryTag.PRIMARY_BUNDLE_ZIP, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.BUNDLE,
+                   archive=True),
+    QueryAttribute(QueryTag.SECONDARY_BUNDLE_ZIP, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.BUNDLE,
+                   archive=True),
+    # Navigation methods are unbound User methods which are called with the current user
+    QueryAttribute(QueryTag.NEXT_WEEK, nav_method=User.next_report_week),
+    QueryAttribute(QueryTag.PREVIOUS_WEEK, nav_method=User.previous_report_week),
+    QueryAttribute(QueryTag.NEXT_MONTH, nav_method=User.next_report_month),
+    QueryAttribute(QueryTag.PREVIOUS_MONTH, nav_method=User.previous_report_month),
+    QueryAttribute(QueryTag.NEXT_YEAR, nav_method=User.next_report_year),
+    QueryAttribute(QueryTag.PREVIOUS_YEAR, nav_method=User.previous_report_year),
+    QueryAttribute(QueryTag.DEFAULT_WEEK, nav_method=User.default_report_week),
+    QueryAttribute(QueryTag.UPDATE_DAYS, nav_method=User.update_report_days),
+)}
+
+
 def get_query_attribute(query_tag: str) -> QueryAttribute:
-    _action_attributes: List[QueryAttribute] = [
-        QueryAttribute(QueryTag.PRIMARY_WEEKLY, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.WEEKLY),
-        QueryAttribute(QueryTag.SECONDARY_WEEKLY, comp_set=QueryAttribute.SECONDARY,
-                       period=QueryAttribute.WEEKLY),
-        QueryAttribute(QueryTag.PRIMARY_MONTHLY, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.MONTHLY),
-        QueryAttribute(QueryTag.SECONDARY_MONTHLY, comp_set=QueryAttribute.SECONDARY,
-                       period=QueryAttribute.MONTHLY),
-        QueryAttribute(QueryTag.PRIMARY_DAYS, comp_set=QueryAttribute.PRIMARY, period=QueryAttribute.DAYS),
-        QueryAttribute(QueryTag.SECONDARY_DAYS, comp_set=QueryAttribute.SECONDARY, period=QueryAttribute.DAYS),
-        QueryAttribute(QueryTag.NEXT_WEEK, nav_method=current_user.next_report_week),
-        QueryAttribute(QueryTag.PREVIOUS_WEEK, nav_method=current_user.previous_report_week),
-        QueryAttribute(QueryTag.NEXT_MONTH, nav_method=current_user.next_report_month),
-        QueryAttribute(QueryTag.PREVIOUS_MONTH, nav_method=current_user.previous_report_month),
-        QueryAttribute(QueryTag.NEXT_YEAR, nav_method=current_user.next_report_year),
-        QueryAttribute(QueryTag.PREVIOUS_YEAR, nav_method=current_user.previous_report_year),
-        QueryAttribute(QueryTag.DEFAULT_WEEK, nav_method=current_user.default_report_week),
-        QueryAttribute(QueryTag.UPDATE_DAYS, nav_method=current_user.update_report_days),
-    ]
-    return next(attribute for attribute in _action_attributes if attribute.name == query_tag)
+    return QUERY_ATTRIBUTES[query_tag]
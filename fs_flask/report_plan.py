@@ -0,0 +1,81 @@
+from typing import List, Dict, Tuple, NamedTuple
+
+from fs_flask.analytics import EVENTS, KPIs, compute_kpis
+from fs_flask.date_methods import Days
+from fs_flask.file import RangeValues
+from fs_flask.report_helpers import ReportAttribute, REPORT_ATTRIBUTES
+from fs_flask.usage import Usage
+
+# Metrics
+EVENT_COUNT, OCCUPANCY = "events", "occupancy"
+# Groupings
+BY_HOTEL, SUMMARY = "by_hotel", "summary"
+# KPI metric of the replica for each (event filter, metric)
+REPLICA_METRICS: Dict[Tuple[str, str], str] = {
+    (ReportAttribute.FULL_DAY, EVENT_COUNT): "events",
+    (ReportAttribute.MORNING, EVENT_COUNT): "morning_events",
+    (ReportAttribute.EVENING, EVENT_COUNT): "evening_events",
+    (ReportAttribute.CORPORATE, EVENT_COUNT): "corporate_events",
+    (ReportAttribute.SOCIAL, EVENT_COUNT): "social_events",
+    (ReportAttribute.WEEKDAY, EVENT_COUNT): "weekday_events",
+    (ReportAttribute.WEEKEND, EVENT_COUNT): "weekend_events",
+    (ReportAttribute.FULL_DAY, OCCUPANCY): "occupancy",
+    (ReportAttribute.MORNING, OCCUPANCY): "morning_occupancy",
+    (ReportAttribute.EVENING, OCCUPANCY): "evening_occupancy",
+}
+
+
+class PlanNode(NamedTuple):
+    event: str
+    metric: str
+    grouping: str
+
+    @property
+    def replica_metric(self) -> str:
+        return REPLICA_METRICS.get((self.event, self.metric), str())
+
+
+def get_node(report_attr: ReportAttribute) -> PlanNode:
+    metric = OCCUPANCY if report_attr.occupancy else EVENT_COUNT
+    grouping = SUMMARY if report_attr.sheet == ReportAttribute.DATA_POINT else BY_HOTEL
+    return PlanNode(report_attr.event, metric, grouping)
+
+
+class ReportPlan:
+    # Report definitions compiled into distinct (event filter, metric, grouping) nodes. Each node is computed once per
+    # report irrespective of the number of ranges which read it. Only the event filters used by the nodes are counted.
+    # Nodes do not depend on each other since summaries are computed from the KPIs like the per hotel values.
+
+    def __init__(self, report_attributes: Tuple[ReportAttribute, ...]):
+        self.outputs: List[Tuple[ReportAttribute, PlanNode]] = [(report_attr, get_node(report_attr))
+                                                                for report_attr in report_attributes]
+        self.nodes: List[PlanNode] = list(dict.fromkeys(node for _, node in self.outputs))
+        used_events = {node.event for node in self.nodes}
+        self.events: Tuple[str, ...] = tuple(event for event in EVENTS if event in used_events)
+        # Closed periods are read from the materialized KPIs of the replica when it has every metric of the plan
+        self.replica_ready: bool = all(node.replica_metric for node in self.nodes)
+
+    def execute(self, usages: List[Usage], hotels: List[str], ballroom_counts: Dict[str, int], day_counts: Days,
+                period: str) -> List[dict]:
+        # Returns the range values of every report attribute. The first hotel is my property.
+        kpis: KPIs = compute_kpis(usages, hotels, ballroom_counts, day_counts, self.events)
+        results: Dict[PlanNode, List[list]] = dict()
+        for node in self.nodes:
+            occupancy = node.metric == OCCUPANCY
+            if node.grouping == BY_HOTEL:
+                results[node] = kpis.get_values(node.event, occupancy)
+            else:
+                results[node] = kpis.get_data_point_values(node.event, occupancy, period)
+        return self.get_ranges(results, len(hotels))
+
+    def get_ranges(self, results: Dict[PlanNode, List[list]], hotel_count: int) -> List[dict]:
+        update_ranges: List[dict] = list()
+        for report_attr, node in self.outputs:
+            values = [value[:] for value in results[node]]
+            if report_attr.sheet == ReportAttribute.BAR_GRAPH:
+                values.extend([[str(), str()]] * (10 - hotel_count))
+            update_ranges.append(RangeValues(report_attr.range, values).to_dict())
+        return update_ranges
+
+
+REPORT_PLAN = ReportPlan(REPORT_ATTRIBUTES)
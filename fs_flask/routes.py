@@ -1,11 +1,19 @@
+import datetime as dt
+
+import pytz
 from flask import render_template, url_for, redirect, Response, flash, send_file, request
 from flask_login import current_user
 
 from config import Config, Date
 from fs_flask import fs_app
+from fs_flask.export import stream_export
 from fs_flask.fbr_report import QueryForm, Dashboard
 from fs_flask.file import File
+from fs_flask.file_cache import file_cache
+from fs_flask.file_stream import stream_from_cloud
+from fs_flask.google_clients import transport_stats
 from fs_flask.hotel import Hotel, HotelForm, AdminForm
+from fs_flask.metrics import metrics
 from fs_flask.report_methods import QueryTag, execute_report_action
 from fs_flask.templates.forms import ReportForm
 from fs_flask.usage import Usage, UsageForm
@@ -39,6 +47,8 @@ def main_report() -> Response:
     if not form.validate_on_submit():
         form.flash_form_errors()
     form.update_data()
+    if form.export_usages:
+        return stream_export(form.export_usages, form.export_format.data, "Report")
     if form.file_path:
         return send_file(form.file_path, as_attachment=True, attachment_filename="Report.xlsx")
     return render_template("main_report.html", form=form, title="Reports")
@@ -81,6 +91,17 @@ def admin_manage() -> Response:
     return render_template("admin.html", form=form, title="Admin")
 
 
+@fs_app.route("/admin/metrics")
+@cookie_login_required
+def view_metrics() -> Response:
+    if current_user.role != Config.ADMIN:
+        flash("Insufficient privilege")
+        return redirect(url_for("view_dashboard"))
+    started_at = dt.datetime.fromtimestamp(metrics.started_at, tz=pytz.UTC).strftime("%d-%b-%Y %H:%M UTC")
+    return render_template("metrics.html", title="Metrics", rows=metrics.snapshot(), started_at=started_at,
+                           transport=transport_stats.to_dict())
+
+
 @fs_app.route("/hotels/<hotel_id>", methods=["GET", "POST"])
 @cookie_login_required
 def hotel_manage(hotel_id: str) -> Response:
@@ -136,8 +157,13 @@ def download() -> Response:
     new_filename = request.args.get("new_filename", default=str())
     new_filename = new_filename or f"{filename}.{extension}"
     file = File(filename, extension)
-    file_path = file.download_from_cloud()
-    if not file_path:
+    # Cached files are sent from the disk. Others are streamed from cloud storage and are cached only where a local
+    # copy is needed.
+    file_path = file_cache.peek(file.filename)
+    if file_path:
+        return send_file(file_path, as_attachment=attachment, attachment_filename=new_filename, conditional=True)
+    response = stream_from_cloud(File.BUCKET, file.filename, attachment, new_filename)
+    if not response:
         flash("Error in downloading")
         return redirect(request.referrer) if request.referrer else redirect(url_for("view_dashboard"))
-    return send_file(file_path, as_attachment=attachment, attachment_filename=new_filename)
+    return response
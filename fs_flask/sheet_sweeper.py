@@ -0,0 +1,167 @@
+import datetime as dt
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import List, Optional
+
+# noinspection PyPackageRequirements
+from googleapiclient.errors import HttpError
+
+from config import Config
+from fs_flask.google_clients import drive_service
+
+BATCH_SIZE = 100  # Maximum number of calls in a Drive batch request
+SPREADSHEET = "application/vnd.google-apps.spreadsheet"
+# Drive app property set on the temporary sheets i.e. copies of the template and sheets created for the reports
+TEMPORARY_PROPERTIES = {"fsTemporarySheet": "true"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (id TEXT PRIMARY KEY, created_at REAL, released_at REAL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class SheetLedger:
+    # Temporary Drive sheets which have been created by this instance and are yet to be deleted
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._created: bool = False
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._created:
+            connection.executescript(SCHEMA)
+            self._created = True
+        return connection
+
+    def register(self, sheet_id: str) -> None:
+        with closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR IGNORE INTO sheets (id, created_at) VALUES (?, ?)", (sheet_id, time.time()))
+
+    def release(self, sheet_id: str) -> None:
+        with closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO sheets (id, created_at, released_at) VALUES "
+                               "(?, COALESCE((SELECT created_at FROM sheets WHERE id = ?), ?), ?)",
+                               (sheet_id, sheet_id, time.time(), time.time()))
+
+    def due(self, stale_before: float) -> List[str]:
+        # Sheets which have been released or which were never released by a failed request
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT id FROM sheets WHERE released_at IS NOT NULL OR created_at < ?",
+                                      (stale_before,)).fetchall()
+        return [row[0] for row in rows]
+
+    def remove(self, sheet_ids: List[str]) -> None:
+        with closing(self.connect()) as connection, connection:
+            connection.executemany("DELETE FROM sheets WHERE id = ?", [(sheet_id,) for sheet_id in sheet_ids])
+
+    def get_meta(self, key: str) -> str:
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else str()
+
+    def set_meta(self, key: str, value: str) -> None:
+        with closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+class SheetSweeper:
+    # Deletes the released sheets of the ledger in Drive batch requests off the request path.
+    # Once in a while, temporary sheets left on Drive by any instance for more than orphan_age seconds are also deleted.
+    # Every instance deletes its own sheets after max_age, so orphan_age is kept well above it.
+
+    def __init__(self, ledger: SheetLedger, interval: int, max_age: int, orphan_interval: int, orphan_age: int):
+        self.ledger: SheetLedger = ledger
+        self.interval: int = interval
+        self.max_age: int = max_age
+        self.orphan_interval: int = orphan_interval
+        self.orphan_age: int = orphan_age
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        # The thread is started on first use in every worker process since threads do not survive a fork
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name="sheet-sweeper", daemon=True)
+            self._thread.start()
+
+    def register(self, sheet_id: str) -> None:
+        self.ledger.register(sheet_id)
+        self.start()
+
+    def release(self, sheet_id: str) -> None:
+        self.ledger.release(sheet_id)
+        self.start()
+        self._wake.set()
+
+    def run(self) -> None:
+        drive = drive_service()
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sweep(drive)
+                if time.time() - float(self.ledger.get_meta("orphans_swept_at") or 0) >= self.orphan_interval:
+                    self.sweep_orphans(drive)
+            except Exception as error:
+                print(f"Sheet sweeper error: {error}")
+
+    def sweep(self, drive) -> int:
+        sheet_ids = self.ledger.due(time.time() - self.max_age)
+        deleted = self.delete(drive, sheet_ids)
+        self.ledger.remove(deleted)
+        return len(deleted)
+
+    def sweep_orphans(self, drive) -> int:
+        # Only the sheets tagged at creation by this app are matched, never a sheet named like one
+        created_before = (dt.datetime.utcnow() - dt.timedelta(seconds=self.orphan_age)).strftime("%Y-%m-%dT%H:%M:%S")
+        properties = " and ".join(f"appProperties has {{ key='{key}' and value='{value}' }}"
+                                  for key, value in TEMPORARY_PROPERTIES.items())
+        query = f"'me' in owners and mimeType = '{SPREADSHEET}' and trashed = false " \
+                f"and createdTime < '{created_before}' and {properties}"
+        protected = {Config.SHEET_ID, Config.TEMPLATE_SHEET_ID}
+        sheet_ids: List[str] = list()
+        page_token = None
+        while True:
+            response = drive.files().list(q=query, fields="nextPageToken, files(id)", pageSize=1000,
+                                          pageToken=page_token).execute()
+            sheet_ids.extend(file["id"] for file in response.get("files", list()) if file["id"] not in protected)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        deleted = self.delete(drive, sheet_ids)
+        self.ledger.remove(deleted)
+        self.ledger.set_meta("orphans_swept_at", str(time.time()))
+        if deleted:
+            print(f"{len(deleted)} orphan sheets deleted")
+        return len(deleted)
+
+    @staticmethod
+    def delete(drive, sheet_ids: List[str]) -> List[str]:
+        # Returns the ids which have been deleted or which no longer exist
+        deleted: List[str] = list()
+
+        def callback(request_id: str, _, exception: Optional[HttpError]):
+            if exception and exception.resp.status != 404:
+                print(f"Error in deleting sheet ID {request_id}: {exception}")
+                return
+            deleted.append(request_id)
+
+        for index in range(0, len(sheet_ids), BATCH_SIZE):
+            batch = drive.new_batch_http_request(callback=callback)
+            for sheet_id in sheet_ids[index: index + BATCH_SIZE]:
+                batch.add(drive.files().delete(fileId=sheet_id), request_id=sheet_id)
+            batch.execute()
+        return deleted
+
+
+sheet_sweeper = SheetSweeper(SheetLedger(Config.SHEET_LEDGER_PATH), Config.SHEET_SWEEP_INTERVAL,
+                             Config.SHEET_MAX_AGE, Config.SHEET_ORPHAN_INTERVAL, Config.SHEET_ORPHAN_AGE)
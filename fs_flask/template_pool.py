@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+from config import Config
+from fs_flask.file import File
+
+
+class PooledCopy(NamedTuple):
+    sheet: File
+    version: str
+    created_at: float
+
+
+class TemplatePool:
+    # Copies of the template sheet made ahead of time so that a report does not wait for the Drive copy.
+    # The pool is refilled in the background up to the number of copies taken in the recent window (limited to size).
+    # Copies expire after max_age which is kept below the age at which the sheet sweeper deletes unreleased sheets.
+    # All the copies are discarded when the version of the template changes.
+
+    def __init__(self, template_id: str, size: int, max_age: int, window: int, interval: int):
+        self.template: File = File(template_id, "xlsx")
+        self.size: int = size
+        self.max_age: int = max_age
+        self.window: int = window
+        self.interval: int = interval
+        self.copies: Deque[PooledCopy] = deque()
+        self.taken: Deque[float] = deque()
+        self.version: str = str()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def start(self) -> None:
+        # The thread is started on first use in every worker process since threads do not survive a fork
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run, name="template-pool", daemon=True)
+            self._thread.start()
+
+    def take(self) -> File:
+        # Returns a ready copy of the template if available else copies the template now
+        if not self.size:
+            return self.template.copy_sheet()
+        self.start()
+        now = time.time()
+        pooled_copy: Optional[PooledCopy] = None
+        stale: List[PooledCopy] = list()
+        with self._lock:
+            self.taken.append(now)
+            while self.copies and not pooled_copy:
+                candidate = self.copies.popleft()
+                if now - candidate.created_at < self.max_age and candidate.version == self.version:
+                    pooled_copy = candidate
+                else:
+                    stale.append(candidate)
+        self._wake.set()
+        for candidate in stale:
+            candidate.sheet.delete_sheet()
+        return pooled_copy.sheet if pooled_copy else self.template.copy_sheet()
+
+    @property
+    def target(self) -> int:
+        with self._lock:
+            while self.taken and time.time() - self.taken[0] > self.window:
+                self.taken.popleft()
+            return min(self.size, max(1, len(self.taken)))
+
+    def get_template_version(self) -> str:
+        file = File.DRIVE.files().get(fileId=self.template.name, fields="version").execute()
+        return str(file.get("version", str()))
+
+    def discard(self, force: bool = False) -> None:
+        # Releases the expired copies (or all the copies if forced) to the sheet sweeper
+        now = time.time()
+        with self._lock:
+            expired = [pooled_copy for pooled_copy in self.copies
+                       if force or now - pooled_copy.created_at >= self.max_age]
+            for pooled_copy in expired:
+                self.copies.remove(pooled_copy)
+        for pooled_copy in expired:
+            pooled_copy.sheet.delete_sheet()
+
+    def refill(self) -> None:
+        version = self.get_template_version()
+        if version != self.version:
+            self.version = version
+            self.discard(force=True)
+        self.discard()
+        while len(self.copies) < self.target:
+            sheet = self.template.copy_sheet()
+            with self._lock:
+                self.copies.append(PooledCopy(sheet, version, time.time()))
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.refill()
+            except Exception as error:
+                print(f"Template pool error: {error}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+template_pool = TemplatePool(Config.TEMPLATE_SHEET_ID, Config.TEMPLATE_POOL_SIZE, Config.TEMPLATE_POOL_MAX_AGE,
+                             Config.TEMPLATE_POOL_WINDOW, Config.TEMPLATE_POOL_INTERVAL)
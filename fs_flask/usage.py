@@ -1,9 +1,9 @@
+import codecs
 import csv
 import datetime as dt
 import itertools
 from typing import Optional, List, Tuple
 
-from firestore_ci import FirestoreDocument
 from flask import url_for, request
 from flask_login import current_user
 from flask_wtf.file import FileAllowed
@@ -14,11 +14,11 @@ from wtforms import SelectMultipleField, ValidationError, HiddenField, \
 
 from config import Config, Date
 from fs_flask import FSForm
-from fs_flask.file import File
+from fs_flask.db_methods import TrackedDocument, batch_create
 from fs_flask.hotel import Hotel
 
 
-class Usage(FirestoreDocument):
+class Usage(TrackedDocument):
     def __init__(self):
         super().__init__()
         self.hotel: str = str()
@@ -232,12 +232,10 @@ class UsageForm(FSForm):
         file: FileStorage = filename.data
         if not secure_filename(file.filename):
             raise ValidationError("No file selected for upload")
-        file_path = File(current_user.id, "csv").local_path
-        file.save(file_path)
-        with open(file_path) as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            columns = set(csv_reader.fieldnames)
-            csv_reader = [row for row in csv_reader]
+        # The rows are decoded and validated as they are read from the uploaded file.
+        # The stream of a spooled upload has no readable() on python 3.7 and cannot be wrapped with io.TextIOWrapper.
+        csv_reader = csv.DictReader(codecs.iterdecode(file.stream, "utf-8-sig"))
+        columns = set(csv_reader.fieldnames or list())
         if columns != {HDR.DATE, HDR.TIMING, HDR.NO_EVENT, HDR.CLIENT, HDR.MEAL, HDR.TYPE, HDR.BALLROOM, HDR.EVENT}:
             raise ValidationError("Invalid column names in the csv file")
         for row in csv_reader:
@@ -359,7 +357,10 @@ class UsageForm(FSForm):
             return
         elif self.form_type.data == self.UPLOAD:
             self.hotel.set_last_entry(self.upload_data[-1].date, self.upload_data[-1].timing)
-            usages = Usage.create_from_list_of_dict([usage.doc_to_dict() for usage in self.upload_data])
+            # One batch per chunk instead of one commit per row, so that an upload is a few round trips
+            doc_ids = batch_create(Usage, [usage.doc_to_dict() for usage in self.upload_data])
+            usages = [Usage.dict_to_doc(usage.doc_to_dict(), doc_id)
+                      for usage, doc_id in zip(self.upload_data, doc_ids)]
             self.hotel.save()
             if not self.usages:
                 self.usages = [u for u in usages if Date(self.date).db_date == u.date and self.timing == u.timing]
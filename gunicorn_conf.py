@@ -0,0 +1,19 @@
+import os
+
+from gunicorn.workers.base import Worker
+
+# The app waits on Firestore and Google APIs for most of a request, so every worker serves requests in threads.
+# Threads of a worker share the pooled Google transport, the file cache and the template pool.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS") or "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY") or 1)
+threads = int(os.environ.get("GUNICORN_THREADS") or 8)
+timeout = 180  # seconds. Bundle reports wait on several Sheets exports of up to GOOGLE_TIMEOUT each.
+graceful_timeout = 30
+
+
+def post_worker_init(worker: Worker) -> None:
+    # gevent workers patch the standard library after the fork. grpc (Firestore) needs its gevent support enabled
+    # after that patch and before the first call. gevent is not in requirements.txt and must be installed for it.
+    if worker.cfg.worker_class_str == "gevent":
+        import grpc.experimental.gevent
+        grpc.experimental.gevent.init_gevent()
@@ -0,0 +1,18 @@
+import os
+
+from gunicorn.workers.base import Worker
+
+# noinspection PyUnresolvedReferences
+from gunicorn_conf import worker_class, workers, threads, timeout, graceful_timeout
+from gunicorn_conf import post_worker_init as init_worker
+
+
+def post_worker_init(worker: Worker) -> None:
+    # The memory Firestore of the worker is seeded before the worker accepts requests
+    init_worker(worker)
+    from config import Config
+    from fs_flask.memory_firestore import MEMORY
+    if Config.FIRESTORE_BACKEND != MEMORY:
+        return
+    from loadtest.seed import seed
+    seed(int(os.environ["LOADTEST_HOTELS"]), int(os.environ["LOADTEST_DAYS"]))
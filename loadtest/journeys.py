@@ -0,0 +1,163 @@
+import datetime as dt
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from config import Config, Date
+
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+TIMEOUT = 120  # seconds
+QUERY_DAYS = 30  # days of events in a main report query
+DOWNLOAD_EVERY = 5  # journeys between two bqt report downloads of a virtual user
+PASSWORD = "load-test-password"
+
+
+def user_email(index: int) -> str:
+    return f"load-test-{index + 1:02}@example.com"
+
+
+def credentials(user_count: int) -> List[Tuple[str, str]]:
+    # Users are seeded with the same password
+    return [(user_email(index), PASSWORD) for index in range(user_count)]
+
+
+class Sample:
+    def __init__(self, step: str, duration: float, ok: bool):
+        self.step: str = step
+        self.duration: float = duration  # milliseconds
+        self.ok: bool = ok
+
+
+class Recorder:
+    # Samples of all the virtual users of a run
+
+    def __init__(self):
+        self.samples: List[Sample] = list()
+        self._lock = threading.Lock()
+
+    def add(self, step: str, duration: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.append(Sample(step, duration, ok))
+
+    def by_step(self) -> Dict[str, List[Sample]]:
+        steps: Dict[str, List[Sample]] = dict()
+        for sample in self.samples:
+            steps.setdefault(sample.step, list()).append(sample)
+        return steps
+
+
+class VirtualUser:
+    # A hotel user going through the data entry, dashboard and report pages with a session of its own
+
+    def __init__(self, base_url: str, email: str, password: str, recorder: Recorder, think: float = 0.0):
+        self.base_url: str = base_url
+        self.email: str = email
+        self.password: str = password
+        self.recorder: Recorder = recorder
+        self.think: float = think
+        self.session = requests.Session()
+        self.journeys: int = 0
+        self.clients: int = 0
+
+    def request(self, step: str, method: str, path: str, expected: Tuple[int, ...] = (200,),
+                **kwargs) -> Optional[requests.Response]:
+        # Every request is timed including the download of the body. Redirects are returned and not followed.
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=TIMEOUT, allow_redirects=False,
+                                            **kwargs)
+            _ = response.content
+        except requests.RequestException:
+            self.recorder.add(step, (time.perf_counter() - start) * 1000, False)
+            return None
+        ok = response.status_code in expected
+        self.recorder.add(step, (time.perf_counter() - start) * 1000, ok)
+        if self.think:
+            time.sleep(random.uniform(0, 2 * self.think))
+        return response if ok else None
+
+    @staticmethod
+    def csrf_token(response: requests.Response) -> str:
+        match = CSRF_PATTERN.search(response.text)
+        return match.group(1) if match else str()
+
+    @staticmethod
+    def location(response: requests.Response) -> str:
+        # Only the path is kept since the redirect is made to the host in the request
+        location = response.headers.get("Location", str())
+        return "/" + location.split("/", 3)[3] if location.startswith("http") else location
+
+    def login(self) -> bool:
+        response = self.request("login_page", "GET", "/login")
+        if not response:
+            return False
+        data = {"email": self.email, "password": self.password, "csrf_token": self.csrf_token(response)}
+        return self.request("login", "POST", "/login", expected=(302,), data=data) is not None
+
+    def data_entry(self) -> None:
+        # Two events are created in the pending period and then the user moves to the next period
+        response = self.request("data_entry", "GET", "/data_entry", expected=(302,))
+        if not response:
+            return
+        path = self.location(response)
+        for _ in range(2):
+            response = self.request("usage_page", "GET", path)
+            if not response:
+                return
+            timing = path.rsplit("/", 1)[-1]
+            self.clients += 1
+            data = {"csrf_token": self.csrf_token(response), "form_type": "create",
+                    "client": f"{self.email} {self.clients}", "event_type": random.choice(Config.EVENTS),
+                    "morning_meal": random.choice([Config.BREAKFAST, Config.LUNCH]) if timing == Config.MORNING
+                    else Config.NO_MEAL,
+                    "evening_meal": random.choice([Config.HI_TEA, Config.DINNER]) if timing == Config.EVENING
+                    else Config.NO_MEAL,
+                    "ballrooms": ["Ballroom A"], "event_description": "Load test"}
+            if not self.request("usage_create", "POST", path, data=data):
+                return
+            response = self.request("data_entry", "GET", "/data_entry", expected=(302,))
+            if not response:
+                return
+            path = self.location(response)
+
+    def dashboard(self) -> None:
+        self.request("dashboard", "GET", "/dashboard")
+
+    def main_report(self) -> None:
+        response = self.request("main_report_page", "GET", "/reports/main")
+        if not response:
+            return
+        end_date = Date.today() - dt.timedelta(days=random.randint(14, 60))
+        start_date = end_date - dt.timedelta(days=QUERY_DAYS)
+        data = {"csrf_token": self.csrf_token(response), "form_type": "filter_query",
+                "hotel_select": "Primary Comp Set", "start_date": start_date.strftime("%d/%m/%Y"),
+                "end_date": end_date.strftime("%d/%m/%Y"), "timing": "All Timings", "all_meal": "All Meals",
+                "morning_meal": "All Meals", "evening_meal": "All Meals", "day": "All Days",
+                "event": "All Events", "export_format": "sheet"}
+        self.request("main_report_query", "POST", "/reports/main", data=data)
+
+    def bqt_download(self) -> None:
+        response = self.request("bqt_page", "GET", "/reports/bqt")
+        if not response:
+            return
+        data = {"csrf_token": self.csrf_token(response), "action_type": "primary_weekly", "days": ["1"]}
+        self.request("bqt_download", "POST", "/reports/bqt", data=data)
+
+    def journey(self) -> None:
+        if self.journeys == 0 and not self.login():
+            time.sleep(1)
+            return
+        self.journeys += 1
+        self.data_entry()
+        self.dashboard()
+        self.main_report()
+        if self.journeys % DOWNLOAD_EVERY == 1:
+            self.bqt_download()
+
+    def run(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            self.journey()
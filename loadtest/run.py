@@ -0,0 +1,142 @@
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Tuple, Dict
+
+import requests
+
+from loadtest.journeys import Recorder, VirtualUser, Sample, credentials
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUNICORN_CONFIG = os.path.join("loadtest", "gunicorn_conf.py")
+MEMORY = "memory"
+STARTUP_TIMEOUT = 60  # seconds for gunicorn to accept requests
+
+
+def parse_configs(configs: str) -> List[Tuple[int, int]]:
+    # "1x1,2x8" is 1 worker with 1 thread and 2 workers with 8 threads
+    return [tuple(int(number) for number in config.split("x")) for config in configs.split(",")]
+
+
+def percentile(durations: List[float], fraction: float) -> float:
+    # Nearest rank percentile of sorted durations
+    if not durations:
+        return 0.0
+    return durations[max(0, math.ceil(fraction * len(durations)) - 1)]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    durations = sorted(sample.duration for sample in samples)
+    return {"requests": len(samples), "errors": sum(1 for sample in samples if not sample.ok),
+            "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            "p50": round(percentile(durations, 0.50), 1), "p95": round(percentile(durations, 0.95), 1),
+            "p99": round(percentile(durations, 0.99), 1)}
+
+
+def environment() -> Dict[str, str]:
+    # The server uses the local stand-ins for Google APIs and never runs with the production settings.
+    # Firestore is the emulator when FIRESTORE_EMULATOR_HOST is set and the memory backend otherwise.
+    env = dict(os.environ)
+    env["GOOGLE_BACKEND"] = "local"
+    if not env.get("FIRESTORE_EMULATOR_HOST"):
+        env["FIRESTORE_BACKEND"] = MEMORY
+    env.pop("ENVIRONMENT", None)
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, threads: int, port: int) -> subprocess.Popen:
+    # gunicorn 20.0 cannot be run with python -m
+    command = [sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()", "-c", GUNICORN_CONFIG,
+               "-b", f"127.0.0.1:{port}", "-w", str(workers), "--threads", str(threads), "fs_flask:fs_app"]
+    server = subprocess.Popen(command, cwd=ROOT, env=environment(), stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=5)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def run(workers: int, threads: int, users: List[Tuple[str, str]], duration: float, think: float) -> dict:
+    port = free_port()
+    server = start_server(workers, threads, port)
+    recorder = Recorder()
+    try:
+        start = time.monotonic()
+        deadline = start + duration
+        virtual_users = [VirtualUser(f"http://127.0.0.1:{port}", email, password, recorder, think)
+                         for email, password in users]
+        user_threads = [threading.Thread(target=virtual_user.run, args=(deadline,)) for virtual_user in virtual_users]
+        for user_thread in user_threads:
+            user_thread.start()
+        for user_thread in user_threads:
+            user_thread.join()
+        elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+    result = {"workers": workers, "threads": threads, "users": len(users), **summarize(recorder.samples, elapsed)}
+    result["steps"] = {step: summarize(samples, elapsed) for step, samples in sorted(recorder.by_step().items())}
+    return result
+
+
+def print_result(result: dict) -> None:
+    print(f"\n{result['workers']} workers x {result['threads']} threads, {result['users']} users: "
+          f"{result['requests']} requests, {result['errors']} errors, {result['rps']} req/s, "
+          f"p50 {result['p50']} ms, p95 {result['p95']} ms, p99 {result['p99']} ms")
+    print(f"{'step':<20}{'requests':>10}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for step, row in result["steps"].items():
+        print(f"{step:<20}{row['requests']:>10}{row['errors']:>8}{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs user journeys against gunicorn for each worker setting")
+    parser.add_argument("--configs", default="1x1,1x8", help="workers x threads e.g. 1x1,2x8")
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per configuration")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds a user waits between requests")
+    parser.add_argument("--days", type=int, default=120, help="days of seeded events per hotel")
+    parser.add_argument("--json", help="file to save the results")
+    args = parser.parse_args()
+    configs = parse_configs(args.configs)
+    os.environ.update(environment())
+    os.environ["LOADTEST_HOTELS"], os.environ["LOADTEST_DAYS"] = str(args.users), str(args.days)
+    memory = os.environ.get("FIRESTORE_BACKEND") == MEMORY
+    if memory and any(workers > 1 for workers, _ in configs):
+        # Each worker would have its own copy of the data and the writes of one worker are not seen by the others
+        parser.error("The memory Firestore is per process. Use FIRESTORE_EMULATOR_HOST for more than one worker.")
+    results = list()
+    for workers, threads in configs:
+        # Every configuration starts from the same data entry state. The memory Firestore is seeded by the worker.
+        if memory:
+            users = credentials(args.users)
+        else:
+            from loadtest.seed import seed
+            users = seed(args.users, args.days)
+        result = run(workers, threads, users, args.duration, args.think)
+        print_result(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import datetime as dt
+import random
+from typing import List, Tuple
+
+from config import Config, Date
+from fs_flask.db_methods import batch_create
+from fs_flask.hotel import Hotel
+from fs_flask.usage import Usage
+from fs_flask.user import User
+from loadtest.journeys import PASSWORD, user_email, credentials
+
+HOTEL_PREFIX = "Load Test Hotel"
+BALLROOMS = ["Ballroom A", "Ballroom B", "Ballroom C"]
+
+
+def hotel_names(hotel_count: int) -> List[str]:
+    return [f"{HOTEL_PREFIX} {index + 1:02}" for index in range(hotel_count)]
+
+
+def random_usage(hotel: Hotel, date: dt.date, timing: str, index: int) -> dict:
+    usage = Usage()
+    usage.city = hotel.city
+    usage.hotel = hotel.name
+    usage.set_date(date)
+    usage.timing = timing
+    usage.client = f"Client {index}"
+    usage.event_type = random.choice(Config.EVENTS)
+    meals = (Config.BREAKFAST, Config.LUNCH) if timing == Config.MORNING else (Config.HI_TEA, Config.DINNER)
+    usage.meals = [random.choice(meals)]
+    usage.ballrooms = random.sample(BALLROOMS, random.randint(1, 2))
+    usage.event_description = "Load test"
+    return usage.doc_to_dict()
+
+
+def seed(hotel_count: int, days: int) -> List[Tuple[str, str]]:
+    # Creates the hotels with the events of the past days and one hotel user per hotel. The data entry is complete up
+    # to the previous lock in, so that the reports are open and the current period is left for the virtual users.
+    # Hotels which exist are reset to the same state so that every run starts from the same data.
+    # Returns the email and password of the users.
+    city = Config.DEFAULT_CITY
+    names = hotel_names(hotel_count)
+    today = Date.today()
+    first_date = today - dt.timedelta(days=days)
+    last_date = Date.previous_lock_in()
+    existing = {hotel.name: hotel for hotel in Hotel.objects.filter_by(city=city).get() if hotel.name in names}
+    for name in names:
+        hotel = existing.get(name)
+        if hotel:
+            query = Usage.objects.filter_by(city=city, hotel=name)
+            query.filter("date", ">", Date(last_date).db_date).delete()
+            hotel.last_date, hotel.last_timing = Date(last_date).db_date, Config.EVENING
+            hotel.save()
+            continue
+        hotel = Hotel(name=name, ballrooms=BALLROOMS, primary_hotels=[other for other in names if other != name],
+                      city=city)
+        hotel.ballroom_count = len(BALLROOMS)
+        hotel.set_contract(first_date, today + dt.timedelta(days=365))
+        hotel.set_last_entry(last_date, Config.EVENING)
+        hotel.create()
+        usages = [random_usage(hotel, first_date + dt.timedelta(days=day), timing, index)
+                  for day in range((last_date - first_date).days + 1)
+                  for timing in Config.TIMINGS for index in range(random.randint(1, 3))]
+        batch_create(Usage, usages)
+    for index, name in enumerate(names):
+        email = user_email(index)
+        user = User.objects.filter_by(email=email).first()
+        if not user:
+            user = User()
+            user.email = email
+            user.name = name
+            user.set_id(email.replace("@", "_").replace(".", "-"))
+        user.hotel, user.city, user.role = name, city, Config.HOTEL
+        user.set_password(PASSWORD)
+    print(f"{len(names)} hotels and users seeded in {city}")
+    return credentials(hotel_count)